@@ -2,23 +2,183 @@
 Admin action for marimo comments
 """
 from django.contrib import admin
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.db import connection
+from django.utils.html import escape
 
+from marimo_comments import constants, moderation, resolver, search, snapshots
 from marimo_comments.models import MarimoComment, MarimoCommentBucket
+from marimo_comments.util.changelist import ChangeListQuerySet
+
+
+class BucketChangeList(ChangeList):
+    """
+    Looks up the content urls of a whole page of buckets at once (see
+    resolver.get_content_object_urls) instead of a content object per row.
+    """
+
+    def get_results(self, request):
+        super(BucketChangeList, self).get_results(request)
+        urls = resolver.get_content_object_urls((bucket.content_type_id, bucket.object_id)
+                                                for bucket in self.result_list)
+        for bucket in self.result_list:
+            bucket.content_url = urls.get((bucket.content_type_id, bucket.object_id))
 
 
 class MarimoCommentBucketAdmin(admin.ModelAdmin):
 
-    list_display = ('content_object', 'content_type', 'object_id', 'originating_site',)
-    list_filter = ('originating_site', 'content_type',)
+    list_display = ('content_link', 'content_type', 'object_id', 'originating_site', 'status',)
+    list_filter = ('originating_site', 'content_type', 'status',)
+    actions = ('freeze', 'thaw',)
+
+    def queryset(self, request):
+        qs = super(MarimoCommentBucketAdmin, self).queryset(request)
+        return qs._clone(klass=ChangeListQuerySet).select_related('content_type', 'originating_site')
+
+    def get_changelist(self, request, **kwargs):
+        return BucketChangeList
+
+    def content_link(self, bucket):
+        url = bucket.content_url
+        if not url:
+            return '(deleted)' if url is None else ''
+        return '<a href="%s">%s</a>' % (escape(url), escape(url))
+    content_link.short_description = 'Content'
+    content_link.allow_tags = True
+
+    def freeze(self, request, queryset):
+        for bucket in queryset:
+            try:
+                snapshots.freeze(bucket)
+            except snapshots.NotNumbered:
+                self.message_user(request, 'Bucket %s has comments without a position, run '
+                                           'backfill_comment_positions first.' % bucket)
+    freeze.short_description = 'Freeze comments (serve a snapshot, take no new comments)'
+
+    def thaw(self, request, queryset):
+        for bucket in queryset:
+            snapshots.thaw(bucket)
+    thaw.short_description = 'Thaw comments'
 
 admin.site.register(MarimoCommentBucket, MarimoCommentBucketAdmin)
 
 
+class SearchChangeList(ChangeList):
+    """
+    Answers the search box from the full-text index (see search.py) instead
+    of an ``icontains`` scan over every comment, best match first unless a
+    column is sorted on.
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        # get_query_set runs from ChangeList.__init__, and only gets the
+        # request on Django 1.4+
+        self.request = request
+        super(SearchChangeList, self).__init__(request, *args, **kwargs)
+
+    def get_query_set(self, *args):
+        query, self.query = self.query, ''
+        try:
+            qs = super(SearchChangeList, self).get_query_set(*args)
+        finally:
+            self.query = query
+        if query:
+            comment_ids = search.search_ids(query, limit=constants.SEARCH_ADMIN_LIMIT + 1)
+            if len(comment_ids) > constants.SEARCH_ADMIN_LIMIT:
+                comment_ids = comment_ids[:constants.SEARCH_ADMIN_LIMIT]
+                self.model_admin.message_user(self.request, 'Showing the %d best matches only, refine the '
+                                                            'search to see the others.' % len(comment_ids))
+            qs = qs.filter(pk__in=comment_ids)
+            if comment_ids and ORDER_VAR not in self.params:
+                qs = qs.extra(select={'search_rank': rank_sql(MarimoComment, len(comment_ids))},
+                              select_params=comment_ids, order_by=['search_rank'])
+        return qs
+
+
+def rank_sql(model, count):
+    """ a CASE ranking the rows of ``model`` in the order of ``count`` pk params """
+    pk_column = '%s.%s' % (connection.ops.quote_name(model._meta.db_table),
+                           connection.ops.quote_name(model._meta.pk.column))
+    return 'CASE %s END' % ' '.join('WHEN %s = %%s THEN %d' % (pk_column, rank) for rank in xrange(count))
+
+
 class MarimoCommentAdmin(admin.ModelAdmin):
 
-    list_display = ('bucket', 'user', 'text', 'submit_date', 'originating_site',)
-    list_filter = ('submit_date',)
+    list_display = ('bucket', 'user', 'text', 'submit_date', 'originating_site', 'ip_address', 'is_removed',)
+    # the site choices come from the sites table, not from the comments
+    list_filter = ('bucket__originating_site', 'is_removed',)
+    date_hierarchy = 'submit_date'
+    ordering = ('-submit_date',)
 
     raw_id_fields = ('bucket', 'user',)
 
+    # only with MARIMO_COMMENTS_SEARCH, through SearchChangeList
+    search_fields = ('text',) if constants.SEARCH_ENABLED else ()
+
+    # set-based, see moderation.py; they act on everything selected, e.g. a
+    # whole date_hierarchy range with "select all"
+    actions = ('hide_comments', 'show_comments', 'delete_comments', 'hide_by_user', 'delete_by_user',
+               'hide_by_ip', 'delete_by_ip',)
+
+    def queryset(self, request):
+        # one join for every column on the page; the bucket's content type
+        # comes from the ContentType cache
+        qs = super(MarimoCommentAdmin, self).queryset(request)
+        return qs._clone(klass=ChangeListQuerySet).select_related('bucket__originating_site', 'user')
+
+    def get_changelist(self, request, **kwargs):
+        if constants.SEARCH_ENABLED:
+            return SearchChangeList
+        return super(MarimoCommentAdmin, self).get_changelist(request, **kwargs)
+
+    def get_actions(self, request):
+        actions = super(MarimoCommentAdmin, self).get_actions(request)
+        # replaced by delete_comments, which doesn't go row by row
+        if 'delete_selected' in actions:
+            del actions['delete_selected']
+        return actions
+
+    def save_model(self, request, obj, form, change):
+        super(MarimoCommentAdmin, self).save_model(request, obj, form, change)
+        if change and 'is_removed' in form.changed_data:
+            MarimoCommentBucket.objects.recount([obj.bucket_id])
+
+    def hide_comments(self, request, queryset):
+        self.message_user(request, 'Hid %d comment(s).' % moderation.hide_comments(queryset))
+    hide_comments.short_description = 'Hide selected comments'
+
+    def show_comments(self, request, queryset):
+        self.message_user(request, 'Showed %d comment(s).' % moderation.show_comments(queryset))
+    show_comments.short_description = 'Show selected comments'
+
+    def delete_comments(self, request, queryset):
+        self.message_user(request, 'Deleted %d comment(s).' % moderation.delete_comments(queryset))
+    delete_comments.short_description = 'Delete selected comments'
+
+    def _posters(self, queryset):
+        return set(queryset.order_by().values_list('user', flat=True).distinct()) - set([None])
+
+    def _addresses(self, queryset):
+        return set(queryset.order_by().values_list('ip_address', flat=True).distinct()) - set([None])
+
+    def hide_by_user(self, request, queryset):
+        comments = moderation.select_comments(users=self._posters(queryset))
+        self.message_user(request, 'Hid %d comment(s).' % moderation.hide_comments(comments))
+    hide_by_user.short_description = 'Hide every comment by the posters of the selected comments'
+
+    def delete_by_user(self, request, queryset):
+        comments = moderation.select_comments(users=self._posters(queryset))
+        self.message_user(request, 'Deleted %d comment(s).' % moderation.delete_comments(comments))
+    delete_by_user.short_description = 'Delete every comment by the posters of the selected comments'
+
+    def hide_by_ip(self, request, queryset):
+        comments = moderation.select_comments(ip_addresses=self._addresses(queryset))
+        self.message_user(request, 'Hid %d comment(s).' % moderation.hide_comments(comments))
+    hide_by_ip.short_description = 'Hide every comment from the IP addresses of the selected comments'
+
+    def delete_by_ip(self, request, queryset):
+        comments = moderation.select_comments(ip_addresses=self._addresses(queryset))
+        self.message_user(request, 'Deleted %d comment(s).' % moderation.delete_comments(comments))
+    delete_by_ip.short_description = 'Delete every comment from the IP addresses of the selected comments'
+
 admin.site.register(MarimoComment, MarimoCommentAdmin)
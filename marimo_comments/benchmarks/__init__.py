@@ -0,0 +1,7 @@
+"""
+Benchmarks for marimo comments
+
+Each module can be run on its own against the configured settings, e.g.::
+
+    DJANGO_SETTINGS_MODULE=marimo_comments.tests.settings python -m marimo_comments.benchmarks.serialization
+"""
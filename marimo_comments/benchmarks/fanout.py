@@ -0,0 +1,113 @@
+"""
+Live comment push benchmark
+
+Starts a FanoutServer in a thread, holds ``connections`` viewers subscribed to
+one bucket over server-sent events, and publishes ``messages`` comments
+through the unix socket the way ``post()`` does, one at a time. Reports how
+long each comment took to reach every viewer and the comments delivered per
+second across all of them. Needs no database; run it with
+``benchmark_comments --fanout <viewers>``. Each viewer is a file descriptor, raise
+``ulimit -n`` for more than about a thousand.
+"""
+import os
+import select
+import socket
+import tempfile
+import threading
+import time
+
+from marimo_comments import fanout
+from marimo_comments.benchmarks import hotpaths
+
+BUCKET_ID = 1
+COMMENT = {
+    'comment_href': '/entries/1/?cpage=1#c1',
+    'poster': 'marimo-bench-1',
+    'submit_date': '12:00 p.m. Apr. 1, 2011',
+    'submitted_ts': 1301659200,
+    'text': 'benchmark <b>post</b> ' * 10,
+    'comment_id': 1,
+}
+
+
+class Viewers(object):
+    """ ``connections`` event stream subscribers, counting the events each has seen """
+
+    def __init__(self, address, connections):
+        self.sockets = {}
+        for i in range(connections):
+            viewer = socket.create_connection(address)
+            viewer.sendall(('GET /events/%d HTTP/1.1\r\nHost: bench\r\n\r\n' % BUCKET_ID).encode('ascii'))
+            self.sockets[viewer.fileno()] = viewer
+        self.poller = select.poll()
+        for (fd, viewer) in self.sockets.items():
+            viewer.setblocking(0)
+            self.poller.register(fd, select.POLLIN)
+        # the stream opens with a retry field and each event ends in a
+        # blank line, so a viewer's events are its blank lines less one
+        self.seen = dict((fd, -1) for fd in self.sockets)
+        self.tails = dict((fd, b'') for fd in self.sockets)
+
+    def receive(self, expected, timeout=30):
+        """ read until every viewer has seen ``expected`` events """
+        waiting = set(fd for (fd, seen) in self.seen.items() if seen < expected)
+        deadline = time.time() + timeout
+        while waiting:
+            if time.time() > deadline:
+                raise RuntimeError('%d viewers never got event %d' % (len(waiting), expected))
+            for (fd, events) in self.poller.poll(1000):
+                try:
+                    data = self.sockets[fd].recv(65536)
+                except socket.error:
+                    continue
+                if not data:
+                    raise RuntimeError('the server hung up on a viewer')
+                # keep the last byte, a blank line may be split between reads
+                self.seen[fd] += (self.tails[fd] + data).count(b'\n\n')
+                self.tails[fd] = data[-1:]
+                if self.seen[fd] >= expected:
+                    waiting.discard(fd)
+
+    def close(self):
+        for viewer in self.sockets.values():
+            viewer.close()
+
+
+def run(connections=1000, messages=100):
+    """
+    :returns: dict with ``fanout.sse``: latency percentiles (milliseconds)
+        for a comment to reach every viewer, ``connections`` held and
+        ``messages_per_second`` delivered
+    """
+    socket_path = os.path.join(tempfile.mkdtemp(), 'fanout.sock')
+    server = fanout.FanoutServer(('127.0.0.1', 0), socket_path, keepalive=3600, poll_timeout=3600)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    viewers = None
+    try:
+        viewers = Viewers(server.address, connections)
+        viewers.receive(0)
+        channel = fanout.UnixSocketChannel(socket_path)
+
+        timings = []
+        started = time.time()
+        for i in range(messages):
+            call_started = time.time()
+            channel.send(BUCKET_ID, dict(COMMENT, comment_id=i))
+            viewers.receive(i + 1)
+            timings.append((time.time() - call_started) * 1000)
+        duration = time.time() - started
+        held = len(server.connections)
+    finally:
+        server.stop()
+        thread.join()
+        if viewers is not None:
+            viewers.close()
+        server.shutdown()
+        os.rmdir(os.path.dirname(socket_path))
+
+    summary = hotpaths.summarize(timings, [0])
+    summary['connections'] = held
+    summary['messages_per_second'] = connections * messages / duration
+    return {'fanout.sse': summary}
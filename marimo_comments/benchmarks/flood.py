@@ -0,0 +1,110 @@
+"""
+Write path load test under abusive traffic
+
+Drives ``post()`` with a stream of requests from honest posters (many users,
+each posting now and then from their own address) and measures it twice:
+honest traffic alone, then with most requests coming from a handful of
+abusers (one user hammering from one address, and a logged in bot rotating
+addresses). Flood control should turn the abusers away with cache lookups
+only, so the honest posts keep their latency and throughput while the
+rejections cost no queries. Needs the data seeded by ``hotpaths.seed``; run
+it with ``benchmark_comments --flood``.
+"""
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.db import connection, reset_queries
+from django.http import HttpRequest
+
+from marimo_comments.benchmarks import hotpaths
+
+ABUSER_ADDRESS = '203.0.113.7'
+
+
+def make_request(user, address, content_type_id, object_id, site_id):
+    request = HttpRequest()
+    request.method = 'POST'
+    request.is_ajax = lambda: True
+    request.user = user
+    request.META['REMOTE_ADDR'] = address
+    request.POST.update({'text': 'flood <b>test</b>', 'content_type_id': content_type_id, 'object_id': object_id,
+                         'site_id': site_id})
+    return request
+
+
+def drive(requests, abuse_ratio, users, target, rand):
+    """
+    Send ``requests`` posts, ``abuse_ratio`` of them abusive.
+
+    :returns: dict of ``honest`` and ``rejected`` request summaries; the
+        honest one also has the honest posts accepted per second of wall time
+    """
+    from marimo_comments.views import post
+
+    (content_type_id, object_id, site_id, comment_seq) = target
+    (abuser, bot), honest = users[:2], users[2:]
+    timings = {'honest': [], 'rejected': []}
+    queries = {'honest': [], 'rejected': []}
+    accepted = 0
+
+    hotpaths.clear_caches()
+    debug_cursor, connection.use_debug_cursor = connection.use_debug_cursor, True
+    started = time.time()
+    try:
+        for i in range(requests):
+            if rand.random() < abuse_ratio:
+                if rand.random() < 0.5:
+                    (user, address) = (abuser, ABUSER_ADDRESS)
+                else:
+                    (user, address) = (bot, hotpaths.poster_address(rand.randint(0, 2 ** 24)))
+            else:
+                index = rand.randint(0, len(honest) - 1)
+                (user, address) = (honest[index], hotpaths.poster_address(index))
+
+            reset_queries()
+            call_started = time.time()
+            response = post(make_request(user, address, content_type_id, object_id, site_id))
+            elapsed = (time.time() - call_started) * 1000
+
+            kind = 'honest' if user not in (abuser, bot) else None
+            if response.status_code == 429:
+                kind = 'rejected'
+            elif kind == 'honest':
+                accepted += 1
+            if kind is not None:
+                timings[kind].append(elapsed)
+                queries[kind].append(len(connection.queries))
+    finally:
+        connection.use_debug_cursor = debug_cursor
+        reset_queries()
+    duration = time.time() - started
+
+    results = {}
+    for kind in ('honest', 'rejected'):
+        if timings[kind]:
+            results[kind] = hotpaths.summarize(timings[kind], queries[kind])
+    if 'honest' in results:
+        results['honest']['posts_per_second'] = accepted / duration
+    return results
+
+
+def run(requests=1000, abuse_ratio=0.9, site_id=1, seed=0):
+    """
+    :returns: dict of benchmark name to summary: ``flood.baseline.honest``
+        (honest traffic only), ``flood.abusive.honest`` and
+        ``flood.abusive.rejected``
+    """
+    rand = random.Random(seed)
+    users = list(User.objects.filter(username__startswith=hotpaths.USERNAME_PREFIX).order_by('pk'))
+    if len(users) < 3:
+        raise ValueError('no benchmark users found, seed the database first')
+    target = hotpaths.targets(site_id)['median']
+
+    # the same number of honest posts in both runs
+    honest_requests = int(requests * (1 - abuse_ratio))
+    results = {}
+    for (name, count, ratio) in (('baseline', honest_requests, 0.0), ('abusive', requests, abuse_ratio)):
+        for (kind, summary) in drive(count, ratio, users, target, rand).items():
+            results['flood.%s.%s' % (name, kind)] = summary
+    return results
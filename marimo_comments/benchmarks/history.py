@@ -0,0 +1,83 @@
+"""
+User comment history benchmark
+
+Gives one user ``comments`` comments spread over the buckets seeded by
+``hotpaths.seed``, then times history.get_user_history for the newest page
+and for a page near the user's oldest comment, with a cold and a warm cache.
+Both should cost the same handful of queries. The user's comments are
+deleted again at the end. Run it with ``benchmark_comments --history``.
+"""
+import datetime
+import random
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import F
+
+from marimo_comments import constants, history, moderation
+from marimo_comments.benchmarks import hotpaths
+from marimo_comments.models import MarimoComment, MarimoCommentBucket
+from marimo_comments.util import cursors
+
+HISTORIAN = hotpaths.USERNAME_PREFIX + 'historian'
+
+
+def seed_history(comments=50000, site_id=1, seed=0):
+    """ :returns: the user holding the comments """
+    rand = random.Random(seed)
+    historian = User.objects.get_or_create(username=HISTORIAN)[0]
+    bucket_ids = list(MarimoCommentBucket.objects.filter(
+        content_type=ContentType.objects.get_for_model(User), originating_site=site_id).values_list('pk', flat=True))
+    if not bucket_ids:
+        raise ValueError('no benchmark buckets found, seed the database first')
+
+    placed = [rand.choice(bucket_ids) for i in range(comments)]
+    counts = {}
+    for bucket_id in placed:
+        counts[bucket_id] = counts.get(bucket_id, 0) + 1
+    # hand each bucket a block of positions up front
+    positions = {}
+    for (bucket_id, count) in counts.items():
+        with transaction.commit_on_success():
+            buckets = MarimoCommentBucket.objects.filter(pk=bucket_id)
+            buckets.update(comment_seq=F('comment_seq') + count)
+            positions[bucket_id] = buckets.values_list('comment_seq', flat=True)[0] - count
+
+    start = datetime.datetime.now() - datetime.timedelta(days=365)
+    batch = []
+    for (i, bucket_id) in enumerate(placed):
+        positions[bucket_id] += 1
+        batch.append(MarimoComment(bucket_id=bucket_id, user=historian, text='history comment %d' % i,
+                                   submit_date=start + datetime.timedelta(seconds=i * 60),
+                                   position=positions[bucket_id]))
+        if len(batch) == 1000:
+            MarimoComment.objects.bulk_create(batch)
+            batch = []
+    MarimoComment.objects.bulk_create(batch)
+    MarimoCommentBucket.objects.recount(counts.keys())
+    return historian
+
+
+def run(comments=50000, iterations=100, site_id=1):
+    """
+    :returns: dict of ``history.newest_page.*`` and ``history.oldest_page.*``
+        (cold and warm) to measure() results
+    """
+    historian = seed_history(comments, site_id)
+    try:
+        # seeking back from the comment just after the oldest page leads to the oldest page
+        (submit_date, comment_id) = MarimoComment.objects.filter(user=historian).order_by(
+            'submit_date', 'id').values_list('submit_date', 'id')[constants.COMMENTS_PER_PAGE]
+        deep = cursors.encode_cursor(cursors.PREV, submit_date, comment_id,
+                                     comments // constants.COMMENTS_PER_PAGE)
+
+        results = {}
+        for (label, cursor) in (('newest', None), ('oldest', deep)):
+            def page(cursor=cursor):
+                history.get_user_history(historian.pk, cursor)
+            for (temperature, cold) in (('cold', True), ('warm', False)):
+                results['history.%s_page.%s' % (label, temperature)] = hotpaths.measure(page, iterations, cold)
+        return results
+    finally:
+        moderation.delete_comments(moderation.select_comments(users=[historian.pk]))
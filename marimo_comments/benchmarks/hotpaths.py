@@ -0,0 +1,195 @@
+"""
+Read and write hot path benchmarks
+
+Seeds the configured database with a realistic spread of buckets (a few giant
+ones and a long tail of small ones), then times the widget for first, middle
+and last pages, ``post()`` and ``get_page_and_comment_counts``. Each path is
+measured with a cold and a warm cache, reporting latency percentiles and the
+number of queries per call. Run it through the ``benchmark_comments``
+management command.
+"""
+import datetime
+import itertools
+import json
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import connection, reset_queries, transaction
+from django.http import HttpRequest
+
+from marimo_comments import constants, resolver
+from marimo_comments.models import MarimoComment, MarimoCommentBucket
+
+USERNAME_PREFIX = 'marimo-bench-'
+
+
+def seed(buckets=200, comments=50000, users=500, site_id=1, seed=0):
+    """
+    Create ``users`` users and ``buckets`` buckets holding ``comments``
+    comments between them. Bucket sizes follow a pareto distribution, so the
+    first few buckets hold most of the comments. The users double as the
+    buckets' content objects.
+
+    :returns: list of ``(content_type_id, object_id, site_id, comment_count)``
+        tuples, biggest bucket first
+    """
+    rand = random.Random(seed)
+    User.objects.bulk_create([User(username='%s%d' % (USERNAME_PREFIX, i)) for i in range(users)])
+    user_ids = list(User.objects.filter(username__startswith=USERNAME_PREFIX).values_list('pk', flat=True))
+    content_type = ContentType.objects.get_for_model(User)
+
+    weights = sorted((rand.paretovariate(1.2) for i in range(buckets)), reverse=True)
+    scale = comments / sum(weights)
+    sizes = [max(1, int(weight * scale)) for weight in weights]
+
+    start = datetime.datetime.now() - datetime.timedelta(days=30)
+    created = []
+    for (object_id, size) in zip(user_ids, sizes):
+        with transaction.commit_on_success():
+            bucket = MarimoCommentBucket.objects.create(content_type=content_type, object_id=object_id,
+                                                        originating_site_id=site_id)
+            batch = []
+            for position in range(1, size + 1):
+                batch.append(MarimoComment(bucket=bucket, user_id=rand.choice(user_ids), position=position,
+                                           text='benchmark comment %d ' % position * rand.randint(1, 20),
+                                           submit_date=start + datetime.timedelta(seconds=position * 60)))
+                if len(batch) == 1000:
+                    MarimoComment.objects.bulk_create(batch)
+                    batch = []
+            MarimoComment.objects.bulk_create(batch)
+            MarimoCommentBucket.objects.filter(pk=bucket.pk).update(comment_seq=size)
+        created.append((content_type.pk, object_id, site_id, size))
+
+    MarimoCommentBucket.objects.rebuild_counts()
+    return created
+
+
+def targets(site_id=1):
+    """ the biggest, the median and the smallest seeded bucket """
+    buckets = list(MarimoCommentBucket.objects.filter(
+        content_type=ContentType.objects.get_for_model(User), originating_site=site_id,
+        object_id__in=User.objects.filter(username__startswith=USERNAME_PREFIX).values('pk')).order_by(
+            '-comment_count').values_list('content_type', 'object_id', 'originating_site', 'comment_seq'))
+    if not buckets:
+        raise ValueError('no benchmark buckets found, seed the database first')
+    return {
+        'giant': buckets[0],
+        'median': buckets[len(buckets) // 2],
+        'small': buckets[-1],
+    }
+
+
+def clear_caches():
+    cache.clear()
+    resolver.local_cache.clear()
+
+
+def measure(fn, iterations, cold=False):
+    """
+    Call ``fn`` ``iterations`` times.
+
+    :returns: dict with latency percentiles (milliseconds) and queries per call
+    """
+    timings = []
+    queries = []
+    debug_cursor, connection.use_debug_cursor = connection.use_debug_cursor, True
+    try:
+        for i in range(iterations):
+            if cold:
+                clear_caches()
+            reset_queries()
+            started = time.time()
+            fn()
+            timings.append((time.time() - started) * 1000)
+            queries.append(len(connection.queries))
+    finally:
+        connection.use_debug_cursor = debug_cursor
+        reset_queries()
+    return summarize(timings, queries)
+
+
+def summarize(timings, queries):
+    """ latency percentiles (milliseconds) and mean queries of a list of calls """
+    timings = sorted(timings)
+    iterations = len(timings)
+    return {
+        'p50': percentile(timings, 50),
+        'p90': percentile(timings, 90),
+        'p99': percentile(timings, 99),
+        'max': timings[-1],
+        'mean': sum(timings) / len(timings),
+        'queries': float(sum(queries)) / len(queries),
+        'iterations': iterations,
+    }
+
+
+def percentile(ordered, percent):
+    """ nearest-rank percentile of an already sorted list """
+    index = int(round(percent / 100.0 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def run(iterations=100, site_id=1):
+    """
+    Run every benchmark.
+
+    :returns: dict of benchmark name to measure() results
+    """
+    from marimo_comments.views import CommentsWidget, get_page_and_comment_counts, post
+
+    widget = CommentsWidget()
+    request = HttpRequest()
+    users = list(User.objects.filter(username__startswith=USERNAME_PREFIX))
+    request.user = users[0]
+    # post as a different user and address every time, or flood control kicks in
+    posters = itertools.cycle(enumerate(users))
+    results = {}
+
+    for (name, (content_type_id, object_id, site_id, comment_seq)) in sorted(targets(site_id).items()):
+        last_page = max(1, (comment_seq + constants.COMMENTS_PER_PAGE - 1) // constants.COMMENTS_PER_PAGE)
+        for (label, page) in (('first', 1), ('middle', (last_page + 1) // 2), ('last', last_page)):
+            def render(page=page, content_type_id=content_type_id, object_id=object_id, site_id=site_id):
+                widget.uncacheable(request, {'context': {}}, content_type_id, object_id, site_id=site_id, page=page)
+            for (temperature, cold) in (('cold', True), ('warm', False)):
+                results['widget.%s.%s_page.%s' % (name, label, temperature)] = measure(render, iterations, cold)
+
+        def counts(content_type_id=content_type_id, object_id=object_id, site_id=site_id):
+            get_page_and_comment_counts(content_type_id, object_id, site_id)
+        for (temperature, cold) in (('cold', True), ('warm', False)):
+            results['counts.%s.%s' % (name, temperature)] = measure(counts, iterations, cold)
+
+        def comment(content_type_id=content_type_id, object_id=object_id, site_id=site_id):
+            post_request = HttpRequest()
+            post_request.method = 'POST'
+            post_request.is_ajax = lambda: True
+            (index, post_request.user) = next(posters)
+            post_request.META['REMOTE_ADDR'] = poster_address(index)
+            post_request.POST.update({'text': 'benchmark <b>post</b>', 'content_type_id': content_type_id,
+                                      'object_id': object_id, 'site_id': site_id})
+            response = post(post_request)
+            assert response.status_code == 200, response.content
+        results['post.%s' % name] = measure(comment, iterations)
+
+    return results
+
+
+def poster_address(index):
+    """ a distinct private address per poster """
+    return '10.%d.%d.%d' % (index // 65536 % 256, index // 256 % 256, index % 256)
+
+
+def compare(results, baseline):
+    """
+    :returns: list of ``(name, baseline p50, p50, baseline queries, queries)``
+        for every benchmark present in both result sets
+    """
+    return [(name, baseline[name]['p50'], results[name]['p50'], baseline[name]['queries'], results[name]['queries'])
+            for name in sorted(results) if name in baseline]
+
+
+def dump(results, label, fp):
+    json.dump({'label': label, 'created': datetime.datetime.now().isoformat(), 'results': results}, fp,
+              indent=2, sort_keys=True)
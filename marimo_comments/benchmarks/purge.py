@@ -0,0 +1,86 @@
+"""
+Bulk moderation benchmark
+
+Spreads ``comments`` comments by one spammer over the buckets seeded by
+``hotpaths.seed``, then times hiding, showing and finally deleting all of
+them through moderation.py, counters and caches included. Leaves the
+database as it found it, apart from the spammer's user. Run it with
+``benchmark_comments --purge``.
+"""
+import datetime
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, reset_queries, transaction
+from django.db.models import F
+
+from marimo_comments import moderation
+from marimo_comments.benchmarks import hotpaths
+from marimo_comments.models import MarimoComment, MarimoCommentBucket
+
+SPAMMER = hotpaths.USERNAME_PREFIX + 'spammer'
+SPAMMER_ADDRESS = '198.51.100.23'
+
+
+def seed_spam(comments=100000, site_id=1, seed=0):
+    """
+    :returns: ``(spammer, number of buckets spammed)``
+    """
+    rand = random.Random(seed)
+    spammer = User.objects.get_or_create(username=SPAMMER)[0]
+    bucket_ids = list(MarimoCommentBucket.objects.filter(
+        content_type=ContentType.objects.get_for_model(User), originating_site=site_id).values_list('pk', flat=True))
+    if not bucket_ids:
+        raise ValueError('no benchmark buckets found, seed the database first')
+
+    counts = {}
+    for i in range(comments):
+        bucket_id = rand.choice(bucket_ids)
+        counts[bucket_id] = counts.get(bucket_id, 0) + 1
+
+    now = datetime.datetime.now()
+    for (bucket_id, count) in counts.items():
+        with transaction.commit_on_success():
+            buckets = MarimoCommentBucket.objects.filter(pk=bucket_id)
+            buckets.update(comment_seq=F('comment_seq') + count)
+            last = buckets.values_list('comment_seq', flat=True)[0]
+            batch = []
+            for position in range(last - count + 1, last + 1):
+                batch.append(MarimoComment(bucket_id=bucket_id, user=spammer, ip_address=SPAMMER_ADDRESS,
+                                           text='cheap watches', submit_date=now, position=position))
+                if len(batch) == 1000:
+                    MarimoComment.objects.bulk_create(batch)
+                    batch = []
+            MarimoComment.objects.bulk_create(batch)
+    MarimoCommentBucket.objects.recount(counts.keys())
+    return (spammer, len(counts))
+
+
+def run(comments=100000, site_id=1):
+    """
+    :returns: dict of ``purge.hide``, ``purge.show`` and ``purge.delete`` to
+        their timing (a single call each), with the ``comments`` changed and
+        the ``buckets`` they were spread over
+    """
+    (spammer, buckets) = seed_spam(comments, site_id)
+    spam = moderation.select_comments(users=[spammer.pk])
+
+    results = {}
+    debug_cursor, connection.use_debug_cursor = connection.use_debug_cursor, True
+    try:
+        for (name, action) in (('hide', moderation.hide_comments), ('show', moderation.show_comments),
+                               ('delete', moderation.delete_comments)):
+            hotpaths.clear_caches()
+            reset_queries()
+            started = time.time()
+            changed = action(spam)
+            summary = hotpaths.summarize([(time.time() - started) * 1000], [len(connection.queries)])
+            summary['comments'] = changed
+            summary['buckets'] = buckets
+            results['purge.%s' % name] = summary
+    finally:
+        connection.use_debug_cursor = debug_cursor
+        reset_queries()
+    return results
@@ -0,0 +1,62 @@
+"""
+Sanitizer micro-benchmark: django-sanitizer's ``allowtags`` pipeline versus
+markup.clean_comment_text on comments close to COMMENT_MAX_LENGTH. No
+database is needed. Needs django-sanitizer (and BeautifulSoup) installed.
+"""
+from __future__ import absolute_import
+
+import random
+import sys
+import timeit
+
+from marimo_comments import markup
+from marimo_comments.models import COMMENT_MAX_LENGTH
+
+ROUNDS = 200
+
+FRAGMENTS = (
+    'Lorem ipsum dolor sit amet, ', 'consectetur adipiscing elit. ', '<b>bold</b> ', '<br>', '<br />', '\n',
+    '<i>', '</i>', '<a href="http://example.com/">', '</a>', 'AT&T ', '&amp; ', ' < ', ' > ', '<!-- x -->',
+    '<p class="quote">', '</p>', u'caf\xe9 ',
+)
+
+
+def make_comment(rand, length=COMMENT_MAX_LENGTH):
+    parts = []
+    size = 0
+    while size < length - 40:
+        fragment = rand.choice(FRAGMENTS)
+        parts.append(fragment)
+        size += len(fragment)
+    return u''.join(parts)
+
+
+def legacy_clean(text):
+    """ post()'s sanitizing before markup.clean_comment_text """
+    from sanitizer.templatetags.sanitizer import allowtags
+    return allowtags(text, 'b br').replace('<br />', '\n')
+
+
+def run():
+    rand = random.Random(0)
+    comments = [make_comment(rand) for i in range(10)]
+    plain = [u'%s' % ('Lorem ipsum dolor sit amet. ' * (COMMENT_MAX_LENGTH // 28))] * 10
+    for (name, texts) in (('mixed markup', comments), ('plain text', plain)):
+        for text in texts:
+            assert legacy_clean(text) == markup.clean_comment_text(text)
+
+        legacy = min(timeit.repeat(lambda: [legacy_clean(t) for t in texts], number=ROUNDS, repeat=3))
+        fast = min(timeit.repeat(lambda: [markup.clean_comment_text(t) for t in texts], number=ROUNDS, repeat=3))
+        count = ROUNDS * len(texts)
+        size = sum(len(t) for t in texts) * ROUNDS
+
+        sys.stdout.write('%s, %d comments of ~%d characters\n' % (name, len(texts), size // count))
+        sys.stdout.write('  allowtags:          %8.1f us/comment %8.2f MB/s\n' % (legacy / count * 1e6,
+                                                                               size / legacy / 1e6))
+        sys.stdout.write('  clean_comment_text: %8.1f us/comment %8.2f MB/s\n' % (fast / count * 1e6,
+                                                                               size / fast / 1e6))
+        sys.stdout.write('  speedup %.1fx\n' % (legacy / fast))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,80 @@
+"""
+Serialization micro-benchmark: one page of comments rendered from full model
+instances (the old list comprehension) versus from CommentRows. No database is
+needed; the instances and rows are built in memory.
+"""
+import datetime
+import gc
+import sys
+import timeit
+
+from django.contrib.auth.models import User
+
+from marimo_comments import constants, serialization
+from marimo_comments.models import MarimoComment
+
+ROUNDS = 2000
+
+
+def legacy_serialize(comments, hrefs):
+    """ the widget's serialization before CommentRows """
+    return [{
+        'comment_href': href,
+        'poster': c.user.username,
+        'submit_date': c.submit_date.strftime("%l:%M %p %b. %e, %Y").replace('AM', 'a.m.').replace('PM', 'p.m.'),
+        'submitted_ts': int(c.submit_date.strftime('%s')),
+        'text': c.text,
+        'comment_id': c.pk,
+    } for (c, href) in zip(comments, hrefs)]
+
+
+def make_page(size=constants.COMMENTS_PER_PAGE):
+    start = datetime.datetime(2013, 3, 1, 9, 30)
+    comments, rows = [], []
+    for i in range(size):
+        submit_date = start + datetime.timedelta(minutes=37 * i)
+        text = 'comment number %d ' % i * 10
+        user = User(pk=i, username='user%d' % i, email='user%d@example.com' % i)
+        comments.append(MarimoComment(pk=i + 1, bucket_id=1, user=user, text=text, submit_date=submit_date,
+                                      position=i + 1))
+        rows.append(serialization.CommentRow(i + 1, user.username, text, submit_date, i + 1))
+    return comments, rows
+
+
+def footprint(objects):
+    """ rough bytes held by objects and the attribute dicts hanging off them """
+    total = 0
+    seen = set()
+    stack = list(objects)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (int, str, datetime.datetime)):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        attrs = getattr(obj, '__dict__', None)
+        if attrs is not None:
+            total += sys.getsizeof(attrs)
+            stack.extend(attrs.values())
+    return total
+
+
+def run():
+    comments, rows = make_page()
+    hrefs = ['/story/#/comment/p1/c%d/' % c.pk for c in comments]
+    assert legacy_serialize(comments, hrefs) == serialization.serialize_comments(rows, hrefs)
+
+    gc.collect()
+    legacy = min(timeit.repeat(lambda: legacy_serialize(comments, hrefs), number=ROUNDS, repeat=3)) / ROUNDS
+    fast = min(timeit.repeat(lambda: serialization.serialize_comments(rows, hrefs), number=ROUNDS, repeat=3)) / ROUNDS
+
+    legacy_bytes, fast_bytes = footprint(comments), footprint(rows)
+
+    sys.stdout.write('page of %d comments\n' % len(comments))
+    sys.stdout.write('  model instances: %8.1f us/page %8d bytes\n' % (legacy * 1e6, legacy_bytes))
+    sys.stdout.write('  comment rows:    %8.1f us/page %8d bytes\n' % (fast * 1e6, fast_bytes))
+    sys.stdout.write('  speedup %.1fx, %.0f%% less memory\n' % (legacy / fast, 100.0 * (1 - float(fast_bytes) / legacy_bytes)))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,199 @@
+"""
+Cache keys and cache helpers for everything marimo comments caches
+
+All keys are built here so that they are namespaced the same way and share a
+global version (``MARIMO_COMMENTS_CACHE_VERSION``); bumping the version
+abandons every comment cache entry at once, e.g. after a change to what is
+cached.
+
+Per-bucket cache generations
+    Everything cached about a bucket's comments has the bucket's generation
+    in its key. Changing a comment bumps the generation, which makes all of
+    those entries unreachable at once; they are left to expire on their own.
+
+Stampede protection
+    Values stored with ``store`` / ``get_or_set`` carry a soft expiry and are
+    kept in the cache for a grace period past it. The first reader to see a
+    stale value takes a short lock and recomputes it while everybody else
+    keeps being served the stale value, so a hot key expiring sends one
+    worker to the database instead of all of them.
+"""
+import time
+
+from django.core.cache import cache
+
+from marimo_comments import constants, stats
+
+
+def make_key(namespace, *parts):
+    """ ``marimo_comments:<version>:<namespace>:<part>:<part>...`` """
+    return ':'.join(['marimo_comments', str(constants.CACHE_VERSION), namespace] + [str(part) for part in parts])
+
+
+def count_key(content_type_id, object_id, site_id):
+    """ (total_comments, total_pages) of a content object """
+    return make_key('counts', content_type_id, object_id, site_id)
+
+
+def bucket_key(content_type_id, object_id, site_id):
+    """ bucket id of a content object, see resolver.py """
+    return make_key('bucket', content_type_id, object_id, site_id)
+
+
+def content_url_key(content_type_id, object_id):
+    """ get_absolute_url() of a content object, see resolver.py """
+    return make_key('url', content_type_id, object_id)
+
+
+def leaderboard_key(site_id, hours, limit):
+    """ most commented buckets of a site, see rollups.py """
+    return make_key('top', site_id, hours, limit)
+
+
+def generation_key(bucket_id):
+    """ the bucket's current generation """
+    return make_key('gen', bucket_id)
+
+
+def bumped_key(bucket_id):
+    """ present for DB_PIN_SECONDS after the bucket's generation was bumped """
+    return make_key('bumped', bucket_id)
+
+
+def page_key(bucket_id, generation, page):
+    """ a rendered page of comments, ``page`` being a page number or cursor """
+    return make_key('page', bucket_id, generation, page)
+
+
+def page_count_key(bucket_id, generation):
+    """ number of pages of the bucket's comments, to clamp page numbers before they go into page keys """
+    return make_key('pages', bucket_id, generation)
+
+
+def since_key(bucket_id, generation, field, after):
+    """ the bucket's comments after a comment id or timestamp, see views.since """
+    return make_key('since', bucket_id, generation, field, after)
+
+
+def rate_key(scope, ident):
+    """ token bucket of a poster, see ratelimit.py """
+    return make_key('rate', scope, ident)
+
+
+def _namespace(key):
+    """ the namespace of a make_key key, for the hit and miss stats; 'other' for any other key """
+    parts = key.split(':')
+    if len(parts) > 2 and parts[0] == 'marimo_comments':
+        return parts[2]
+    return 'other'
+
+
+def _lock_key(key):
+    return key + ':lock'
+
+
+def _new_generation():
+    # seeded from the clock rather than 1 so that a generation which was
+    # evicted from the cache can never come back and resurrect stale entries
+    return int(time.time() * 1000)
+
+
+def get_generation(bucket_id):
+    """ current generation of the bucket, initialising it if needed """
+    key = generation_key(bucket_id)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, _new_generation(), constants.GENERATION_CACHE_TIMEOUT)
+        generation = cache.get(key) or _new_generation()
+    return generation
+
+
+def get_generation_state(bucket_id):
+    """
+    ``(generation, bumped)``: the bucket's current generation, and whether
+    it was bumped recently enough that replicas may not have the change
+    behind it yet. Nothing read from a replica may be cached under a bumped
+    generation, see views.get_cached_comment_page.
+    """
+    (key, bumped) = (generation_key(bucket_id), bumped_key(bucket_id))
+    values = cache.get_many([key, bumped])
+    generation = values.get(key)
+    if generation is None:
+        generation = get_generation(bucket_id)
+    return (generation, bumped in values)
+
+
+def bump_generation(bucket_id):
+    """ invalidate everything cached for the bucket in O(1) """
+    key = generation_key(bucket_id)
+    if constants.DB_REPLICAS:
+        # before the bump, so that nobody sees the new generation without it
+        cache.set(bumped_key(bucket_id), 1, constants.DB_PIN_SECONDS)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        generation = _new_generation()
+        cache.set(key, generation, constants.GENERATION_CACHE_TIMEOUT)
+        return generation
+
+
+def pack(value, timeout):
+    """ wrap ``value`` with its soft expiry """
+    return (value, time.time() + timeout)
+
+
+def unpack(packed):
+    """
+    :returns: the value stored by ``pack``, or None if it is missing or
+        past its soft expiry
+    """
+    if packed is None or packed[1] <= time.time():
+        return None
+    return packed[0]
+
+
+def store(key, value, timeout):
+    """ store a value to be read back with ``get_or_set`` """
+    cache.set(key, pack(value, timeout), timeout + constants.CACHE_STALE_GRACE)
+
+
+def store_many(data, timeout):
+    """ store several values to be read back with ``get_or_set`` """
+    cache.set_many(dict((key, pack(value, timeout)) for (key, value) in data.items()),
+                   timeout + constants.CACHE_STALE_GRACE)
+
+
+def get_or_set(key, recompute, timeout, refresh=False):
+    """
+    Return the cached value for ``key``, calling ``recompute()`` to fill it in
+    when it is missing or stale. Only one caller at a time recomputes a key;
+    the others get the stale value, or wait briefly for a missing one.
+    ``refresh`` recomputes and stores the value whether it is cached or not.
+    """
+    if refresh:
+        stats.cache_miss(_namespace(key))
+        value = recompute()
+        store(key, value, timeout)
+        return value
+    packed = cache.get(key)
+    if packed is not None:
+        (value, soft_expiry) = packed
+        if soft_expiry > time.time() or not cache.add(_lock_key(key), 1, constants.CACHE_LOCK_TIMEOUT):
+            stats.cache_hit(_namespace(key))
+            return value
+    stats.cache_miss(_namespace(key))
+    if packed is None and not cache.add(_lock_key(key), 1, constants.CACHE_LOCK_TIMEOUT):
+        # somebody else is already computing it; give them a moment
+        for attempt in range(constants.CACHE_LOCK_WAIT_ATTEMPTS):
+            time.sleep(constants.CACHE_LOCK_WAIT)
+            packed = cache.get(key)
+            if packed is not None:
+                return packed[0]
+        return recompute()
+
+    try:
+        value = recompute()
+        store(key, value, timeout)
+        return value
+    finally:
+        cache.delete(_lock_key(key))
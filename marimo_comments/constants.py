@@ -1,6 +1,7 @@
 """
 Helpful data
 """
+from django.conf import settings
 
 COMMENTS_DISABLED_STATUS = 1
 COMMENTS_FROZEN_STATUS = 2
@@ -23,3 +24,68 @@ comment_help_text = """ "Default" will defer to the the medley comment rules<br
 COMMENTS_PER_PAGE = 20
 
 EDIT_EXPIRATION = 2
+
+# bump to abandon every cache entry written by marimo comments
+CACHE_VERSION = getattr(settings, 'MARIMO_COMMENTS_CACHE_VERSION', 1)
+
+# stampede protection, see caching.py. Stale values are kept around for
+# CACHE_STALE_GRACE seconds past their timeout while one worker recomputes them.
+CACHE_STALE_GRACE = getattr(settings, 'MARIMO_COMMENTS_CACHE_STALE_GRACE', 60)
+CACHE_LOCK_TIMEOUT = 10
+CACHE_LOCK_WAIT = 0.05
+CACHE_LOCK_WAIT_ATTEMPTS = 5
+
+# how long a rendered page of comments is cached (seconds). Pages are
+# invalidated by bumping the bucket generation, so this can be generous.
+PAGE_CACHE_TIMEOUT = getattr(settings, 'MARIMO_COMMENTS_PAGE_CACHE_TIMEOUT', 60 * 60)
+
+# how long a bucket generation counter is kept (seconds)
+GENERATION_CACHE_TIMEOUT = getattr(settings, 'MARIMO_COMMENTS_GENERATION_CACHE_TIMEOUT', 60 * 60 * 24 * 7)
+
+# bucket resolution (content object -> bucket id) caching, see resolver.py
+BUCKET_CACHE_TIMEOUT = getattr(settings, 'MARIMO_COMMENTS_BUCKET_CACHE_TIMEOUT', 60 * 60 * 24)
+BUCKET_NEGATIVE_CACHE_TIMEOUT = getattr(settings, 'MARIMO_COMMENTS_BUCKET_NEGATIVE_CACHE_TIMEOUT', 30)
+BUCKET_LOCAL_CACHE_TIMEOUT = getattr(settings, 'MARIMO_COMMENTS_BUCKET_LOCAL_CACHE_TIMEOUT', 60 * 5)
+BUCKET_LOCAL_CACHE_SIZE = getattr(settings, 'MARIMO_COMMENTS_BUCKET_LOCAL_CACHE_SIZE', 10000)
+
+# content object urls are cached for CONTENT_URL_CACHE_TIMEOUT seconds when
+# their model is listed here ('app_label.modelname') or registered with
+# resolver.register_content_model, which keeps them current on save and
+# delete; for SHORT_CACHE_TIMEOUT otherwise
+CONTENT_URL_MODELS = getattr(settings, 'MARIMO_COMMENTS_CONTENT_URL_MODELS', ())
+CONTENT_URL_CACHE_TIMEOUT = getattr(settings, 'MARIMO_COMMENTS_CONTENT_URL_CACHE_TIMEOUT', 60 * 60 * 24)
+
+# sanitize posted comments with django-sanitizer's allowtags instead of
+# markup.clean_comment_text (same output, several times slower)
+LEGACY_SANITIZER = getattr(settings, 'MARIMO_COMMENTS_LEGACY_SANITIZER', False)
+
+# admin changelists count at most this many rows; unfiltered tables bigger
+# than this show the database's row estimate instead, see util/changelist.py
+ADMIN_COUNT_LIMIT = getattr(settings, 'MARIMO_COMMENTS_ADMIN_COUNT_LIMIT', 10000)
+
+# flood control for posting, see ratelimit.py. Per scope ('user' and 'ip'):
+# (posts, per this many seconds, burst). Leave a scope out to not limit it.
+RATE_LIMITS = getattr(settings, 'MARIMO_COMMENTS_RATE_LIMITS', {'user': (5, 60, 5), 'ip': (30, 60, 30)})
+RATE_LIMIT_CACHE_TIMEOUT = 60 * 60 * 24
+RATE_LIMIT_RESET_LOCK_TIMEOUT = 5
+
+# primary/replica routing, see routers.py. Aliases in DATABASES; after a
+# write the poster reads from the primary for DB_PIN_SECONDS.
+DB_PRIMARY = getattr(settings, 'MARIMO_COMMENTS_DB_PRIMARY', 'default')
+DB_REPLICAS = getattr(settings, 'MARIMO_COMMENTS_DB_REPLICAS', [])
+DB_PIN_SECONDS = getattr(settings, 'MARIMO_COMMENTS_DB_PIN_SECONDS', 15)
+
+# optional full-text search over comment text, see search.py. SEARCH_CONFIG
+# is the postgres text search configuration.
+SEARCH_ENABLED = getattr(settings, 'MARIMO_COMMENTS_SEARCH', False)
+SEARCH_CONFIG = getattr(settings, 'MARIMO_COMMENTS_SEARCH_CONFIG', 'english')
+# the comment admin's search box lists at most this many of the best matches
+SEARCH_ADMIN_LIMIT = getattr(settings, 'MARIMO_COMMENTS_SEARCH_ADMIN_LIMIT', 500)
+
+# "most commented" leaderboards, see rollups.py. Comments are counted per
+# bucket in slices of LEADERBOARD_SLICE seconds (must divide a day), kept for
+# LEADERBOARD_RETENTION_HOURS; leaderboards are cached for
+# LEADERBOARD_CACHE_TIMEOUT seconds.
+LEADERBOARD_SLICE = getattr(settings, 'MARIMO_COMMENTS_LEADERBOARD_SLICE', 60 * 10)
+LEADERBOARD_RETENTION_HOURS = getattr(settings, 'MARIMO_COMMENTS_LEADERBOARD_RETENTION_HOURS', 24)
+LEADERBOARD_CACHE_TIMEOUT = getattr(settings, 'MARIMO_COMMENTS_LEADERBOARD_CACHE_TIMEOUT', 60)
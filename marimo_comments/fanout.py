@@ -0,0 +1,476 @@
+"""
+Live comment push
+
+An optional standalone process (``run_fanout_server``) that holds open
+connections from viewers and pushes them new comments as they are posted.
+With tens of thousands of viewers on one live event, this costs one message
+from ``post()`` per comment instead of one poll per viewer every few seconds.
+
+Viewers subscribe per bucket::
+
+    GET /events/<bucket_id>           server-sent events, one "comment"
+                                      event per new comment
+    GET /poll/<bucket_id>?after=<id>  long-poll: answered as soon as there
+                                      is a comment newer than event <id>
+
+Both replay what a reconnecting viewer missed (``Last-Event-ID`` or
+``after``) from a short per-bucket backlog. Backlogs of buckets nothing was
+published to for a while are dropped.
+
+``post()`` hands new comments to ``publish``, which sends them through the
+configured channel. ``UnixSocketChannel`` sends a datagram to the server's
+unix socket; it never blocks, and drops the message if the server isn't
+running. Each message is encoded once and the same bytes are written to
+every subscriber, so the server never touches the database.
+
+Settings::
+
+    # dotted path of the channel class; NullChannel (publish nothing) by default
+    MARIMO_COMMENTS_FANOUT_CHANNEL = 'marimo_comments.fanout.UnixSocketChannel'
+    MARIMO_COMMENTS_FANOUT_SOCKET = '/tmp/marimo_comments_fanout.sock'
+"""
+import collections
+import errno
+import json
+import os
+import select
+import socket
+import time
+
+try:
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    from urllib.parse import parse_qs, urlparse
+
+from django.conf import settings
+from django.utils.importlib import import_module
+
+DEFAULT_SOCKET = '/tmp/marimo_comments_fanout.sock'
+
+SSE = 'sse'
+LONG_POLL = 'poll'
+
+MAX_REQUEST_SIZE = 8192
+# datagrams bigger than this are dropped; comments are at most COMMENT_MAX_LENGTH characters
+MAX_MESSAGE_SIZE = 65536
+
+
+class NullChannel(object):
+    """ publishes nothing """
+
+    def send(self, bucket_id, comment):
+        pass
+
+
+class MemoryChannel(NullChannel):
+    """
+    Keeps everything published in ``messages``, and hands it straight to
+    ``server`` (a FanoutServer in the same process) if there is one; meant
+    for tests and benchmarks.
+    """
+
+    def __init__(self, server=None):
+        self.server = server
+        self.messages = []
+
+    def send(self, bucket_id, comment):
+        self.messages.append((bucket_id, comment))
+        if self.server is not None:
+            self.server.publish(bucket_id, comment)
+
+
+class UnixSocketChannel(NullChannel):
+    """ fire and forget datagrams to the fan-out server's unix socket """
+
+    def __init__(self, path=None):
+        self.path = path or getattr(settings, 'MARIMO_COMMENTS_FANOUT_SOCKET', DEFAULT_SOCKET)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.setblocking(0)
+
+    def send(self, bucket_id, comment):
+        try:
+            self.socket.sendto(encode_message(bucket_id, comment), self.path)
+        except socket.error:
+            # not running, or not keeping up: live updates are best effort
+            pass
+
+
+_channel = None
+
+
+def get_channel():
+    global _channel
+    if _channel is None:
+        path = getattr(settings, 'MARIMO_COMMENTS_FANOUT_CHANNEL', 'marimo_comments.fanout.NullChannel')
+        module, name = path.rsplit('.', 1)
+        _channel = getattr(import_module(module), name)()
+    return _channel
+
+
+def set_channel(channel):
+    """ swap the channel, e.g. for a MemoryChannel in tests; None reloads it from settings """
+    global _channel
+    _channel = channel
+
+
+def enabled():
+    """ whether publishing goes anywhere, so callers can skip building the message """
+    return type(get_channel()) is not NullChannel
+
+
+def publish(bucket_id, comment):
+    """ push a serialized comment (as in the widget's ``comments``) to the bucket's viewers """
+    get_channel().send(bucket_id, comment)
+
+
+def encode_message(bucket_id, comment):
+    return json.dumps({'bucket': bucket_id, 'comment': comment}, separators=(',', ':')).encode('utf-8')
+
+
+def decode_message(data):
+    message = json.loads(data.decode('utf-8'))
+    return (int(message['bucket']), message['comment'])
+
+
+class Poller(object):
+    """ epoll where there is one, poll otherwise; timeouts in seconds """
+    READ = select.POLLIN | select.POLLPRI
+    WRITE = select.POLLOUT
+    ERROR = select.POLLERR | select.POLLHUP
+
+    def __init__(self):
+        if hasattr(select, 'epoll'):
+            self._poller = select.epoll()
+            self._scale = 1
+        else:
+            self._poller = select.poll()
+            self._scale = 1000
+
+    def register(self, fd, events):
+        self._poller.register(fd, events)
+
+    def modify(self, fd, events):
+        self._poller.modify(fd, events)
+
+    def unregister(self, fd):
+        self._poller.unregister(fd)
+
+    def poll(self, timeout):
+        try:
+            return self._poller.poll(timeout * self._scale)
+        except (IOError, OSError, select.error) as e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+
+
+class Connection(object):
+    """ a viewer """
+    __slots__ = ('socket', 'fd', 'inbuf', 'outbuf', 'mode', 'bucket_id', 'closing', 'opened', 'last_write')
+
+    def __init__(self, sock, now):
+        self.socket = sock
+        self.fd = sock.fileno()
+        self.inbuf = b''
+        self.outbuf = b''
+        self.mode = None
+        self.bucket_id = None
+        self.closing = False
+        self.opened = self.last_write = now
+
+
+def http_response(status, headers, body=b''):
+    lines = ['HTTP/1.1 %s' % status, 'Access-Control-Allow-Origin: *', 'Cache-Control: no-cache']
+    lines.extend('%s: %s' % header for header in headers)
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('ascii') + body
+
+
+def json_response(events):
+    body = json.dumps([{'id': seq, 'comment': comment} for (seq, comment) in events],
+                      separators=(',', ':')).encode('utf-8')
+    return http_response('200 OK', [('Content-Type', 'application/json'), ('Content-Length', len(body)),
+                                    ('Connection', 'close')], body)
+
+
+SSE_HEADERS = http_response('200 OK', [('Content-Type', 'text/event-stream'), ('Connection', 'keep-alive')],
+                            b'retry: 3000\n\n')
+NO_CONTENT = http_response('204 No Content', [('Content-Length', 0), ('Connection', 'close')])
+NOT_FOUND = http_response('404 Not Found', [('Content-Length', 0), ('Connection', 'close')])
+KEEPALIVE = b':\n\n'
+
+
+class FanoutServer(object):
+    """
+    Single threaded, non-blocking fan-out server.
+
+    :param address: ``(host, port)`` viewers connect to
+    :param socket_path: unix datagram socket ``post()`` publishes to, or
+        None to only take messages through ``publish``
+    :param keepalive: seconds between keepalive comments on idle event streams
+    :param poll_timeout: seconds a long-poll is held before answering 204
+    :param backlog: messages kept per bucket for reconnecting viewers
+    :param backlog_ttl: seconds a bucket's backlog is kept after its last message
+    :param max_buffer: bytes queued for a viewer before it is dropped as too slow
+    """
+
+    def __init__(self, address=('127.0.0.1', 8765), socket_path=None, keepalive=15, poll_timeout=30, backlog=100,
+                 backlog_ttl=600, max_buffer=256 * 1024):
+        self.keepalive = keepalive
+        self.poll_timeout = poll_timeout
+        self.backlog_size = backlog
+        self.backlog_ttl = backlog_ttl
+        self.max_buffer = max_buffer
+
+        self.poller = Poller()
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(address)
+        self.listener.listen(1024)
+        self.listener.setblocking(0)
+        self.address = self.listener.getsockname()
+        self.poller.register(self.listener.fileno(), Poller.READ)
+
+        self.inbox = None
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            self.inbox = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.inbox.bind(socket_path)
+            self.inbox.setblocking(0)
+            self.poller.register(self.inbox.fileno(), Poller.READ)
+
+        self.connections = {}
+        self.subscribers = {}
+        self.backlogs = {}
+        # bucket id -> time of its last message, to expire the backlogs
+        self.published = {}
+        self.seq = 0
+        self.delivered = 0
+        self.running = False
+        self._housekept = time.time()
+
+    def serve_forever(self):
+        self.running = True
+        while self.running:
+            self.run_once(1.0)
+
+    def stop(self):
+        self.running = False
+
+    def run_once(self, timeout):
+        """ handle whatever is ready within ``timeout`` seconds """
+        for (fd, events) in self.poller.poll(timeout):
+            if fd == self.listener.fileno():
+                self.accept()
+            elif self.inbox is not None and fd == self.inbox.fileno():
+                self.receive()
+            else:
+                connection = self.connections.get(fd)
+                if connection is None:
+                    continue
+                if events & Poller.ERROR:
+                    self.close(connection)
+                    continue
+                if events & Poller.READ:
+                    self.read(connection)
+                if events & Poller.WRITE and fd in self.connections:
+                    self.flush(connection)
+        now = time.time()
+        if now - self._housekept >= 1:
+            self.housekeep(now)
+
+    # publishing
+
+    def receive(self):
+        """ drain the unix socket """
+        while True:
+            try:
+                data = self.inbox.recv(MAX_MESSAGE_SIZE)
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            try:
+                (bucket_id, comment) = decode_message(data)
+            except (ValueError, KeyError, TypeError):
+                continue
+            self.publish(bucket_id, comment)
+
+    def publish(self, bucket_id, comment):
+        """ broadcast a comment to every viewer of the bucket """
+        self.seq += 1
+        backlog = self.backlogs.get(bucket_id)
+        if backlog is None:
+            backlog = self.backlogs[bucket_id] = collections.deque(maxlen=self.backlog_size)
+        backlog.append((self.seq, comment))
+        self.published[bucket_id] = time.time()
+
+        subscribers = self.subscribers.get(bucket_id)
+        if not subscribers:
+            return
+        # encoded once for everybody
+        event = self.sse_event(self.seq, comment)
+        poll_answer = None
+        for connection in list(subscribers):
+            if connection.mode == SSE:
+                self.send(connection, event)
+            else:
+                if poll_answer is None:
+                    poll_answer = json_response([(self.seq, comment)])
+                self.answer(connection, poll_answer)
+            self.delivered += 1
+
+    def sse_event(self, seq, comment):
+        return ('id: %d\nevent: comment\ndata: %s\n\n' % (
+            seq, json.dumps(comment, separators=(',', ':')))).encode('utf-8')
+
+    def missed(self, bucket_id, after):
+        if after is None:
+            return []
+        return [(seq, comment) for (seq, comment) in self.backlogs.get(bucket_id, ()) if seq > after]
+
+    # connections
+
+    def accept(self):
+        while True:
+            try:
+                (sock, address) = self.listener.accept()
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ECONNABORTED):
+                    return
+                raise
+            sock.setblocking(0)
+            connection = Connection(sock, time.time())
+            self.connections[connection.fd] = connection
+            self.poller.register(connection.fd, Poller.READ | Poller.ERROR)
+
+    def read(self, connection):
+        try:
+            data = connection.socket.recv(4096)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = b''
+        if not data:
+            self.close(connection)
+            return
+        if connection.mode is not None:
+            # subscribers have nothing more to say
+            return
+        connection.inbuf += data
+        if b'\r\n\r\n' in connection.inbuf:
+            self.subscribe(connection, connection.inbuf.split(b'\r\n\r\n', 1)[0].decode('latin-1'))
+        elif len(connection.inbuf) > MAX_REQUEST_SIZE:
+            self.close(connection)
+
+    def subscribe(self, connection, head):
+        """ route a viewer's request """
+        lines = head.split('\r\n')
+        try:
+            (method, target, version) = lines[0].split(' ', 2)
+            url = urlparse(target)
+            (kind, bucket_id) = url.path.strip('/').split('/')
+            bucket_id = int(bucket_id)
+            query = parse_qs(url.query)
+            headers = dict(line.lower().split(':', 1) for line in lines[1:] if ':' in line)
+            after = query.get('after', [None])[0] or headers.get('last-event-id')
+            after = int(after) if after else None
+        except ValueError:
+            method = kind = None
+        if method != 'GET' or kind not in ('events', 'poll'):
+            connection.mode = LONG_POLL
+            self.answer(connection, NOT_FOUND)
+            return
+
+        connection.bucket_id = bucket_id
+        connection.inbuf = b''
+        missed = self.missed(bucket_id, after)
+        if kind == 'events':
+            connection.mode = SSE
+            self.send(connection, SSE_HEADERS + b''.join(self.sse_event(seq, comment) for (seq, comment) in missed))
+        else:
+            connection.mode = LONG_POLL
+            if missed:
+                self.answer(connection, json_response(missed))
+                return
+        self.subscribers.setdefault(bucket_id, set()).add(connection)
+
+    def answer(self, connection, response):
+        """ answer a long-poll (or a bad request) and hang up """
+        self.unsubscribe(connection)
+        connection.closing = True
+        self.send(connection, response)
+
+    def send(self, connection, data):
+        if connection.fd not in self.connections:
+            return
+        connection.last_write = time.time()
+        if connection.outbuf:
+            connection.outbuf += data
+            if len(connection.outbuf) > self.max_buffer:
+                # too slow to keep up; it will reconnect and catch up from the backlog
+                self.close(connection)
+            return
+        connection.outbuf = data
+        self.flush(connection)
+
+    def flush(self, connection):
+        try:
+            sent = connection.socket.send(connection.outbuf)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                sent = 0
+            else:
+                self.close(connection)
+                return
+        connection.outbuf = connection.outbuf[sent:]
+        if connection.outbuf:
+            self.poller.modify(connection.fd, Poller.READ | Poller.WRITE | Poller.ERROR)
+        elif connection.closing:
+            self.close(connection)
+        else:
+            self.poller.modify(connection.fd, Poller.READ | Poller.ERROR)
+
+    def unsubscribe(self, connection):
+        subscribers = self.subscribers.get(connection.bucket_id)
+        if subscribers is not None:
+            subscribers.discard(connection)
+            if not subscribers:
+                del self.subscribers[connection.bucket_id]
+
+    def close(self, connection):
+        if self.connections.pop(connection.fd, None) is None:
+            return
+        self.unsubscribe(connection)
+        try:
+            self.poller.unregister(connection.fd)
+        except (IOError, OSError, KeyError, ValueError):
+            pass
+        connection.socket.close()
+
+    def housekeep(self, now):
+        """ keep idle event streams alive, time out long-polls and drop idle backlogs """
+        self._housekept = now
+        for connection in list(self.connections.values()):
+            if connection.mode == SSE and now - connection.last_write >= self.keepalive:
+                self.send(connection, KEEPALIVE)
+            elif connection.mode == LONG_POLL and not connection.closing and \
+                    now - connection.opened >= self.poll_timeout:
+                self.answer(connection, NO_CONTENT)
+            elif connection.mode is None and now - connection.opened >= self.poll_timeout:
+                self.close(connection)
+        for (bucket_id, published) in list(self.published.items()):
+            if now - published >= self.backlog_ttl:
+                del self.published[bucket_id]
+                del self.backlogs[bucket_id]
+
+    def shutdown(self):
+        for connection in list(self.connections.values()):
+            self.close(connection)
+        self.poller.unregister(self.listener.fileno())
+        self.listener.close()
+        if self.inbox is not None:
+            path = self.inbox.getsockname()
+            self.inbox.close()
+            if path and os.path.exists(path):
+                os.unlink(path)
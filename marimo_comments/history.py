@@ -0,0 +1,93 @@
+"""
+A user's comment history, across every bucket
+
+Newest first, walked with keyset cursors (util/cursors.py) over the
+``(user_id, submit_date, id)`` index in sql/marimocomment.sql. Every page is
+a range scan of that index, so page 2500 of a user with 50k comments costs
+the same as page 1; there are no page numbers to jump to, only ``next`` and
+``prev`` cursors.
+
+Each page resolves the buckets of its comments in one query and their
+content object urls in bulk (resolver.get_content_object_urls), so the cost
+of a page doesn't grow with the number of buckets it spans either.
+"""
+from marimo_comments import constants, resolver, serialization
+from marimo_comments.models import (MarimoComment, MarimoCommentBucket, build_comment_url, get_num_pages,
+                                    get_page_for_position)
+from marimo_comments.util import cursors
+
+# the CommentRow columns, then the bucket
+HISTORY_ROW_FIELDS = serialization.COMMENT_ROW_FIELDS + ('bucket',)
+
+
+def get_user_history(user_id, cursor=None, site_id=None, per_page=constants.COMMENTS_PER_PAGE):
+    """
+    A page of the visible comments of a user, newest first.
+
+    :param cursor: ``next_cursor`` or ``prev_cursor`` of an earlier page;
+        None for the newest comments
+    :param site_id: only comments on content of this site
+    :returns: dict of ``comments`` (serialized like the widget's, plus the
+        ``bucket_id``, ``content_type_id``, ``object_id``, ``site_id`` and
+        ``content_url`` of each), ``page``, ``next_cursor`` (older comments)
+        and ``prev_cursor`` (newer comments); permalinks and content urls
+        are None where the content object is gone
+    :raises cursors.InvalidCursor: if the cursor can't be decoded
+    """
+    comments = MarimoComment.objects.filter(user=user_id, is_removed=False)
+    if site_id is not None:
+        comments = comments.filter(bucket__originating_site=site_id)
+    comments = comments.values_list(*HISTORY_ROW_FIELDS)
+
+    if cursor is None:
+        (page, submit_date, comment_id, older) = (1, None, None, True)
+    else:
+        (direction, submit_date, comment_id, page) = cursors.decode_cursor(cursor)
+        # older comments sort before the cursor's comment
+        older = direction == cursors.PREV
+    (values, has_more) = cursors.seek(comments, submit_date, comment_id, forward=not older, limit=per_page)
+    values.reverse()
+
+    if older:
+        (has_newer, has_older) = (page > 1, has_more)
+    else:
+        (has_newer, has_older) = (has_more, True)
+    return {
+        'comments': serialize_history(values),
+        'page': page,
+        'next_cursor': cursors.encode_cursor(cursors.PREV, values[-1][3], values[-1][0], page + 1)
+        if values and has_older else None,
+        'prev_cursor': cursors.encode_cursor(cursors.NEXT, values[0][3], values[0][0], max(1, page - 1))
+        if values and has_newer else None,
+    }
+
+
+def serialize_history(values):
+    """
+    :param values: tuples of HISTORY_ROW_FIELDS
+    """
+    rows = serialization.to_rows([value[:-1] for value in values])
+    bucket_ids = set(value[-1] for value in values)
+    buckets = dict((row[0], row[1:]) for row in MarimoCommentBucket.objects.filter(pk__in=bucket_ids).values_list(
+        'pk', 'content_type', 'object_id', 'originating_site', 'comment_count')) if bucket_ids else {}
+    urls = resolver.get_content_object_urls(bucket[:2] for bucket in buckets.values())
+
+    hrefs = []
+    for (row, value) in zip(rows, values):
+        (content_type_id, object_id, site_id, comment_count) = buckets[value[-1]]
+        burl = urls.get((content_type_id, object_id))
+        # only comments without a position fall back to the bucket's last page
+        page = get_num_pages(comment_count) if row.position is None else get_page_for_position(row.position)
+        hrefs.append(None if burl is None else build_comment_url(burl, page, row.pk))
+
+    serialized = serialization.serialize_comments(rows, hrefs)
+    for (comment, value) in zip(serialized, values):
+        (content_type_id, object_id, site_id, comment_count) = buckets[value[-1]]
+        comment.update({
+            'bucket_id': value[-1],
+            'content_type_id': content_type_id,
+            'object_id': object_id,
+            'site_id': site_id,
+            'content_url': urls.get((content_type_id, object_id)),
+        })
+    return serialized
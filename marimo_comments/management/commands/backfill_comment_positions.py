@@ -0,0 +1,33 @@
+"""
+Assign per-bucket positions to comments which don't have one yet
+"""
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from marimo_comments.models import MarimoComment, MarimoCommentBucket
+
+
+class Command(BaseCommand):
+    args = '[bucket_id bucket_id ...]'
+    help = ('Number the visible comments of every bucket that has visible comments without a position (or of '
+            'the given buckets) in (submit_date, id) order, and reset the bucket sequence to match. Run it once '
+            'after upgrading: until a bucket is numbered, its pages are read with OFFSET.')
+    option_list = BaseCommand.option_list + (
+        make_option('--all', action='store_true', dest='all', default=False,
+                    help='Renumber every bucket, not only the ones with unnumbered comments.'),
+    )
+
+    def handle(self, *args, **options):
+        if args:
+            bucket_ids = [int(bucket_id) for bucket_id in args]
+        elif options['all']:
+            bucket_ids = MarimoCommentBucket.objects.values_list('pk', flat=True).order_by('pk')
+        else:
+            bucket_ids = MarimoComment.objects.filter(position__isnull=True, is_removed=False).values_list(
+                'bucket', flat=True).order_by('bucket').distinct()
+
+        bucket_ids = list(bucket_ids)
+        numbered = MarimoCommentBucket.objects.renumber(bucket_ids)
+        MarimoCommentBucket.objects.refresh_caches(bucket_ids)
+        self.stdout.write('Numbered %d comment(s) in %d bucket(s)\n' % (numbered, len(bucket_ids)))
@@ -0,0 +1,74 @@
+"""
+Benchmark the comment read and write hot paths
+"""
+import json
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from marimo_comments.benchmarks import fanout, flood, history, hotpaths, purge
+
+
+class Command(BaseCommand):
+    help = ('Time the widget, post() and count lookups against the configured database and cache, and write '
+            'the results as JSON. Use --seed on a scratch database to create the benchmark data first.')
+    option_list = BaseCommand.option_list + (
+        make_option('--seed', action='store_true', dest='seed', default=False,
+                    help='Create benchmark users, buckets and comments first. Writes to the database!'),
+        make_option('--buckets', type='int', dest='buckets', default=200,
+                    help='Number of buckets to seed.'),
+        make_option('--comments', type='int', dest='comments', default=50000,
+                    help='Approximate number of comments to seed.'),
+        make_option('--iterations', type='int', dest='iterations', default=100,
+                    help='Calls per benchmark.'),
+        make_option('--site', type='int', dest='site_id', default=1,
+                    help='Site id to seed and benchmark.'),
+        make_option('--flood', action='store_true', dest='flood', default=False,
+                    help='Also load test post() with mostly abusive traffic, see benchmarks/flood.py.'),
+        make_option('--fanout', type='int', dest='fanout', default=0,
+                    help='Also push comments to this many live viewers, see benchmarks/fanout.py.'),
+        make_option('--purge', type='int', dest='purge', default=0,
+                    help='Also hide, show and delete this many spam comments, see benchmarks/purge.py. '
+                         'Writes to the database!'),
+        make_option('--history', type='int', dest='history', default=0,
+                    help='Also page through the history of a user with this many comments, see '
+                         'benchmarks/history.py. Writes to the database!'),
+        make_option('--label', dest='label', default='',
+                    help='Label stored with the results, e.g. a commit hash.'),
+        make_option('--output', dest='output', default=None,
+                    help='Write JSON results to this file instead of stdout.'),
+        make_option('--compare', dest='compare', default=None,
+                    help='JSON results of an earlier run to print p50 and query count changes against.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            created = hotpaths.seed(buckets=options['buckets'], comments=options['comments'],
+                                    site_id=options['site_id'])
+            sys.stderr.write('Seeded %d buckets, %d comments\n' % (len(created), sum(c[3] for c in created)))
+
+        results = hotpaths.run(iterations=options['iterations'], site_id=options['site_id'])
+        if options['flood']:
+            results.update(flood.run(requests=options['iterations'] * 10, site_id=options['site_id']))
+        if options['fanout']:
+            results.update(fanout.run(connections=options['fanout'], messages=options['iterations']))
+        if options['purge']:
+            results.update(purge.run(comments=options['purge'], site_id=options['site_id']))
+        if options['history']:
+            results.update(history.run(comments=options['history'], iterations=options['iterations'],
+                                       site_id=options['site_id']))
+
+        if options['output']:
+            with open(options['output'], 'w') as fp:
+                hotpaths.dump(results, options['label'], fp)
+        else:
+            hotpaths.dump(results, options['label'], self.stdout)
+            self.stdout.write('\n')
+
+        if options['compare']:
+            with open(options['compare']) as fp:
+                baseline = json.load(fp)['results']
+            for (name, old_p50, p50, old_queries, queries) in hotpaths.compare(results, baseline):
+                sys.stderr.write('%-45s p50 %8.2fms -> %8.2fms   queries %5.1f -> %5.1f\n' % (
+                    name, old_p50, p50, old_queries, queries))
@@ -0,0 +1,52 @@
+"""
+Freeze the comment buckets of content nobody has commented on for a while
+"""
+import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import reset_queries
+from django.db.models import Q
+
+from marimo_comments import constants, snapshots
+from marimo_comments.models import MarimoCommentBucket
+
+
+class Command(BaseCommand):
+    help = ('Freeze buckets whose comments have not changed for --days days: they stop taking comments and '
+            'are served from a snapshot. Also rebuilds the snapshots of frozen buckets that went stale.')
+    option_list = BaseCommand.option_list + (
+        make_option('--days', type='int', dest='days', default=None,
+                    help='Freeze buckets inactive for this many days.'),
+    )
+
+    def handle(self, *args, **options):
+        if not options['days'] or options['days'] < 1:
+            raise CommandError('--days must be a positive number of days')
+        cutoff = datetime.datetime.now() - datetime.timedelta(days=options['days'])
+
+        # only buckets left to the default rules; "Enabled" ones were opened on purpose
+        inactive = MarimoCommentBucket.objects.filter(status=constants.COMMENTS_DEFAULT_STATUS).filter(
+            Q(last_modified__lt=cutoff) | Q(last_modified__isnull=True, last_comment_at__lt=cutoff))
+        bucket_ids = list(inactive.values_list('pk', flat=True))
+
+        stale = MarimoCommentBucket.objects.filter(status=constants.COMMENTS_FROZEN_STATUS).values_list(
+            'pk', 'last_modified', 'snapshot__bucket_modified', 'snapshot__created')
+        bucket_ids.extend(bucket_id for (bucket_id, last_modified, bucket_modified, created) in stale.iterator()
+                          if created is None or bucket_modified != last_modified)
+
+        frozen = skipped = 0
+        for bucket_id in bucket_ids:
+            try:
+                bucket = MarimoCommentBucket.objects.get(pk=bucket_id)
+                snapshots.freeze(bucket)
+                frozen += 1
+            except MarimoCommentBucket.DoesNotExist:
+                continue
+            except snapshots.NotNumbered:
+                skipped += 1
+                self.stderr.write('Bucket %d has comments without a position, run backfill_comment_positions\n'
+                                  % bucket_id)
+            reset_queries()
+
+        self.stdout.write('Froze %d bucket(s), skipped %d\n' % (frozen, skipped))
@@ -0,0 +1,181 @@
+"""
+Bulk load django.contrib.comments into marimo comment buckets
+"""
+from optparse import make_option
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import ipv4_re
+from django.db import IntegrityError, connections, reset_queries, router, transaction
+from django.db.models import AutoField, Q
+
+from marimo_comments.models import (COMMENT_MAX_LENGTH, MarimoComment, MarimoCommentBucket,
+                                    MarimoCommentImportCheckpoint)
+
+SOURCE_FIELDS = ('pk', 'content_type', 'object_pk', 'site', 'user', 'comment', 'submit_date', 'ip_address',
+                 'is_public', 'is_removed')
+
+
+class Command(BaseCommand):
+    help = ('Copy django.contrib.comments comments into marimo comments in chunks. Can be interrupted and '
+            'resumed with --checkpoint; positions, counters and count caches are rebuilt at the end.')
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=1000,
+                    help='Number of source comments read and inserted per transaction.'),
+        make_option('--checkpoint', dest='checkpoint', default=None,
+                    help='Name under which the last imported source comment id is recorded (in the '
+                         'marimo_comments_marimocommentimportcheckpoint table), to resume from.'),
+        make_option('--include-removed', action='store_true', dest='include_removed', default=False,
+                    help='Also import comments that are removed or not public.'),
+        make_option('--skip-rebuild', action='store_true', dest='skip_rebuild', default=False,
+                    help="Don't number comments and rebuild counters once the import is done."),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            from django.contrib.comments.models import Comment
+        except ImportError:
+            raise CommandError('django.contrib.comments is not available')
+
+        batch_size = options['batch_size']
+        checkpoint = options['checkpoint']
+        last_pk = read_checkpoint(checkpoint)
+
+        source = Comment.objects.order_by('pk')
+        if not options['include_removed']:
+            source = source.filter(is_public=True, is_removed=False)
+        source = source.values_list(*SOURCE_FIELDS)
+
+        imported = 0
+        while True:
+            # seek on the primary key rather than OFFSET or one huge cursor:
+            # every chunk is an index range scan and memory stays bounded
+            rows = list(source.filter(pk__gt=last_pk)[:batch_size])
+            if not rows:
+                break
+
+            (inserted, skipped, unaddressed) = import_chunk(rows, checkpoint)
+            imported += inserted
+            for pk in skipped:
+                self.stderr.write('Skipped source comment %d: its object_pk is not an integer\n' % pk)
+            for pk in unaddressed:
+                self.stderr.write('Dropped the IP address of source comment %d: not an IPv4 address\n' % pk)
+            last_pk = rows[-1][0]
+            reset_queries()
+            self.stdout.write('Imported %d comment(s), up to source id %d\n' % (imported, last_pk))
+
+        if not options['skip_rebuild']:
+            call_command('backfill_comment_positions')
+            updated = MarimoCommentBucket.objects.rebuild_counts()
+            self.stdout.write('Rebuilt counters of %d bucket(s)\n' % updated)
+
+
+def import_chunk(rows, checkpoint=None):
+    """
+    Insert one chunk of source rows, creating whatever buckets it needs, and
+    move the ``checkpoint`` past it in the same transaction: an import that
+    is killed half way never copies a chunk twice when it is resumed.
+
+    Rows on objects without an integer primary key are skipped, since buckets
+    only point at integer primary keys. IPv6 addresses don't fit the
+    15 character ``ip_address`` column and are imported as NULL.
+
+    :returns: tuple of the number of comments inserted, the source ids of the
+        skipped rows and the source ids of the rows whose IP address was dropped
+    """
+    last_pk = rows[-1][0]
+    skipped = [row[0] for row in rows if not row[2].isdigit()]
+    rows = [row for row in rows if row[2].isdigit()]
+    unaddressed = [row[0] for row in rows if row[7] and not ipv4_re.match(row[7])]
+    keys = set((row[1], int(row[2]), row[3]) for row in rows)
+    bucket_ids = resolve_buckets(keys)
+
+    comments = [MarimoComment(bucket_id=bucket_ids[(content_type_id, int(object_pk), site_id)], user_id=user_id,
+                              text=text[:COMMENT_MAX_LENGTH], submit_date=submit_date,
+                              ip_address=ip_address if ip_address and ipv4_re.match(ip_address) else None,
+                              is_removed=is_removed or not is_public)
+                for (pk, content_type_id, object_pk, site_id, user_id, text, submit_date, ip_address, is_public,
+                     is_removed) in rows]
+
+    using = router.db_for_write(MarimoComment)
+    with transaction.commit_on_success(using=using):
+        bulk_insert(MarimoComment, comments, using)
+        if checkpoint:
+            write_checkpoint(checkpoint, last_pk, using)
+    return (len(comments), skipped, unaddressed)
+
+
+def bulk_insert(model, objs, using):
+    """
+    Insert ``objs`` without calling save() or sending signals: with
+    bulk_create where there is one (Django 1.4+), with a single executemany
+    otherwise. Must be called in a transaction.
+    """
+    if hasattr(model.objects, 'bulk_create'):
+        model.objects.using(using).bulk_create(objs)
+        return
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    fields = [f for f in model._meta.local_fields if not isinstance(f, AutoField)]
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (qn(model._meta.db_table), ', '.join(qn(f.column) for f in fields),
+                                               ', '.join(['%s'] * len(fields)))
+    connection.cursor().executemany(sql, [[f.get_db_prep_save(f.pre_save(obj, True), connection=connection)
+                                           for f in fields] for obj in objs])
+    transaction.set_dirty(using=using)
+
+
+def resolve_buckets(keys):
+    """
+    Map ``(content_type_id, object_id, site_id)`` keys to bucket ids, bulk
+    creating the buckets which don't exist yet.
+
+    :returns: dict of key to bucket id
+    """
+    bucket_ids = find_buckets(keys)
+    missing = keys.difference(bucket_ids)
+    if missing:
+        using = router.db_for_write(MarimoCommentBucket)
+        try:
+            with transaction.commit_on_success(using=using):
+                bulk_insert(MarimoCommentBucket, [
+                    MarimoCommentBucket(content_type_id=content_type_id, object_id=object_id,
+                                        originating_site_id=site_id)
+                    for (content_type_id, object_id, site_id) in missing], using)
+        except IntegrityError:
+            # somebody commented on one of these while we were importing
+            for (content_type_id, object_id, site_id) in missing:
+                MarimoCommentBucket.objects.get_or_create(content_type_id=content_type_id, object_id=object_id,
+                                                          originating_site_id=site_id)
+        bucket_ids.update(find_buckets(missing))
+    return bucket_ids
+
+
+def find_buckets(keys):
+    """ look up the ids of existing buckets for ``keys`` in a single query """
+    grouped = {}
+    for (content_type_id, object_id, site_id) in keys:
+        grouped.setdefault((content_type_id, site_id), []).append(object_id)
+    query = Q()
+    for (content_type_id, site_id), object_ids in grouped.items():
+        query |= Q(content_type=content_type_id, originating_site=site_id, object_id__in=object_ids)
+
+    return dict(((content_type_id, object_id, site_id), pk) for (pk, content_type_id, object_id, site_id) in
+                MarimoCommentBucket.objects.filter(query).order_by().values_list(
+                    'pk', 'content_type', 'object_id', 'originating_site'))
+
+
+def read_checkpoint(checkpoint):
+    if checkpoint:
+        # from the database the comments go to, see write_checkpoint
+        last_pks = MarimoCommentImportCheckpoint.objects.using(router.db_for_write(MarimoComment)).filter(
+            name=checkpoint).values_list('last_pk', flat=True)
+        if last_pks:
+            return last_pks[0]
+    return 0
+
+
+def write_checkpoint(checkpoint, last_pk, using):
+    """ must be called in the transaction that imported the source comments up to ``last_pk`` """
+    checkpoints = MarimoCommentImportCheckpoint.objects.using(using)
+    if not checkpoints.filter(name=checkpoint).update(last_pk=last_pk):
+        checkpoints.create(name=checkpoint, last_pk=last_pk)
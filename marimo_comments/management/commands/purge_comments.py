@@ -0,0 +1,72 @@
+"""
+Hide or delete comments by poster, IP address or date range
+"""
+import datetime
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from marimo_comments import moderation
+
+DATE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d')
+
+
+def parse_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    raise CommandError('Bad date %r, use YYYY-MM-DD[ HH:MM[:SS]]' % value)
+
+
+class Command(BaseCommand):
+    help = ('Delete (or with --hide, hide) every comment matching all of the given --user, --ip, --since and '
+            '--until options, then recompute the affected buckets\' counters and caches.')
+    option_list = BaseCommand.option_list + (
+        make_option('--user', action='append', dest='users', default=None,
+                    help='Username or user id of a poster; repeat for several.'),
+        make_option('--ip', action='append', dest='ip_addresses', default=None,
+                    help='IP address the comments were posted from; repeat for several.'),
+        make_option('--since', dest='since', default=None,
+                    help='Comments submitted at or after this date (YYYY-MM-DD[ HH:MM[:SS]]).'),
+        make_option('--until', dest='until', default=None,
+                    help='Comments submitted before this date (YYYY-MM-DD[ HH:MM[:SS]]).'),
+        make_option('--hide', action='store_const', dest='action', const='hide', default='delete',
+                    help='Hide the comments instead of deleting them.'),
+        make_option('--show', action='store_const', dest='action', const='show',
+                    help='Show hidden comments again.'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+                    help='Only count the matching comments.'),
+    )
+
+    def handle(self, *args, **options):
+        users = None
+        if options['users']:
+            users = set()
+            for user in options['users']:
+                found = User.objects.filter(username=user).values_list('pk', flat=True)
+                if not found and user.isdigit():
+                    found = [int(user)]
+                if not found:
+                    raise CommandError('No such user: %s' % user)
+                users.update(found)
+        since = parse_date(options['since']) if options['since'] else None
+        until = parse_date(options['until']) if options['until'] else None
+
+        try:
+            comments = moderation.select_comments(users=users, ip_addresses=options['ip_addresses'], since=since,
+                                                  until=until)
+        except ValueError:
+            raise CommandError('Give at least one of --user, --ip, --since or --until')
+
+        if options['dry_run']:
+            self.stdout.write('%d comment(s) match\n' % comments.count())
+            return
+        if options['action'] == 'hide':
+            self.stdout.write('Hid %d comment(s)\n' % moderation.hide_comments(comments))
+        elif options['action'] == 'show':
+            self.stdout.write('Showed %d comment(s)\n' % moderation.show_comments(comments))
+        else:
+            self.stdout.write('Deleted %d comment(s)\n' % moderation.delete_comments(comments))
@@ -0,0 +1,17 @@
+"""
+Correct drift in the "most commented" leaderboard rollups, see marimo_comments.rollups
+"""
+from django.core.management.base import BaseCommand
+
+from marimo_comments import rollups
+
+
+class Command(BaseCommand):
+    args = '[bucket_id bucket_id ...]'
+    help = ('Recount the retained leaderboard slices of all buckets, or only the given bucket ids, from the '
+            'comments; without bucket ids, also drop the slices past retention.')
+
+    def handle(self, *args, **options):
+        bucket_ids = [int(bucket_id) for bucket_id in args] or None
+        changed = rollups.reconcile(bucket_ids)
+        self.stdout.write('Corrected %d rollup(s)\n' % changed)
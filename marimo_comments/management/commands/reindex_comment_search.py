@@ -0,0 +1,53 @@
+"""
+Create and fill the full-text index over comment text, see marimo_comments.search
+"""
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import reset_queries, router, transaction
+
+from marimo_comments import search
+from marimo_comments.models import MarimoComment
+
+
+class Command(BaseCommand):
+    help = ('Create the full-text index over comment text (--install) and, where the database does not maintain '
+            'it itself (sqlite), fill it in chunks of comments.')
+    option_list = BaseCommand.option_list + (
+        make_option('--install', action='store_true', dest='install', default=False,
+                    help='Create the index first.'),
+        make_option('--batch-size', type='int', dest='batch_size', default=1000,
+                    help='Number of comments read and indexed per transaction.'),
+        make_option('--start', type='int', dest='start', default=0,
+                    help='Resume after this comment id.'),
+    )
+
+    def handle(self, *args, **options):
+        using = router.db_for_write(MarimoComment)
+        try:
+            backend = search.get_backend(using)
+        except search.SearchUnavailable as e:
+            raise CommandError('No full-text search for %s databases' % e)
+
+        if options['install']:
+            backend.install()
+            self.stdout.write('Installed the search index\n')
+        if not backend.needs_sync:
+            self.stdout.write('The database keeps the search index current itself\n')
+            return
+
+        last_pk = options['start']
+        indexed = 0
+        source = MarimoComment.objects.using(using).order_by('pk').values_list('pk', 'text')
+        while True:
+            # seek on the primary key: every chunk is a short index range
+            # read, so writers are never held up behind a table scan
+            rows = list(source.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not rows:
+                break
+            with transaction.commit_on_success(using=using):
+                backend.index(rows)
+            indexed += len(rows)
+            last_pk = rows[-1][0]
+            reset_queries()
+            self.stdout.write('Indexed %d comment(s), up to id %d\n' % (indexed, last_pk))
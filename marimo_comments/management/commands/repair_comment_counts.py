@@ -0,0 +1,16 @@
+"""
+Recompute the denormalized comment counters on MarimoCommentBucket
+"""
+from django.core.management.base import BaseCommand
+
+from marimo_comments.models import MarimoCommentBucket
+
+
+class Command(BaseCommand):
+    args = '[bucket_id bucket_id ...]'
+    help = 'Repair comment_count and last_comment_at for all buckets, or only the given bucket ids.'
+
+    def handle(self, *args, **options):
+        bucket_ids = [int(bucket_id) for bucket_id in args] or None
+        updated = MarimoCommentBucket.objects.rebuild_counts(bucket_ids)
+        self.stdout.write('Repaired %d bucket(s)\n' % updated)
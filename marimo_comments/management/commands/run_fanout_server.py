@@ -0,0 +1,41 @@
+"""
+Run the live comment push server, see marimo_comments.fanout
+"""
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from marimo_comments import fanout
+
+
+class Command(BaseCommand):
+    help = ('Push new comments to viewers subscribed over server-sent events or long-polling. Set '
+            'MARIMO_COMMENTS_FANOUT_CHANNEL to marimo_comments.fanout.UnixSocketChannel for post() to publish to it.')
+    option_list = BaseCommand.option_list + (
+        make_option('--host', dest='host', default='127.0.0.1',
+                    help='Address to listen on for viewers.'),
+        make_option('--port', type='int', dest='port', default=8765,
+                    help='Port to listen on for viewers.'),
+        make_option('--socket', dest='socket', default=None,
+                    help='Unix socket new comments are published to (MARIMO_COMMENTS_FANOUT_SOCKET).'),
+        make_option('--keepalive', type='int', dest='keepalive', default=15,
+                    help='Seconds between keepalives on idle event streams.'),
+        make_option('--poll-timeout', type='int', dest='poll_timeout', default=30,
+                    help='Seconds a long-poll is held open.'),
+        make_option('--backlog-ttl', type='int', dest='backlog_ttl', default=600,
+                    help='Seconds a bucket\'s backlog is kept for reconnecting viewers after its last comment.'),
+    )
+
+    def handle(self, *args, **options):
+        socket_path = options['socket'] or getattr(settings, 'MARIMO_COMMENTS_FANOUT_SOCKET', fanout.DEFAULT_SOCKET)
+        server = fanout.FanoutServer((options['host'], options['port']), socket_path,
+                                     keepalive=options['keepalive'], poll_timeout=options['poll_timeout'],
+                                     backlog_ttl=options['backlog_ttl'])
+        self.stdout.write('Listening on %s:%d, publishing through %s\n' % (server.address + (socket_path,)))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
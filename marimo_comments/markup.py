@@ -0,0 +1,251 @@
+"""
+Comment markup cleaning
+
+Comments may only contain ``<b>`` and ``<br>``. This used to be done with
+``allowtags(text, 'b br')`` from django-sanitizer followed by replacing
+``<br />`` with newlines; that builds a full BeautifulSoup tree for every
+post, walks it and renders it again. ``clean_comment_text`` produces the same
+output while the text is tokenized: it feeds the text to the same sgmllib
+parser BeautifulSoup 3 uses and applies BeautifulSoup's tree building rules
+as tags come in, keeping only the state those rules need: the stack of open
+tag names.
+
+The old pipeline's behaviour is kept on purpose, quirks included. Disallowed
+tags are unwrapped but keep their text. Whitespace-only text between tags
+collapses to a single space or newline. Character and entity references are
+converted to the characters they stand for (an unknown one, such as the
+``&T`` of ``AT&T``, keeps its ampersand), bare ``&``, ``<`` and ``>`` are
+escaped, and the text of declarations and processing instructions is kept
+as text. Markup left unterminated at the end of the text is dropped, and so
+is ``javascript:``.
+
+Where allowtags raises (non-ASCII end tag names, character references past
+the last code point) the text is cleaned all the same.
+"""
+import re
+import sgmllib
+from htmlentitydefs import name2codepoint
+
+# BeautifulSoup's markup massage, applied before tokenizing
+MARKUP_MASSAGE = (
+    (re.compile('(<[^<>]*)/>'), lambda m: m.group(1) + ' />'),
+    (re.compile(r'<!\s+([^<>]*)>'), lambda m: '<!' + m.group(1) + '>'),
+)
+
+# allowtags' text escaping: django.utils.html.fix_ampersands, then the brackets
+UNENCODED_AMPERSAND = re.compile(r'&(?!(\w+|#\d+);)')
+
+WHITESPACE = ' \t\n\r\f'
+
+# BeautifulSoup's (HTML) tag nesting rules
+SELF_CLOSING_TAGS = frozenset(('br', 'hr', 'input', 'img', 'meta', 'spacer', 'link', 'frame', 'base', 'col'))
+PRESERVE_WHITESPACE_TAGS = frozenset(('pre', 'textarea'))
+QUOTE_TAGS = frozenset(('script', 'textarea'))
+NESTABLE_LIST_TAGS = {'ol': (), 'ul': (), 'li': ('ul', 'ol'), 'dl': (), 'dd': ('dl',), 'dt': ('dl',)}
+NESTABLE_TABLE_TAGS = {'table': (), 'tr': ('table', 'tbody', 'tfoot', 'thead'), 'td': ('tr',), 'th': ('tr',),
+                       'thead': ('table',), 'tbody': ('table',), 'tfoot': ('table',)}
+NESTABLE_TAGS = dict(NESTABLE_LIST_TAGS, **NESTABLE_TABLE_TAGS)
+NESTABLE_TAGS.update((name, ()) for name in ('span', 'font', 'q', 'object', 'bdo', 'sub', 'sup', 'center',
+                                             'blockquote', 'div', 'fieldset', 'ins', 'del'))
+RESET_NESTING_TAGS = frozenset(('blockquote', 'div', 'fieldset', 'ins', 'del', 'noscript', 'address', 'form', 'p',
+                                'pre') + tuple(NESTABLE_LIST_TAGS) + tuple(NESTABLE_TABLE_TAGS))
+
+
+class _Cleaner(sgmllib.SGMLParser):
+    """ the state of one clean_comment_text call """
+
+    def __init__(self):
+        sgmllib.SGMLParser.__init__(self)
+        self.out = []
+        self.data = []
+        # open tags, innermost last; only their names matter
+        self.open_tags = []
+        self.quote_stack = []
+        # <b> doesn't nest, so there's at most one open: its depth and its number of children
+        self.bold_depth = None
+        self.bold_children = 0
+        # a <br> in the open <b>: (its index among the children, where the output after it
+        # starts, and the start and kind of every child after it), see split_bold
+        self.split = None
+
+    # tree building
+
+    def handle_data(self, data):
+        self.data.append(data)
+
+    def end_data(self):
+        if self.data:
+            data = u''.join(self.data)
+            self.data = []
+            if not data.strip(WHITESPACE) and not PRESERVE_WHITESPACE_TAGS.intersection(self.open_tags):
+                data = '\n' if '\n' in data else ' '
+            self.child(True)
+            self.out.append(UNENCODED_AMPERSAND.sub('&amp;', data).replace('<', '&lt;').replace('>', '&gt;'))
+
+    def text_node(self, text):
+        """ declarations and processing instructions: nodes of their own, output as text """
+        self.end_data()
+        self.handle_data(text)
+        self.end_data()
+
+    def child(self, is_text):
+        """ count a node about to be output, if it is a child of the open <b> """
+        if self.bold_depth == len(self.open_tags):
+            if self.split:
+                self.split[2].append((len(self.out), is_text))
+            self.bold_children += 1
+
+    def push(self, name):
+        self.child(False)
+        self.open_tags.append(name)
+        if name == 'b':
+            (self.bold_depth, self.bold_children) = (len(self.open_tags), 0)
+            self.out.append('<b>')
+
+    def pop(self):
+        if self.open_tags.pop() == 'b':
+            if self.split:
+                self.split_bold()
+            self.bold_depth = None
+            self.out.append('</b>')
+
+    def pop_to(self, name, inclusive=True):
+        for i in range(len(self.open_tags) - 1, -1, -1):
+            if self.open_tags[i] == name:
+                if not inclusive:
+                    i += 1
+                while len(self.open_tags) > i:
+                    self.pop()
+                return
+
+    def split_bold(self):
+        """
+        allowtags doesn't allow a <br> inside <b>. It moves the <br> out after
+        the <b>, followed by a new <b> for the children after it, and indexes
+        the old <b>'s children as if the <br> and the tags it already moved
+        were still there: text can end up in both <b>s, and tags can go
+        missing from the old one.
+        """
+        (before, start, children) = self.split
+        self.split = None
+        ends = [child_start for (child_start, is_text) in children[1:]] + [len(self.out)]
+        children = [(is_text, u''.join(self.out[child_start:end]))
+                    for ((child_start, is_text), end) in zip(children, ends)]
+        kept = [None] * before + range(len(children))
+        moved = []
+        for (k, (is_text, html)) in enumerate(children):
+            i = before + k
+            if is_text:
+                if i < len(kept):
+                    kept[i] = None
+            elif k in kept:
+                kept.remove(k)
+            moved.insert(i, k)
+        self.out[start:] = ([children[k][1] for k in kept if k is not None] + ['</b>', '\n', '<b>'] +
+                            [children[k][1] for k in moved])
+
+    def smart_pop(self, name):
+        triggers = NESTABLE_TAGS.get(name)
+        resets = triggers is None and name in RESET_NESTING_TAGS
+        for open_tag in reversed(self.open_tags):
+            if open_tag == name and triggers is None:
+                self.pop_to(name)
+                return
+            if (triggers is not None and open_tag in triggers) or (resets and open_tag in RESET_NESTING_TAGS):
+                self.pop_to(open_tag, inclusive=False)
+                return
+
+    # sgmllib callbacks
+
+    def finish_starttag(self, name, attrs):
+        # no start_<tag> methods to look up; looking one up for a non-ASCII name would raise
+        if self.quote_stack:
+            # inside <script> or <textarea>: not a real tag
+            self.handle_data('<%s%s>' % (name, ''.join([' %s="%s"' % attr for attr in attrs])))
+            return
+        self.end_data()
+        if name in SELF_CLOSING_TAGS:
+            if name == 'br' and self.bold_depth == len(self.open_tags) and not self.split:
+                self.split = (self.bold_children, len(self.out), [])
+                self.bold_children += 1
+            else:
+                self.child(False)
+                if name == 'br':
+                    # the old pipeline rendered <br /> and then replaced it
+                    self.out.append('\n')
+            return
+        self.smart_pop(name)
+        self.push(name)
+        if name in QUOTE_TAGS:
+            self.quote_stack.append(name)
+            self.literal = True
+
+    def finish_endtag(self, name):
+        if self.quote_stack and self.quote_stack[-1] != name:
+            self.handle_data('</%s>' % name)
+            return
+        self.end_data()
+        self.pop_to(name)
+        if self.quote_stack and self.quote_stack[-1] == name:
+            self.quote_stack.pop()
+            self.literal = bool(self.quote_stack)
+
+    def handle_charref(self, ref):
+        try:
+            self.handle_data(unichr(int(ref)))
+        except (ValueError, OverflowError):
+            self.handle_data(u'\ufffd')
+
+    def handle_entityref(self, name):
+        if name in name2codepoint:
+            self.handle_data(unichr(name2codepoint[name]))
+        elif name == 'apos':
+            # an XML entity, but not an HTML one
+            self.handle_data('&apos;')
+        else:
+            # most likely a misplaced ampersand
+            self.handle_data('&amp;' + name)
+
+    def handle_comment(self, text):
+        self.end_data()
+
+    def handle_decl(self, text):
+        self.text_node(text)
+
+    def handle_pi(self, text):
+        if text[:3] == 'xml':
+            text = u"xml version='1.0' encoding='%SOUP-ENCODING%'"
+        self.text_node(text)
+
+    def parse_declaration(self, i):
+        if self.rawdata[i:i + 9] == '<![CDATA[':
+            k = self.rawdata.find(']]>', i)
+            if k == -1:
+                k = len(self.rawdata)
+            self.text_node(self.rawdata[i + 9:k])
+            return k + 3
+        try:
+            return sgmllib.SGMLParser.parse_declaration(self, i)
+        except sgmllib.SGMLParseError:
+            # a bogus declaration is text, up to the end
+            self.handle_data(self.rawdata[i:])
+            return len(self.rawdata)
+
+    def clean(self, text):
+        # like BeautifulSoup, feed without close(): whatever is left unterminated is dropped
+        self.feed(text)
+        self.end_data()
+        while self.open_tags:
+            self.pop()
+        return u''.join(self.out).replace('javascript:', '')
+
+
+def clean_comment_text(text):
+    """
+    Strip everything but ``<b>`` and ``<br>`` from comment text; ``<br>``
+    becomes a newline. Same output as
+    ``allowtags(text, 'b br').replace('<br />', '\\n')``.
+    """
+    for (fix, massage) in MARKUP_MASSAGE:
+        text = fix.sub(massage, text)
+    return _Cleaner().clean(text)
@@ -1,17 +1,178 @@
+import base64
 import datetime
+import json
+import zlib
+from contextlib import contextmanager
 
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.contenttypes import generic
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
-from django.db import models
+from django.db import connections, models, router, transaction
+from django.db.models import Count, F, Max, Q
+from django.db.models.signals import post_delete, post_save, pre_delete
 from django.utils.translation import ugettext_lazy as _
 
-from marimo_comments import constants
+from marimo_comments import caching, constants
 
 COMMENT_MAX_LENGTH = 3000
 
 
+class MarimoCommentBucketManager(models.Manager):
+
+    def rebuild_counts(self, bucket_ids=None):
+        """
+        Recompute the denormalized ``comment_count`` and ``last_comment_at``
+        columns from the comments table's visible comments. Only needed to
+        repair drift (raw sql, fixtures loaded with ``raw=True``, etc), normal
+        writes keep them current.
+
+        :param bucket_ids: optional list of bucket ids to limit the repair to
+        :returns: number of buckets that were updated
+        """
+        buckets = self.get_query_set()
+        comments = MarimoComment.objects.filter(is_removed=False)
+        if bucket_ids is not None:
+            buckets = buckets.filter(pk__in=bucket_ids)
+            comments = comments.filter(bucket__in=bucket_ids)
+
+        stats = comments.values_list('bucket').annotate(total=Count('id'), latest=Max('submit_date')).order_by()
+
+        now = datetime.datetime.now()
+        updated = []
+        for bucket_id, total, latest in stats.iterator():
+            if self.filter(pk=bucket_id).exclude(comment_count=total, last_comment_at=latest).update(
+                    comment_count=total, last_comment_at=latest, last_modified=now):
+                updated.append(bucket_id)
+
+        # buckets that no longer have any visible comments
+        empty = list(buckets.exclude(marimocomments__is_removed=False).exclude(
+            comment_count=0, last_comment_at=None).values_list('pk', flat=True))
+        self.filter(pk__in=empty).update(comment_count=0, last_comment_at=None, last_modified=now)
+        updated.extend(empty)
+
+        self.refresh_caches(updated)
+        return len(updated)
+
+    def recount(self, bucket_ids, chunk_size=500):
+        """
+        Recompute the counters of buckets whose comments were hidden, shown or
+        deleted in bulk, with one UPDATE per chunk of buckets, and refresh
+        their caches. Touches ``last_modified`` of every bucket, so their
+        feeds and snapshots go stale too. Their comments are renumbered
+        first, see renumber.
+        """
+        bucket_ids = list(bucket_ids)
+        self.renumber(bucket_ids)
+        using = router.db_for_write(self.model)
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        comments = '%s WHERE %s = %s.%s AND %s = %%s' % (
+            qn(MarimoComment._meta.db_table), qn(MarimoComment._meta.get_field('bucket').column),
+            qn(self.model._meta.db_table), qn(self.model._meta.pk.column), qn('is_removed'))
+        sql = ('UPDATE %s SET %s = (SELECT COUNT(*) FROM %s), %s = (SELECT MAX(%s) FROM %s), %s = %%s '
+               'WHERE %s IN ') % (qn(self.model._meta.db_table), qn('comment_count'), comments,
+                                       qn('last_comment_at'), qn('submit_date'), comments, qn('last_modified'),
+                                       qn(self.model._meta.pk.column))
+        now = datetime.datetime.now()
+        for start in range(0, len(bucket_ids), chunk_size):
+            chunk = bucket_ids[start:start + chunk_size]
+            with transaction.commit_on_success(using=using):
+                connection.cursor().execute(sql + '(%s)' % ', '.join(['%s'] * len(chunk)), [False, False, now] + chunk)
+        self.refresh_caches(bucket_ids, chunk_size)
+
+    def renumber(self, bucket_ids):
+        """
+        Number the visible comments of each bucket 1..n in (submit_date, id)
+        order and clear the positions of hidden ones, so that every page is
+        a full range of positions again, each bucket in a transaction of its
+        own. Comments that only move past the gaps before them are moved a
+        run at a time with a ranged UPDATE (see move_positions), so hiding
+        or deleting a few comments takes a few statements however long the
+        bucket is; only comments gaining or losing a position are written
+        one by one.
+
+        :returns: the number of comments whose position changed
+        """
+        using = router.db_for_write(MarimoComment)
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        sql = 'UPDATE %s SET %s = %%s WHERE %s = %%s' % (qn(MarimoComment._meta.db_table), qn('position'), qn('id'))
+
+        changed = 0
+        for bucket_id in bucket_ids:
+            with bucket_transaction(using):
+                buckets = self.using(using).filter(pk=bucket_id)
+                # lock the bucket row first so that new posts wait for us
+                buckets.update(comment_seq=F('comment_seq'))
+                rows = MarimoComment.objects.using(using).filter(bucket=bucket_id).order_by(
+                    'submit_date', 'id').values_list('pk', 'position', 'is_removed')
+                seq = top = 0
+                (cleared, runs, numbered) = ([], [], [])
+                for (comment_id, position, is_removed) in rows.iterator():
+                    if not is_removed:
+                        seq += 1
+                    wanted = None if is_removed else seq
+                    if position is not None:
+                        top = max(top, position)
+                    if position == wanted:
+                        continue
+                    changed += 1
+                    if position is None:
+                        numbered.append((wanted, comment_id))
+                    elif wanted is None:
+                        cleared.append((None, comment_id))
+                    elif runs and runs[-1][0] == wanted - position and runs[-1][2] == position - 1:
+                        runs[-1][2] = position
+                    else:
+                        runs.append([wanted - position, position, position])
+                cursor = connection.cursor()
+                # clear first and number last, so renumbering never trips over the (bucket, position) unique index
+                if cleared:
+                    cursor.executemany(sql, cleared)
+                move_positions(connection, bucket_id, runs, top)
+                if numbered:
+                    cursor.executemany(sql, numbered)
+                buckets.update(comment_seq=seq)
+        return changed
+
+    def close_gap(self, bucket_id, position):
+        """
+        Clear ``position`` and move the bucket's comments after it up by one,
+        so the pages after it stay full. Done before the comment at
+        ``position`` is deleted (see comment_deleting), so that the positions
+        of several comments deleted at once are each read after the gaps of
+        the others were closed.
+        """
+        using = router.db_for_write(MarimoComment)
+        with bucket_transaction(using):
+            buckets = self.using(using).filter(pk=bucket_id)
+            buckets.update(comment_seq=F('comment_seq'))
+            comments = MarimoComment.objects.using(using).filter(bucket=bucket_id)
+            comments.filter(position=position).update(position=None)
+            top = comments.aggregate(top=Max('position'))['top'] or 0
+            if top > position:
+                move_positions(connections[using], bucket_id, [(-1, position + 1, top)], top)
+            buckets.update(comment_seq=max(top - 1, position - 1))
+
+    def refresh_caches(self, bucket_ids, chunk_size=500):
+        """
+        Bring the caches of buckets whose comments were changed behind the
+        signal handlers' back up to date: bump their generations and rewrite
+        their count caches from the denormalized counters.
+        """
+        bucket_ids = list(bucket_ids)
+        for start in range(0, len(bucket_ids), chunk_size):
+            chunk = bucket_ids[start:start + chunk_size]
+            counts = {}
+            for (bucket_id, content_type_id, object_id, site_id, total) in self.filter(pk__in=chunk).values_list(
+                    'pk', 'content_type', 'object_id', 'originating_site', 'comment_count'):
+                caching.bump_generation(bucket_id)
+                counts[caching.count_key(content_type_id, object_id, site_id)] = (total, get_num_pages(total))
+            caching.store_many(counts, settings.SHORT_CACHE_TIMEOUT)
+
+
 class MarimoCommentBucket(models.Model):
     """
     A container for organizing comments which links to the content object for a particular site
@@ -26,6 +187,22 @@ class MarimoCommentBucket(models.Model):
     # Metadata about the comment
     originating_site = models.ForeignKey(Site)
 
+    # Denormalized counters, maintained by the MarimoComment signal handlers below
+    comment_count = models.PositiveIntegerField(_('comment count'), default=0)
+    last_comment_at = models.DateTimeField(_('last comment at'), blank=True, null=True)
+    # last position handed out to a comment in this bucket, see MarimoComment.position;
+    # equal to comment_count once every visible comment has a position
+    comment_seq = models.PositiveIntegerField(_('comment sequence'), default=0)
+    # when any of the bucket's comments was last created, edited or deleted
+    last_modified = models.DateTimeField(_('last modified'), blank=True, null=True)
+
+    # frozen buckets take no new comments and are served from their snapshot, see snapshots.py
+    status = models.PositiveSmallIntegerField(_('status'), choices=constants.comment_choices,
+                                              default=constants.COMMENTS_DEFAULT_STATUS,
+                                              help_text=constants.comment_help_text)
+
+    objects = MarimoCommentBucketManager()
+
     class Meta:
         ordering = ('originating_site', 'content_type',)
         unique_together = (('originating_site', 'content_type', 'object_id'),)
@@ -33,17 +210,51 @@ class MarimoCommentBucket(models.Model):
         verbose_name_plural = _('buckets')
 
     def __unicode__(self):
-        """ human readable name """
-        return u'{0}:{1}'.format(self.content_type, self.object_id)
+        """ human readable name; the content type comes from the ContentType cache """
+        return u'{0}:{1}'.format(ContentType.objects.get_for_id(self.content_type_id), self.object_id)
+
+    @property
+    def is_frozen(self):
+        return self.status == constants.COMMENTS_FROZEN_STATUS
 
     def get_content_object_url(self):
         """
-        Get a URL suitable for redirecting to the content object.
+        Get a URL suitable for redirecting to the content object. The url is
+        cached (see resolver.get_content_object_url) and remembered on this
+        instance, so the content object is only loaded on a cache miss.
+        """
+        url = getattr(self, '_content_object_url', None)
+        if url is None:
+            from marimo_comments import resolver
+            url = resolver.get_content_object_url(self.content_type_id, self.object_id)
+            self._content_object_url = url
+        return url
+
+    def get_comment_urls(self, comments, page_number):
+        """
+        Permalinks for a page of this bucket's comments, built from a single
+        content object url lookup. Identical to calling
+        ``comment.get_absolute_url()`` for each comment; ``page_number`` is only
+        used for comments that have no position yet.
+        """
+        burl = self.get_content_object_url()
+        return [join_comment_url(burl, fragment) for fragment in self.get_comment_fragments(comments, page_number)]
+
+    def get_comment_fragments(self, comments, page_number):
+        """
+        get_comment_urls without the content object's url, for whatever is
+        cached or snapshotted; see join_comment_url.
         """
-        ct = ContentType.objects.get(id=self.content_type_id)
-        obj = ct.get_object_for_this_type(id=self.object_id)
+        return [build_comment_fragment(page_number if comment.position is None else
+                                       get_page_for_position(comment.position), comment.pk) for comment in comments]
 
-        return (obj.get_absolute_url() if hasattr(obj, 'get_absolute_url') else '')
+    def get_page_and_comment_counts(self):
+        """
+        the total comment count and page count, read from the denormalized
+        counters. Visible comments are numbered without gaps, so every page
+        but the last holds COMMENTS_PER_PAGE of them.
+        """
+        return (self.comment_count, get_num_pages(self.comment_count))
 
     def get_comments(self):
         """
@@ -56,6 +267,76 @@ class MarimoCommentBucket(models.Model):
         return comment_cache
 
 
+class MarimoCommentSnapshot(models.Model):
+    """
+    Every page of a frozen bucket's comments, rendered once. ``data`` is zlib
+    compressed JSON, base64 encoded so that it fits a text column on every
+    backend. Built by snapshots.freeze.
+    """
+
+    bucket = models.OneToOneField(MarimoCommentBucket, primary_key=True, related_name='snapshot')
+    data = models.TextField()
+    # the bucket's last_modified when the snapshot was taken; the snapshot is
+    # stale once they differ
+    bucket_modified = models.DateTimeField(blank=True, null=True)
+    created = models.DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        verbose_name = _('snapshot')
+        verbose_name_plural = _('snapshots')
+
+    def __unicode__(self):
+        """ human readable name """
+        return u'{0}'.format(self.bucket)
+
+    def load(self):
+        return json.loads(zlib.decompress(base64.b64decode(self.data)).decode('utf-8'))
+
+    def dump(self, content):
+        self.data = base64.b64encode(zlib.compress(json.dumps(content, separators=(',', ':')).encode('utf-8'), 9))
+
+
+class MarimoCommentRollup(models.Model):
+    """
+    The number of comments posted to a bucket during one time slice, for the
+    "most commented" leaderboards; see rollups.py.
+    """
+
+    bucket = models.ForeignKey(MarimoCommentBucket, related_name='rollups')
+    # the bucket's originating_site, so leaderboards don't join the buckets
+    site = models.ForeignKey(Site)
+    # start of the slice, see rollups.slice_start
+    slice = models.DateTimeField(_('slice'))
+    count = models.PositiveIntegerField(_('count'), default=0)
+
+    class Meta:
+        unique_together = (('bucket', 'slice'),)
+        verbose_name = _('rollup')
+        verbose_name_plural = _('rollups')
+
+    def __unicode__(self):
+        """ human readable name """
+        return u'{0} {1}'.format(self.bucket_id, self.slice)
+
+
+class MarimoCommentImportCheckpoint(models.Model):
+    """
+    The last source comment id an import_contrib_comments run has copied,
+    written in the same transaction as the comments it covers.
+    """
+
+    name = models.CharField(_('name'), max_length=100, unique=True)
+    last_pk = models.PositiveIntegerField(_('last source id'), default=0)
+
+    class Meta:
+        verbose_name = _('import checkpoint')
+        verbose_name_plural = _('import checkpoints')
+
+    def __unicode__(self):
+        """ human readable name """
+        return u'{0} {1}'.format(self.name, self.last_pk)
+
+
 class MarimoComment(models.Model):
     """ A user comment. It lives in a bucket. """
 
@@ -69,9 +350,17 @@ class MarimoComment(models.Model):
     text = models.TextField(max_length=COMMENT_MAX_LENGTH)
 
     # Metadata about the comment
-    submit_date = models.DateTimeField(_('date/time submitted'), default=None)
+    submit_date = models.DateTimeField(_('date/time submitted'), default=None, db_index=True)
     ip_address = models.IPAddressField(_('IP address'), blank=True, null=True)
     is_edited = models.BooleanField(_('is edited'), default=False)
+    # hidden by a moderator: kept, but not shown or counted, see moderation.py
+    is_removed = models.BooleanField(_('is removed'), default=False)
+
+    # 1-based position of the comment among its bucket's visible comments,
+    # handed out in insert order; None while hidden. Deleting or hiding a
+    # comment closes its gap, so the comment at position n is on page
+    # (n - 1) / COMMENTS_PER_PAGE + 1.
+    position = models.PositiveIntegerField(_('position'), blank=True, null=True)
 
     class Meta:
         ordering = ('submit_date', 'bucket')
@@ -85,7 +374,17 @@ class MarimoComment(models.Model):
     def save(self, *args, **kwargs):
         if self.submit_date is None:
             self.submit_date = datetime.datetime.now()
-        super(MarimoComment, self).save(*args, **kwargs)
+        if self.pk is None and self.position is None and not self.is_removed:
+            using = kwargs.get('using') or router.db_for_write(MarimoCommentBucket, instance=self)
+            with bucket_transaction(using):
+                # the update takes the bucket's row lock until commit, so
+                # concurrent posts are handed out positions one at a time
+                buckets = MarimoCommentBucket.objects.using(using).filter(pk=self.bucket_id)
+                buckets.update(comment_seq=F('comment_seq') + 1)
+                self.position = buckets.order_by().values_list('comment_seq', flat=True)[0]
+                super(MarimoComment, self).save(*args, **kwargs)
+        else:
+            super(MarimoComment, self).save(*args, **kwargs)
 
     @property
     def originating_site(self):
@@ -123,6 +422,9 @@ class MarimoComment(models.Model):
 
     def get_page_number(self):
         """Return the 1-based page # that this comment is displayed on"""
+        if self.position is not None:
+            return get_page_for_position(self.position)
+        # not backfilled yet, see the backfill_comment_positions command
         comments_before_this_one = MarimoComment.objects.filter(bucket=self.bucket,
                                                                 submit_date__lt=self.submit_date)
         return 1 + (comments_before_this_one.count() / constants.COMMENTS_PER_PAGE)
@@ -130,8 +432,9 @@ class MarimoComment(models.Model):
     def get_absolute_url(self, page_number=None):
         ''' this is somewhat misleading. it is really just the url for the
         content object with some query params tacked on. we take page_number as a
-        parameter because figuring out a comment's page is a relatively inefficient
-        operation. But if it isn't passed in, we figure it out anyway.'''
+        parameter because figuring out the page of a comment without a position
+        is a relatively inefficient operation. But if it isn't passed in, we
+        figure it out anyway.'''
 
         if page_number is None:
             page_number = self.get_page_number()
@@ -139,9 +442,155 @@ class MarimoComment(models.Model):
         comment_id = self.__dict__['id']
         burl = self.bucket.get_content_object_url()
 
-        hash_fragment = '/comment/p%s/c%s/' % (page_number, comment_id)
+        return build_comment_url(burl, page_number, comment_id)
 
-        if '#' in burl:
-            return burl + hash_fragment
-        else:
-            return burl + '#' + hash_fragment
+
+def bucket_transaction(using):
+    """
+    A transaction for work that must hold a bucket's row lock until it
+    commits. Joins the caller's transaction if there is one:
+    ``commit_on_success`` doesn't nest before Django 1.6, and would commit
+    the caller's work half way through.
+    """
+    if transaction.is_managed(using=using):
+        return _joined()
+    return transaction.commit_on_success(using=using)
+
+
+@contextmanager
+def _joined():
+    yield
+
+
+def move_positions(connection, bucket_id, runs, top):
+    """
+    Move every ``(delta, first, last)`` run of a bucket's positions by
+    ``delta``, one ranged UPDATE per run. The runs are all lifted past
+    ``top``, the bucket's highest position, before any is lowered into its
+    place: the (bucket, position) index is unique and checked row by row.
+    """
+    if not runs:
+        return
+    qn = connection.ops.quote_name
+    sql = 'UPDATE %s SET %s = %s + %%s WHERE %s = %%s AND %s BETWEEN %%s AND %%s' % (
+        qn(MarimoComment._meta.db_table), qn('position'), qn('position'),
+        qn(MarimoComment._meta.get_field('bucket').column), qn('position'))
+    cursor = connection.cursor()
+    cursor.executemany(sql, [(top, bucket_id, first, last) for (delta, first, last) in runs])
+    cursor.executemany(sql, [(delta - top, bucket_id, first + top, last + top) for (delta, first, last) in runs])
+
+
+def build_comment_url(burl, page_number, comment_id):
+    """ tack the comment's page and id onto the content object's url ``burl`` """
+    return join_comment_url(burl, build_comment_fragment(page_number, comment_id))
+
+
+def build_comment_fragment(page_number, comment_id):
+    """ the part of a comment's permalink that doesn't depend on the content object's url """
+    return '/comment/p%s/c%s/' % (page_number, comment_id)
+
+
+def join_comment_url(burl, hash_fragment):
+    if '#' in burl:
+        return burl + hash_fragment
+    else:
+        return burl + '#' + hash_fragment
+
+
+def get_page_for_position(position):
+    """ the 1-based page a comment at ``position`` is displayed on """
+    return (position - 1) // constants.COMMENTS_PER_PAGE + 1
+
+
+def get_num_pages(comment_count):
+    """ number of pages needed for ``comment_count`` comments. There is always at least one page. """
+    return max(1, (comment_count + constants.COMMENTS_PER_PAGE - 1) // constants.COMMENTS_PER_PAGE)
+
+
+def comment_saved(sender, instance, created, raw=False, **kwargs):
+    """
+    Bump the bucket's comment counter and leaderboard rollup when a comment
+    is created. Uses F() expressions so concurrent posts never lose an
+    increment. Creating or editing a comment also bumps the bucket's cache
+    generation.
+    """
+    if raw:
+        return
+    buckets = MarimoCommentBucket.objects.filter(pk=instance.bucket_id)
+    if created and not instance.is_removed:
+        buckets.update(comment_count=F('comment_count') + 1, last_modified=datetime.datetime.now())
+        buckets.filter(Q(last_comment_at__isnull=True) | Q(last_comment_at__lt=instance.submit_date)).update(
+            last_comment_at=instance.submit_date)
+        from marimo_comments import rollups
+        rollups.record(instance.bucket_id, instance.bucket.originating_site_id, instance.submit_date)
+    else:
+        buckets.update(last_modified=datetime.datetime.now())
+    # new and edited comments both change the bucket's rendered pages
+    caching.bump_generation(instance.bucket_id)
+
+
+def comment_deleting(sender, instance, **kwargs):
+    """
+    Close the gap a comment about to be deleted leaves in its bucket's
+    positions. Its position is read again first: closing the gap of an
+    earlier delete may have moved it since the instance was loaded.
+    """
+    position = MarimoComment.objects.filter(pk=instance.pk).order_by().values_list('position', flat=True)[0]
+    if position is not None:
+        MarimoCommentBucket.objects.close_gap(instance.bucket_id, position)
+
+
+def comment_deleted(sender, instance, **kwargs):
+    """
+    Drop the bucket's comment counter when a comment is deleted; its gap in
+    the bucket's positions was closed by comment_deleting. This fires for
+    every row of queryset and admin deletes as well;
+    moderation.delete_comments deletes in bulk without it.
+    """
+    buckets = MarimoCommentBucket.objects.filter(pk=instance.bucket_id)
+    if instance.is_removed:
+        # hidden comments aren't counted
+        buckets.update(last_modified=datetime.datetime.now())
+    else:
+        if not buckets.filter(comment_count__gt=0).update(comment_count=F('comment_count') - 1,
+                                                          last_modified=datetime.datetime.now()):
+            buckets.update(last_modified=datetime.datetime.now())
+        from marimo_comments import rollups
+        rollups.record(instance.bucket_id, None, instance.submit_date, -1)
+    # only the newest comment moves last_comment_at; this is a single indexed max()
+    if buckets.filter(last_comment_at__lte=instance.submit_date).exists():
+        latest = MarimoComment.objects.filter(bucket=instance.bucket_id, is_removed=False).aggregate(
+            latest=Max('submit_date'))['latest']
+        buckets.update(last_comment_at=latest)
+    caching.bump_generation(instance.bucket_id)
+
+
+def comment_indexed(sender, instance, **kwargs):
+    """ keep the full-text index current where the database doesn't, see search.py """
+    if constants.SEARCH_ENABLED:
+        from marimo_comments import search
+        search.index_comments([(instance.pk, instance.text)])
+
+
+def comment_unindexed(sender, instance, **kwargs):
+    if constants.SEARCH_ENABLED:
+        from marimo_comments import search
+        search.forget_comments([instance.pk])
+
+
+def bucket_deleted(sender, instance, **kwargs):
+    """ stop resolving the content object to a bucket that is gone """
+    from marimo_comments import resolver
+    resolver.forget_bucket(instance.content_type_id, instance.object_id, instance.originating_site_id)
+
+
+post_save.connect(comment_saved, sender=MarimoComment, dispatch_uid='marimo_comments.comment_saved')
+pre_delete.connect(comment_deleting, sender=MarimoComment, dispatch_uid='marimo_comments.comment_deleting')
+post_delete.connect(comment_deleted, sender=MarimoComment, dispatch_uid='marimo_comments.comment_deleted')
+post_save.connect(comment_indexed, sender=MarimoComment, dispatch_uid='marimo_comments.comment_indexed')
+post_delete.connect(comment_unindexed, sender=MarimoComment, dispatch_uid='marimo_comments.comment_unindexed')
+post_delete.connect(bucket_deleted, sender=MarimoCommentBucket, dispatch_uid='marimo_comments.bucket_deleted')
+
+# connects the content models listed in MARIMO_COMMENTS_CONTENT_URL_MODELS as
+# they are loaded; last, since the resolver imports this module
+import marimo_comments.resolver  # noqa
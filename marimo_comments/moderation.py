@@ -0,0 +1,100 @@
+"""
+Set-based moderation
+
+Hides, shows or deletes every comment matching a poster, an IP address or a
+submit date range in a handful of statements rather than row by row, then
+recomputes the counters and caches of all the affected buckets in one grouped
+pass (MarimoCommentBucketManager.recount) and their leaderboard rollups (rollups.reconcile).
+
+Hidden comments (``is_removed``) stay in the table but are left out of the
+widget, feeds, snapshots and counts. The recount renumbers the buckets'
+visible comments, so hidden and deleted comments leave no gaps in the pages.
+Deletes go straight to SQL, so no per-row delete signals are sent; the
+full-text index is kept current by hand.
+"""
+from django.db import connections, router, transaction
+
+from marimo_comments import rollups, search
+from marimo_comments.models import MarimoComment, MarimoCommentBucket
+
+
+def select_comments(users=None, ip_addresses=None, since=None, until=None):
+    """
+    The comments matching all of the given criteria.
+
+    :param users: user ids
+    :param ip_addresses: IP addresses as stored on the comments
+    :param since: submitted at or after this datetime
+    :param until: submitted before this datetime
+    :raises ValueError: if no criteria are given; never the whole table by accident
+    """
+    if users is None and ip_addresses is None and since is None and until is None:
+        raise ValueError('no comments selected')
+    comments = MarimoComment.objects.all()
+    if users is not None:
+        comments = comments.filter(user__in=list(users))
+    if ip_addresses is not None:
+        comments = comments.filter(ip_address__in=list(ip_addresses))
+    if since is not None:
+        comments = comments.filter(submit_date__gte=since)
+    if until is not None:
+        comments = comments.filter(submit_date__lt=until)
+    return comments
+
+
+def affected_buckets(comments):
+    return list(comments.order_by().values_list('bucket', flat=True).distinct())
+
+
+def hide_comments(comments):
+    """
+    Hide a queryset of comments.
+
+    :returns: the number of comments hidden
+    """
+    return _set_removed(comments, True)
+
+
+def show_comments(comments):
+    """
+    Show hidden comments again.
+
+    :returns: the number of comments shown
+    """
+    return _set_removed(comments, False)
+
+
+def _set_removed(comments, removed):
+    comments = comments.filter(is_removed=not removed)
+    bucket_ids = affected_buckets(comments)
+    changed = comments.update(is_removed=removed)
+    MarimoCommentBucket.objects.recount(bucket_ids)
+    rollups.reconcile(bucket_ids)
+    return changed
+
+
+def delete_comments(comments, chunk_size=500):
+    """
+    Delete a queryset of comments, ``chunk_size`` ids per statement and
+    transaction.
+
+    :returns: the number of comments deleted
+    """
+    bucket_ids = affected_buckets(comments)
+    comment_ids = list(comments.order_by().values_list('pk', flat=True))
+
+    using = router.db_for_write(MarimoComment)
+    connection = connections[using]
+    qn = connection.ops.quote_name
+    sql = 'DELETE FROM %s WHERE %s IN (%%s)' % (qn(MarimoComment._meta.db_table), qn('id'))
+    deleted = 0
+    for start in range(0, len(comment_ids), chunk_size):
+        chunk = comment_ids[start:start + chunk_size]
+        with transaction.commit_on_success(using=using):
+            cursor = connection.cursor()
+            cursor.execute(sql % ', '.join(['%s'] * len(chunk)), chunk)
+            deleted += cursor.rowcount
+            search.forget_comments(chunk)
+    MarimoCommentBucket.objects.recount(bucket_ids)
+    rollups.reconcile(bucket_ids)
+    return deleted
@@ -0,0 +1,112 @@
+"""
+Flood control for posting comments
+
+Every poster has a token bucket per scope: one for the user and one for the
+IP address (``REMOTE_ADDR``, as stored on the comment). A bucket holds
+``burst`` tokens and refills at ``posts`` tokens per ``seconds``; a post takes
+one token from each of the poster's buckets, and is rejected if any of them is
+empty. Limits are configured with ``MARIMO_COMMENTS_RATE_LIMITS``.
+
+Buckets live in the cache as a single integer each: the time (in
+milliseconds) at which the bucket will be full again, the "theoretical
+arrival time" of the generic cell rate algorithm. Taking a token is one
+atomic ``incr`` of that time by the refill interval, and the bucket is
+empty when it ends up more than ``burst`` intervals in the future. Under a
+flood every check is that single increment, no lock and no read-modify-write.
+It is only atomic on caches with an atomic incr (memcached, redis); the local
+memory cache is good enough for development.
+
+A bucket that was full has to be moved up to now first, or the idle time
+would pile up as extra tokens. One request does that, under a short ``add``
+lock, and it does it with an ``incr`` by the idle time rather than a
+``set``, so the tokens taken by requests racing it stay taken. Those
+requests are let through; the bound is that the ones which incremented
+before the one holding the lock are not charged, at most the posts made
+within one cache round trip of each other on an idle bucket.
+"""
+import math
+import time
+
+from django.core.cache import cache
+
+from marimo_comments import caching, constants, stats
+
+
+def _interval(posts, seconds):
+    """ milliseconds it takes to refill one token """
+    return max(1, int(seconds * 1000 / posts))
+
+
+def _reset_key(key):
+    return key + ':reset'
+
+
+def take(key, posts, seconds, burst):
+    """
+    Take a token from the bucket at ``key``.
+
+    :returns: 0 if a token was taken, else the seconds until one is available
+    """
+    interval = _interval(posts, seconds)
+    now = int(time.time() * 1000)
+    try:
+        full_at = cache.incr(key, interval)
+    except ValueError:
+        # no bucket yet, which is a full one
+        if cache.add(key, now + interval, constants.RATE_LIMIT_CACHE_TIMEOUT):
+            return 0
+        try:
+            full_at = cache.incr(key, interval)
+        except ValueError:
+            return 0
+
+    if full_at <= now + interval:
+        # the bucket was full; move it up to now (see above)
+        if full_at < now + interval and cache.add(_reset_key(key), 1, constants.RATE_LIMIT_RESET_LOCK_TIMEOUT):
+            try:
+                cache.incr(key, now + interval - full_at)
+            except ValueError:
+                pass
+            cache.delete(_reset_key(key))
+        return 0
+    if full_at - now > burst * interval:
+        # empty: give the token back, rejected posts don't drain the bucket further
+        give_back(key, posts, seconds)
+        return int(math.ceil((full_at - burst * interval - now) / 1000.0))
+    return 0
+
+
+def give_back(key, posts, seconds):
+    try:
+        cache.decr(key, _interval(posts, seconds))
+    except ValueError:
+        pass
+
+
+def poster_identities(request):
+    """ ``(scope, ident)`` of every bucket a request draws from """
+    return (('user', request.user.pk), ('ip', request.META.get('REMOTE_ADDR', None)))
+
+
+def check_post(request):
+    """
+    Take a token from each of the poster's buckets. Runs entirely against
+    the cache.
+
+    :returns: None if the post may go ahead, else the seconds to wait
+    """
+    taken = []
+    for (scope, ident) in poster_identities(request):
+        limit = constants.RATE_LIMITS.get(scope)
+        if limit is None or ident is None:
+            continue
+        key = caching.rate_key(scope, ident)
+        wait = take(key, *limit)
+        if wait:
+            # don't charge the other buckets for a post that isn't made
+            for (taken_key, (posts, seconds, burst)) in taken:
+                give_back(taken_key, posts, seconds)
+            stats.get_sink().incr('ratelimit.%s.rejected' % scope)
+            return wait
+        taken.append((key, limit))
+    return None
@@ -0,0 +1,212 @@
+"""
+Bucket resolution
+
+Maps a (content_type_id, object_id, site_id) triple to a bucket id without
+touching the database on the hot path. Lookups go through a small in-process
+LRU first and the shared django cache second. Content without a bucket (no
+comments yet) is cached too, as a short lived negative entry, so that
+uncommented articles don't cost a query on every view.
+
+Content object urls (the base of every comment permalink) are kept in the
+shared cache too, so rendering permalinks never loads the content object.
+Cached pages and snapshots don't hold them, they are joined on as pages are
+served (views.add_content_url): a changed url shows once its own entry is
+refreshed, after SHORT_CACHE_TIMEOUT for models nothing tells us about.
+For models registered with ``register_content_model`` or listed in
+``MARIMO_COMMENTS_CONTENT_URL_MODELS``, saving an object refreshes its cached
+url and deleting it drops the url; their receivers are connected per model,
+so saving any other model doesn't run them.
+"""
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models import get_model
+from django.db.models.signals import class_prepared, post_delete, post_save
+
+from marimo_comments import caching, constants, stats
+from marimo_comments.models import MarimoCommentBucket
+from marimo_comments.util.lru import LRUCache
+
+# stored for content that has no bucket; real bucket ids are always positive
+NO_BUCKET = 0
+
+local_cache = LRUCache(constants.BUCKET_LOCAL_CACHE_SIZE)
+
+# 'app_label.modelname' of the models whose cached urls are kept current
+content_models = set()
+# MARIMO_COMMENTS_CONTENT_URL_MODELS not loaded yet
+_pending_content_models = set(label.lower() for label in constants.CONTENT_URL_MODELS)
+
+
+def _remember(key, bucket_id):
+    if bucket_id == NO_BUCKET:
+        local_cache.set(key, bucket_id, constants.BUCKET_NEGATIVE_CACHE_TIMEOUT)
+        cache.set(key, bucket_id, constants.BUCKET_NEGATIVE_CACHE_TIMEOUT)
+    else:
+        local_cache.set(key, bucket_id, constants.BUCKET_LOCAL_CACHE_TIMEOUT)
+        cache.set(key, bucket_id, constants.BUCKET_CACHE_TIMEOUT)
+
+
+@stats.instrument('bucket.resolve')
+def resolve_bucket_id(content_type_id, object_id, site_id):
+    """
+    :returns: the id of the bucket for the content object, or None if the
+        object has no bucket yet
+    """
+    key = caching.bucket_key(content_type_id, object_id, site_id)
+
+    bucket_id = local_cache.get(key)
+    if bucket_id is None:
+        bucket_id = cache.get(key)
+        if bucket_id is None:
+            stats.cache_miss('bucket')
+            try:
+                bucket_id = MarimoCommentBucket.objects.values_list('pk', flat=True).get(
+                    content_type=content_type_id, object_id=object_id, originating_site=site_id)
+            except MarimoCommentBucket.DoesNotExist:
+                bucket_id = NO_BUCKET
+            _remember(key, bucket_id)
+        else:
+            stats.cache_hit('bucket')
+            # don't let the local tier outlive a shared negative entry
+            local_cache.set(key, bucket_id, constants.BUCKET_NEGATIVE_CACHE_TIMEOUT if bucket_id == NO_BUCKET
+                            else constants.BUCKET_LOCAL_CACHE_TIMEOUT)
+    else:
+        stats.cache_hit('bucket')
+
+    return bucket_id or None
+
+
+def bucket_created(bucket):
+    """ replace any negative entry for a freshly created bucket """
+    _remember(caching.bucket_key(bucket.content_type_id, bucket.object_id, bucket.originating_site_id), bucket.pk)
+
+
+def forget_bucket(content_type_id, object_id, site_id):
+    """ drop the cached resolution for a content object in both tiers """
+    key = caching.bucket_key(content_type_id, object_id, site_id)
+    local_cache.delete(key)
+    cache.delete(key)
+
+
+def model_label(model):
+    return '%s.%s' % (model._meta.app_label, model._meta.object_name.lower())
+
+
+def register_content_model(model):
+    """ keep the cached urls of ``model``'s objects current as they are saved and deleted """
+    label = model_label(model)
+    content_models.add(label)
+    post_save.connect(_content_object_saved, sender=model, dispatch_uid='marimo_comments.url_saved:' + label)
+    post_delete.connect(_content_object_deleted, sender=model, dispatch_uid='marimo_comments.url_deleted:' + label)
+
+
+def unregister_content_model(model):
+    label = model_label(model)
+    content_models.discard(label)
+    post_save.disconnect(sender=model, dispatch_uid='marimo_comments.url_saved:' + label)
+    post_delete.disconnect(sender=model, dispatch_uid='marimo_comments.url_deleted:' + label)
+
+
+def _content_model_prepared(sender, **kwargs):
+    label = model_label(sender)
+    if label in _pending_content_models:
+        _pending_content_models.discard(label)
+        register_content_model(sender)
+
+
+def _register_content_models():
+    """ MARIMO_COMMENTS_CONTENT_URL_MODELS, now for the ones already loaded, as they load for the others """
+    for label in list(_pending_content_models):
+        model = get_model(*label.split('.', 1), seed_cache=False, only_installed=False)
+        if model is not None:
+            _content_model_prepared(model)
+    if _pending_content_models:
+        class_prepared.connect(_content_model_prepared, dispatch_uid='marimo_comments.content_model_prepared')
+
+
+def is_content_model(model):
+    return model_label(model) in content_models
+
+
+def _url_of(obj):
+    return obj.get_absolute_url() if hasattr(obj, 'get_absolute_url') else ''
+
+
+def get_content_object_url(content_type_id, object_id):
+    """
+    get_absolute_url() of a content object (or '' if it has none), loading
+    the object only on a cache miss.
+
+    :raises ObjectDoesNotExist: if the content object is gone
+    """
+    content_type = ContentType.objects.get_for_id(content_type_id)
+    return caching.get_or_set(caching.content_url_key(content_type_id, object_id),
+                              lambda: _url_of(content_type.get_object_for_this_type(pk=object_id)),
+                              _url_timeout(content_type))
+
+
+def get_content_object_urls(keys):
+    """
+    Bulk version of get_content_object_url: one cache round trip, and one
+    query per content type for the misses.
+
+    :param keys: iterable of ``(content_type_id, object_id)`` tuples
+    :returns: dict mapping each key to its url; content objects that are
+        gone are left out
+    """
+    keys = set(keys)
+    cache_keys = dict((caching.content_url_key(*key), key) for key in keys)
+
+    urls = {}
+    for (cache_key, packed) in cache.get_many(cache_keys.keys()).items():
+        url = caching.unpack(packed)
+        if url is not None:
+            urls[cache_keys[cache_key]] = url
+            stats.cache_hit('url')
+
+    grouped = {}
+    for (content_type_id, object_id) in keys:
+        if (content_type_id, object_id) not in urls:
+            stats.cache_miss('url')
+            grouped.setdefault(content_type_id, []).append(object_id)
+    for (content_type_id, object_ids) in grouped.items():
+        content_type = ContentType.objects.get_for_id(content_type_id)
+        fresh = {}
+        for (object_id, obj) in content_type.get_all_objects_for_this_type().in_bulk(object_ids).items():
+            urls[(content_type_id, object_id)] = fresh[caching.content_url_key(content_type_id, object_id)] = \
+                _url_of(obj)
+        caching.store_many(fresh, _url_timeout(content_type))
+    return urls
+
+
+def _url_timeout(content_type):
+    model = content_type.model_class()
+    if model is not None and is_content_model(model):
+        return constants.CONTENT_URL_CACHE_TIMEOUT
+    # nothing tells us when these change
+    return settings.SHORT_CACHE_TIMEOUT
+
+
+def content_object_saved(instance, created=False, raw=False):
+    """ refresh the cached url of a registered content object """
+    key = caching.content_url_key(ContentType.objects.get_for_model(instance).pk, instance.pk)
+    if raw:
+        cache.delete(key)
+        return
+    caching.store(key, _url_of(instance), constants.CONTENT_URL_CACHE_TIMEOUT)
+
+
+def content_object_deleted(instance):
+    cache.delete(caching.content_url_key(ContentType.objects.get_for_model(instance).pk, instance.pk))
+
+
+def _content_object_saved(sender, instance, created=False, raw=False, **kwargs):
+    content_object_saved(instance, created, raw)
+
+
+def _content_object_deleted(sender, instance, **kwargs):
+    content_object_deleted(instance)
+
+
+_register_content_models()
@@ -0,0 +1,122 @@
+"""
+"Most commented" leaderboards
+
+Every comment posted bumps a counter for its bucket and time slice
+(``LEADERBOARD_SLICE`` seconds, ten minutes by default) in
+MarimoCommentRollup, with a single ``UPDATE ... SET count = count + 1`` in
+the common case. A leaderboard for the last ``hours`` hours sums the
+slices of that window per bucket, which reads a few rows per active bucket
+instead of grouping the comments table. Windows move a slice at a time, so
+"the last hour" covers up to one slice more than an hour.
+
+The comment signal handlers keep the counters current as comments are
+posted and deleted. Anything behind their back (bulk imports, bulk
+moderation, raw sql) drifts until ``reconcile`` recounts the retained slices
+from the comments table; run ``reconcile_comment_rollups`` periodically,
+which also drops slices past ``LEADERBOARD_RETENTION_HOURS``.
+"""
+import datetime
+
+from django.db.models import F, Sum
+
+from marimo_comments import caching, constants
+from marimo_comments.models import MarimoComment, MarimoCommentBucket, MarimoCommentRollup
+
+
+def slice_start(moment):
+    """ the start of the slice ``moment`` falls in """
+    midnight = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    seconds = moment.hour * 3600 + moment.minute * 60 + moment.second
+    return midnight + datetime.timedelta(seconds=seconds - seconds % constants.LEADERBOARD_SLICE)
+
+
+def window_start(hours, now=None):
+    """ the first slice of a leaderboard over the last ``hours`` hours """
+    return slice_start((now or datetime.datetime.now()) - datetime.timedelta(hours=hours))
+
+
+def record(bucket_id, site_id, submit_date, delta=1):
+    """
+    Count a comment posted (or with a negative ``delta``, deleted) at
+    ``submit_date`` towards its bucket's slice. ``site_id`` is only needed
+    for the slice's first comment.
+    """
+    start = slice_start(submit_date)
+    rollups = MarimoCommentRollup.objects.filter(bucket=bucket_id, slice=start)
+    if delta < 0:
+        rollups.filter(count__gte=-delta).update(count=F('count') + delta)
+    elif not rollups.update(count=F('count') + delta):
+        MarimoCommentRollup.objects.get_or_create(bucket_id=bucket_id, slice=start, defaults={'site_id': site_id})
+        rollups.update(count=F('count') + delta)
+
+
+def most_commented(site_id, hours, limit=10):
+    """
+    The buckets of a site with the most comments over the last ``hours``
+    hours, cached for LEADERBOARD_CACHE_TIMEOUT seconds.
+
+    :returns: list of ``{'bucket_id', 'content_type_id', 'object_id',
+        'comments'}`` dicts, most comments first
+    """
+    def compute():
+        totals = list(MarimoCommentRollup.objects.filter(site=site_id, slice__gte=window_start(hours)).values_list(
+            'bucket').annotate(total=Sum('count')).filter(total__gt=0).order_by('-total', 'bucket')[:limit])
+        objects = dict((bucket_id, (content_type_id, object_id)) for (bucket_id, content_type_id, object_id) in
+                       MarimoCommentBucket.objects.filter(pk__in=[bucket_id for (bucket_id, total) in totals])
+                       .values_list('pk', 'content_type', 'object_id'))
+        return [{
+            'bucket_id': bucket_id,
+            'content_type_id': objects[bucket_id][0],
+            'object_id': objects[bucket_id][1],
+            'comments': total,
+        } for (bucket_id, total) in totals if bucket_id in objects]
+
+    return caching.get_or_set(caching.leaderboard_key(site_id, hours, limit), compute,
+                              constants.LEADERBOARD_CACHE_TIMEOUT)
+
+
+def reconcile(bucket_ids=None, chunk_size=500):
+    """
+    Recount the retained slices of every bucket (or of ``bucket_ids``) from
+    the comments table, and drop the slices past retention.
+
+    :returns: the number of rollups created, corrected or dropped
+    """
+    since = window_start(constants.LEADERBOARD_RETENTION_HOURS)
+    changed = 0
+    if bucket_ids is None:
+        expired = MarimoCommentRollup.objects.filter(slice__lt=since)
+        changed += expired.count()
+        expired.delete()
+        chunks = [None]
+    else:
+        bucket_ids = list(bucket_ids)
+        chunks = [bucket_ids[start:start + chunk_size] for start in range(0, len(bucket_ids), chunk_size)]
+
+    for chunk in chunks:
+        comments = MarimoComment.objects.filter(submit_date__gte=since, is_removed=False)
+        rollups = MarimoCommentRollup.objects.filter(slice__gte=since)
+        if chunk is not None:
+            comments = comments.filter(bucket__in=chunk)
+            rollups = rollups.filter(bucket__in=chunk)
+
+        # comments in the window, on the submit_date index
+        actual = {}
+        sites = {}
+        for (bucket_id, site_id, submit_date) in comments.values_list(
+                'bucket', 'bucket__originating_site', 'submit_date').iterator():
+            key = (bucket_id, slice_start(submit_date))
+            actual[key] = actual.get(key, 0) + 1
+            sites[bucket_id] = site_id
+
+        for (pk, bucket_id, start, count) in list(rollups.values_list('pk', 'bucket', 'slice', 'count')):
+            expected = actual.pop((bucket_id, start), 0)
+            if expected != count:
+                MarimoCommentRollup.objects.filter(pk=pk).update(count=expected)
+                changed += 1
+        for ((bucket_id, start), count) in actual.items():
+            MarimoCommentRollup.objects.get_or_create(bucket_id=bucket_id, slice=start,
+                                                      defaults={'site_id': sites[bucket_id]})
+            MarimoCommentRollup.objects.filter(bucket=bucket_id, slice=start).update(count=count)
+            changed += 1
+    return changed
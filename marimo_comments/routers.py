@@ -0,0 +1,118 @@
+"""
+Primary/replica database routing
+
+``ReplicaRouter`` sends the marimo comments models' reads (the widget, counts,
+feeds) to a read replica and their writes to the primary::
+
+    DATABASE_ROUTERS = ['marimo_comments.routers.ReplicaRouter']
+    MIDDLEWARE_CLASSES += ('marimo_comments.routers.PinningMiddleware',)
+    # aliases in DATABASES; reads pick one of the replicas at random
+    MARIMO_COMMENTS_DB_PRIMARY = 'default'
+    MARIMO_COMMENTS_DB_REPLICAS = ['replica']
+
+Replicas lag behind the primary, so somebody who just posted could reload the
+page and not see their own comment. To prevent that, any write pins the
+current thread's reads to the primary for the rest of the request.
+``PinningMiddleware`` then sets a short lived cookie that keeps the poster's
+next requests pinned for ``MARIMO_COMMENTS_DB_PIN_SECONDS``. Pinned requests
+also rebuild the cached comment pages they read, rather than trusting a page
+somebody else may have built from a lagging replica after the post bumped the
+bucket's generation. Everybody else builds the pages of a bucket whose
+generation was bumped less than ``MARIMO_COMMENTS_DB_PIN_SECONDS`` ago from
+the primary too (``reading_primary``), so that a page built from a replica
+that hasn't seen the change is never cached under the new generation.
+"""
+import random
+import threading
+from contextlib import contextmanager
+
+from django.core.signals import request_started
+
+from marimo_comments import constants
+
+PIN_COOKIE = 'marimo_comments_pin'
+
+_state = threading.local()
+
+
+def pin():
+    """ read from the primary for the rest of this request """
+    _state.pinned = True
+
+
+def unpin():
+    _state.pinned = False
+    _state.wrote = False
+
+
+def is_pinned():
+    return getattr(_state, 'pinned', False)
+
+
+@contextmanager
+def reading_primary(primary=True):
+    """ read from the primary within the block if ``primary``, without pinning the rest of the request """
+    pinned = is_pinned()
+    if primary:
+        _state.pinned = True
+    try:
+        yield
+    finally:
+        _state.pinned = pinned
+
+
+def _request_started(sender, **kwargs):
+    # threads serve many requests; pins never outlive the one they were made in
+    unpin()
+
+
+request_started.connect(_request_started, dispatch_uid='marimo_comments.routers.unpin')
+
+
+class ReplicaRouter(object):
+    """ reads from a replica, writes to the primary; only routes marimo comments models """
+    app_label = 'marimo_comments'
+
+    def _routed(self, model):
+        return model._meta.app_label == self.app_label
+
+    def db_for_read(self, model, **hints):
+        if not self._routed(model):
+            return None
+        if is_pinned() or not constants.DB_REPLICAS:
+            return constants.DB_PRIMARY
+        return random.choice(constants.DB_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        if not self._routed(model):
+            return None
+        pin()
+        _state.wrote = True
+        return constants.DB_PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        databases = [constants.DB_PRIMARY] + list(constants.DB_REPLICAS)
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_syncdb(self, db, model):
+        if self._routed(model) and db in constants.DB_REPLICAS:
+            # replicated from the primary, never created directly
+            return False
+        return None
+
+
+class PinningMiddleware(object):
+    """ carries a pin across requests in a cookie; needs ReplicaRouter """
+
+    def process_request(self, request):
+        if PIN_COOKIE in request.COOKIES:
+            pin()
+
+    def process_response(self, request, response):
+        if getattr(_state, 'wrote', False):
+            response.set_cookie(PIN_COOKIE, '1', max_age=constants.DB_PIN_SECONDS, httponly=True)
+        unpin()
+        return response
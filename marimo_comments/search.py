@@ -0,0 +1,211 @@
+"""
+Full-text search over comment text, for moderators
+
+Optional (``MARIMO_COMMENTS_SEARCH = True``), and built on the database's own
+full-text engine:
+
+SQLite
+    an FTS5 table (FTS4 where the sqlite library has no FTS5) next to the
+    comments table, kept in sync by the comment signal handlers and by
+    moderation.delete_comments. Comments inserted behind their back (bulk
+    imports, raw sql) need ``reindex_comment_search``.
+PostgreSQL
+    a GIN index over ``to_tsvector(MARIMO_COMMENTS_SEARCH_CONFIG, text)``
+    on the comments table itself, built ``CONCURRENTLY``, so writes carry on
+    while it is built. The database keeps it current.
+MySQL
+    a FULLTEXT index on the comments table's text column; the database keeps
+    it current. Adding it blocks writes while InnoDB builds it; on big
+    tables use an online schema change tool instead of ``--install``.
+
+Run ``reindex_comment_search --install`` once to create the index, then turn
+the setting on. Results are ranked by relevance (FTS4 has no ranking
+function, newest first there) and paged with offsets; search is for finding
+a few pages of matches, not for walking them all.
+"""
+import re
+
+from django.db import DatabaseError, connections, router
+
+from marimo_comments import constants
+from marimo_comments.models import MarimoComment
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+# FTS query syntax; dropped rather than searched for, every other word must match
+FTS_OPERATORS = frozenset(('AND', 'OR', 'NOT', 'NEAR'))
+
+
+class SearchUnavailable(Exception):
+    """ the database has no full-text engine we know how to use """
+
+
+class SearchBackend(object):
+    """ a database's full-text engine; by default it keeps its index current itself """
+    needs_sync = False
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.qn = connection.ops.quote_name
+        self.table = self.qn(MarimoComment._meta.db_table)
+
+    def install(self):
+        """ create the index """
+        raise NotImplementedError
+
+    def index(self, rows):
+        """ add or replace ``(comment_id, text)`` rows """
+
+    def forget(self, comment_ids):
+        """ drop comments from the index """
+
+    def search(self, query, offset, limit):
+        """ :returns: ids of the comments matching ``query``, best first """
+        raise NotImplementedError
+
+    def _fetch_ids(self, sql, params):
+        cursor = self.connection.cursor()
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+class SqliteSearch(SearchBackend):
+    needs_sync = True
+    index_table = 'marimo_comments_search'
+
+    def install(self):
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute('CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(text)' % self.qn(self.index_table))
+        except DatabaseError:
+            cursor.execute('CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts4(text)' % self.qn(self.index_table))
+
+    def has_rank(self):
+        if not hasattr(self, '_has_rank'):
+            cursor = self.connection.cursor()
+            cursor.execute('SELECT sql FROM sqlite_master WHERE name = %s', [self.index_table])
+            row = cursor.fetchone()
+            self._has_rank = bool(row) and 'fts5' in row[0].lower()
+        return self._has_rank
+
+    def index(self, rows):
+        rows = list(rows)
+        if not rows:
+            return
+        self.forget([comment_id for (comment_id, text) in rows])
+        self.connection.cursor().executemany(
+            'INSERT INTO %s (rowid, text) VALUES (%%s, %%s)' % self.qn(self.index_table), rows)
+
+    def forget(self, comment_ids):
+        comment_ids = list(comment_ids)
+        if comment_ids:
+            self.connection.cursor().execute('DELETE FROM %s WHERE rowid IN (%s)' % (
+                self.qn(self.index_table), ', '.join(['%s'] * len(comment_ids))), comment_ids)
+
+    def search(self, query, offset, limit):
+        # every word, quoted, so that nothing the user typed is read as query syntax
+        terms = ' '.join('"%s"' % word for word in WORD_RE.findall(query) if word not in FTS_OPERATORS)
+        if not terms:
+            return []
+        table = self.qn(self.index_table)
+        return self._fetch_ids('SELECT rowid FROM %s WHERE %s MATCH %%s ORDER BY %s LIMIT %%s OFFSET %%s' % (
+            table, table, 'rank' if self.has_rank() else 'rowid DESC'), [terms, limit, offset])
+
+
+class PostgresSearch(SearchBackend):
+    index_name = 'marimo_comments_marimocomment_text_search'
+
+    def vector(self):
+        return "to_tsvector('%s', %s)" % (constants.SEARCH_CONFIG, self.qn('text'))
+
+    def install(self):
+        cursor = self.connection.cursor()
+        cursor.execute('SELECT 1 FROM pg_indexes WHERE indexname = %s', [self.index_name])
+        if cursor.fetchone():
+            return
+        # CONCURRENTLY doesn't block writes, but can't run inside a transaction
+        raw = self.connection.connection
+        isolation_level = raw.isolation_level
+        raw.set_isolation_level(0)
+        try:
+            cursor.execute('CREATE INDEX CONCURRENTLY %s ON %s USING gin (%s)' % (
+                self.qn(self.index_name), self.table, self.vector()))
+        finally:
+            raw.set_isolation_level(isolation_level)
+
+    def search(self, query, offset, limit):
+        tsquery = "plainto_tsquery('%s', %%s)" % constants.SEARCH_CONFIG
+        return self._fetch_ids('SELECT %s FROM %s WHERE %s @@ %s ORDER BY ts_rank(%s, %s) DESC, %s DESC '
+                               'LIMIT %%s OFFSET %%s' % (self.qn('id'), self.table, self.vector(), tsquery,
+                                                         self.vector(), tsquery, self.qn('id')),
+                               [query, query, limit, offset])
+
+
+class MysqlSearch(SearchBackend):
+    index_name = 'marimo_comments_marimocomment_text_search'
+
+    def install(self):
+        cursor = self.connection.cursor()
+        cursor.execute('SELECT 1 FROM information_schema.statistics WHERE table_schema = DATABASE() '
+                       'AND table_name = %s AND index_name = %s', [MarimoComment._meta.db_table, self.index_name])
+        if not cursor.fetchone():
+            cursor.execute('ALTER TABLE %s ADD FULLTEXT INDEX %s (%s)' % (self.table, self.qn(self.index_name),
+                                                                          self.qn('text')))
+
+    def search(self, query, offset, limit):
+        match = 'MATCH (%s) AGAINST (%%s IN NATURAL LANGUAGE MODE)' % self.qn('text')
+        return self._fetch_ids('SELECT %s FROM %s WHERE %s ORDER BY %s DESC, %s DESC LIMIT %%s OFFSET %%s' % (
+            self.qn('id'), self.table, match, match, self.qn('id')), [query, query, limit, offset])
+
+
+BACKENDS = {
+    'sqlite': SqliteSearch,
+    'postgresql': PostgresSearch,
+    'mysql': MysqlSearch,
+}
+
+
+def get_backend(using):
+    """ :raises SearchUnavailable: if the database has no full-text engine we support """
+    connection = connections[using]
+    try:
+        return BACKENDS[connection.vendor](connection)
+    except KeyError:
+        raise SearchUnavailable(connection.vendor)
+
+
+def search_ids(query, offset=0, limit=constants.COMMENTS_PER_PAGE):
+    """ ids of the comments matching ``query``, best first """
+    return get_backend(router.db_for_read(MarimoComment)).search(query, offset, limit)
+
+
+def search_comments(query, page=1, per_page=constants.COMMENTS_PER_PAGE):
+    """
+    :returns: ``(comments, has_more)``, a page of the comments matching
+        ``query``, best first
+    """
+    comment_ids = search_ids(query, (page - 1) * per_page, per_page + 1)
+    has_more = len(comment_ids) > per_page
+    comment_ids = comment_ids[:per_page]
+    comments = MarimoComment.objects.select_related('user').in_bulk(comment_ids) if comment_ids else {}
+    # the index can be briefly ahead of a lagging replica
+    return ([comments[comment_id] for comment_id in comment_ids if comment_id in comments], has_more)
+
+
+def _sync_backend():
+    if not constants.SEARCH_ENABLED:
+        return None
+    backend = get_backend(router.db_for_write(MarimoComment))
+    return backend if backend.needs_sync else None
+
+
+def index_comments(rows):
+    """ keep ``(comment_id, text)`` rows searchable, where the database doesn't do that itself """
+    backend = _sync_backend()
+    if backend is not None:
+        backend.index(rows)
+
+
+def forget_comments(comment_ids):
+    backend = _sync_backend()
+    if backend is not None:
+        backend.forget(comment_ids)
@@ -0,0 +1,70 @@
+"""
+Fast serialization of comments for the widget and feeds
+
+Rather than building full MarimoComment and User instances, only the columns
+that are rendered are fetched with ``values_list`` into compact rows.
+"""
+import time
+
+# the columns of a CommentRow, in order
+COMMENT_ROW_FIELDS = ('id', 'user__username', 'text', 'submit_date', 'position')
+
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+class CommentRow(object):
+    """ the rendered columns of a comment; quacks like a MarimoComment where it matters """
+    __slots__ = ('pk', 'poster', 'text', 'submit_date', 'position')
+
+    def __init__(self, pk, poster, text, submit_date, position):
+        self.pk = pk
+        self.poster = poster
+        self.text = text
+        self.submit_date = submit_date
+        self.position = position
+
+
+def comment_rows(queryset):
+    """ narrow a MarimoComment queryset down to the CommentRow columns """
+    return queryset.values_list(*COMMENT_ROW_FIELDS)
+
+
+def to_rows(values):
+    """ wrap tuples fetched through comment_rows in CommentRows """
+    return [CommentRow(*value) for value in values]
+
+
+def format_submit_date(date):
+    """
+    Same output as ``date.strftime("%l:%M %p %b. %e, %Y")`` with AM/PM spelled
+    "a.m."/"p.m.", built in a single string format.
+    """
+    return '%2d:%02d %s %s. %2d, %d' % (date.hour % 12 or 12, date.minute, 'a.m.' if date.hour < 12 else 'p.m.',
+                                        MONTHS[date.month - 1], date.day, date.year)
+
+
+def timestamp(date):
+    """ Same as ``int(date.strftime('%s'))``, without relying on the platform's strftime. """
+    return int(time.mktime(date.timetuple()))
+
+
+def serialize_comments(rows, hrefs):
+    """
+    :param rows: CommentRows
+    :param hrefs: the permalink of each row
+    :returns: list of dicts as used in the widget's context
+    """
+    return [{
+        # href of permalink to comment
+        'comment_href': href,
+        # screen_name or username of poster.
+        'poster': row.poster,
+        # date comment was submitted
+        'submit_date': format_submit_date(row.submit_date),
+        # date comment was submitted in timestamp
+        'submitted_ts': timestamp(row.submit_date),
+        # text of comment
+        'text': row.text,
+        # comment's id for permalinking and other targeting
+        'comment_id': row.pk,
+    } for (row, href) in zip(rows, hrefs)]
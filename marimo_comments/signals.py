@@ -0,0 +1,8 @@
+"""
+Signals sent by marimo comments
+"""
+from django.dispatch import Signal
+
+# sent after every instrumented hot path call, see stats.py
+hotpath_measured = Signal(providing_args=['name', 'duration', 'queries', 'cache_hits', 'cache_misses',
+                                          'payload_size'])
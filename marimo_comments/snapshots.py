@@ -0,0 +1,140 @@
+"""
+Frozen buckets
+
+Comment threads on old content are read over and over, but never change.
+Freezing a bucket stops it from taking new comments. It also renders every page
+of its comments once into a compressed MarimoCommentSnapshot, which the widget
+serves instead of querying the comments table.
+
+A snapshot goes stale when the bucket's comments change after it was taken,
+e.g. a moderator deletes one. Stale snapshots are never served; the widget
+reads the comments table instead until the snapshot is rebuilt (see the
+freeze_inactive_buckets command). Snapshots don't hold the content object's
+url: like cached pages, their permalinks get it joined on as they are served
+(views.add_content_url), so a frozen bucket follows its content when it moves.
+
+Freezing and thawing touch the bucket's ``last_modified``, so that feed
+pollers (whose ETag comes from it) see the ``frozen`` flag change.
+"""
+import datetime
+
+from django.db import router, transaction
+
+from marimo_comments import caching, constants, serialization
+from marimo_comments.models import (MarimoComment, MarimoCommentBucket, MarimoCommentSnapshot,
+                                    get_page_for_position)
+from marimo_comments.util import cursors
+
+
+class NotNumbered(ValueError):
+    """ the bucket has comments without a position; run backfill_comment_positions """
+
+
+def build_pages(bucket):
+    """
+    Render every page of the bucket's comments the way get_comment_page does.
+
+    :returns: list of ``{'comments', 'next_cursor', 'prev_cursor'}`` dicts, one per page
+    :raises NotNumbered: if any of the bucket's comments has no position
+    """
+    num_pages = bucket.get_page_and_comment_counts()[1]
+    rows = serialization.to_rows(serialization.comment_rows(
+        MarimoComment.objects.filter(bucket=bucket, is_removed=False)).order_by('position'))
+
+    pages = [[] for i in range(num_pages)]
+    for row in rows:
+        if row.position is None:
+            raise NotNumbered(bucket.pk)
+        pages[min(get_page_for_position(row.position), num_pages) - 1].append(row)
+
+    rendered = []
+    for (index, comments) in enumerate(pages):
+        page = index + 1
+        next_cursor = prev_cursor = None
+        if comments and page < num_pages:
+            next_cursor = cursors.encode_cursor(cursors.NEXT, comments[-1].submit_date, comments[-1].pk, page + 1)
+        if comments and page > 1:
+            prev_cursor = cursors.encode_cursor(cursors.PREV, comments[0].submit_date, comments[0].pk, page - 1)
+        rendered.append({
+            'comments': serialization.serialize_comments(comments, bucket.get_comment_fragments(comments, page)),
+            'next_cursor': next_cursor,
+            'prev_cursor': prev_cursor,
+        })
+    return rendered
+
+
+def freeze(bucket):
+    """
+    Snapshot the bucket and stop it from taking comments. Freezing an
+    already frozen bucket rebuilds its snapshot.
+
+    :raises NotNumbered: if any of the bucket's comments has no position
+    """
+    buckets = MarimoCommentBucket.objects.filter(pk=bucket.pk)
+    # read before rendering: a comment arriving meanwhile leaves the snapshot stale rather than wrong
+    (bucket_modified, bucket.comment_count, bucket.comment_seq) = buckets.values_list(
+        'last_modified', 'comment_count', 'comment_seq')[0]
+    (total_comments, num_pages) = bucket.get_page_and_comment_counts()
+
+    snapshot = MarimoCommentSnapshot(bucket=bucket, bucket_modified=bucket_modified)
+    snapshot.dump({
+        'total_comments': total_comments,
+        'num_pages': num_pages,
+        'pages': build_pages(bucket),
+    })
+
+    now = datetime.datetime.now()
+    with transaction.commit_on_success(using=router.db_for_write(MarimoCommentSnapshot)):
+        MarimoCommentSnapshot.objects.filter(bucket=bucket).delete()
+        # the snapshot is current unless the comments changed since they were read
+        if buckets.filter(last_modified=bucket_modified).update(status=constants.COMMENTS_FROZEN_STATUS,
+                                                                last_modified=now):
+            snapshot.bucket_modified = now
+        else:
+            buckets.update(status=constants.COMMENTS_FROZEN_STATUS, last_modified=now)
+        snapshot.save(force_insert=True)
+    (bucket.status, bucket.last_modified) = (constants.COMMENTS_FROZEN_STATUS, now)
+    caching.bump_generation(bucket.pk)
+    return snapshot
+
+
+def thaw(bucket):
+    """ let the bucket take comments again and drop its snapshot """
+    now = datetime.datetime.now()
+    with transaction.commit_on_success(using=router.db_for_write(MarimoCommentSnapshot)):
+        MarimoCommentSnapshot.objects.filter(bucket=bucket).delete()
+        MarimoCommentBucket.objects.filter(pk=bucket.pk).update(status=constants.COMMENTS_DEFAULT_STATUS,
+                                                                last_modified=now)
+    (bucket.status, bucket.last_modified) = (constants.COMMENTS_DEFAULT_STATUS, now)
+    caching.bump_generation(bucket.pk)
+
+
+def get_snapshot_page(bucket, page=1, cursor=None):
+    """
+    get_comment_page for a frozen bucket, read from its snapshot. Cursors
+    carry the page they lead to, which is all a snapshot needs.
+
+    :returns: the page's context, or None if the bucket has no current snapshot
+    """
+    snapshot = list(MarimoCommentSnapshot.objects.filter(bucket=bucket.pk))
+    if not snapshot or snapshot[0].bucket_modified != bucket.last_modified:
+        return None
+    content = snapshot[0].load()
+
+    if cursor:
+        try:
+            page = cursors.decode_cursor(cursor)[3]
+        except cursors.InvalidCursor:
+            page = 1
+    page = max(1, min(page, content['num_pages']))
+    rendered = content['pages'][page - 1]
+
+    return {
+        'comments': rendered['comments'],
+        'page': page,
+        'next_cursor': rendered['next_cursor'],
+        'prev_cursor': rendered['prev_cursor'],
+        'total_comments': content['total_comments'],
+        'num_pages': content['num_pages'],
+        'frozen': True,
+    }
@@ -0,0 +1,12 @@
+-- Composite index backing keyset (seek) pagination of a bucket's comments,
+-- ordered by (submit_date, id). Run by syncdb after the table is created.
+CREATE INDEX marimo_comments_marimocomment_bucket_date_id ON marimo_comments_marimocomment (bucket_id, submit_date, id);
+
+-- Per-bucket positions (see MarimoComment.position): pages are position ranges.
+CREATE UNIQUE INDEX marimo_comments_marimocomment_bucket_position ON marimo_comments_marimocomment (bucket_id, position);
+
+-- Polling for comments newer than a comment id (see views.since) seeks on (bucket_id, id).
+CREATE INDEX marimo_comments_marimocomment_bucket_id_id ON marimo_comments_marimocomment (bucket_id, id);
+
+-- A user's comment history (see history.py) seeks on (user_id, submit_date, id).
+CREATE INDEX marimo_comments_marimocomment_user_date_id ON marimo_comments_marimocomment (user_id, submit_date, id);
@@ -0,0 +1,3 @@
+-- Finding the buckets of a content object on every site (see resolver.content_object_moved)
+-- seeks on (content_type_id, object_id); the unique index leads with originating_site_id.
+CREATE INDEX marimo_comments_marimocommentbucket_content ON marimo_comments_marimocommentbucket (content_type_id, object_id);
@@ -0,0 +1,3 @@
+-- Leaderboards (see rollups.most_commented) read a site's slices since the
+-- start of the window; the unique index leads with bucket_id.
+CREATE INDEX marimo_comments_marimocommentrollup_site_slice ON marimo_comments_marimocommentrollup (site_id, slice);
@@ -0,0 +1,210 @@
+"""
+Hot path instrumentation
+
+Functions decorated with ``instrument(name)`` report, per call, their wall
+time, the number of queries they ran, the cache hits and misses they saw and
+the size of what they returned. Every measurement is sent to the configured
+stats sink and to the ``hotpath_measured`` signal.
+
+Settings::
+
+    # dotted path of the sink class; NullSink by default
+    MARIMO_COMMENTS_STATS_SINK = 'marimo_comments.stats.StatsdSink'
+    MARIMO_COMMENTS_STATSD_HOST = 'localhost'
+    MARIMO_COMMENTS_STATSD_PORT = 8125
+    MARIMO_COMMENTS_STATS_PREFIX = 'marimo_comments'
+
+    # count queries (turns on the debug cursor inside measured calls)
+    MARIMO_COMMENTS_COUNT_QUERIES = True
+
+    # raise QueryBudgetExceeded when a measured call runs more queries than
+    # its budget; implies MARIMO_COMMENTS_COUNT_QUERIES
+    MARIMO_COMMENTS_QUERY_BUDGETS = {'widget': 3, 'post': 8}
+"""
+import socket
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+from django.utils.importlib import import_module
+
+from marimo_comments.signals import hotpath_measured
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class NullSink(object):
+    """ drops everything """
+
+    def timing(self, name, milliseconds):
+        pass
+
+    def incr(self, name, count=1):
+        pass
+
+    def histogram(self, name, value):
+        pass
+
+
+class MemorySink(NullSink):
+    """ keeps every metric in ``metrics`` as ``(kind, name, value)``; meant for tests """
+
+    def __init__(self):
+        self.metrics = []
+
+    def timing(self, name, milliseconds):
+        self.metrics.append(('timing', name, milliseconds))
+
+    def incr(self, name, count=1):
+        self.metrics.append(('incr', name, count))
+
+    def histogram(self, name, value):
+        self.metrics.append(('histogram', name, value))
+
+    def values(self, name):
+        return [value for (kind, metric, value) in self.metrics if metric == name]
+
+
+class StatsdSink(NullSink):
+    """ fire and forget statsd over UDP """
+
+    def __init__(self, host=None, port=None, prefix=None):
+        self.address = (host or getattr(settings, 'MARIMO_COMMENTS_STATSD_HOST', 'localhost'),
+                        port or getattr(settings, 'MARIMO_COMMENTS_STATSD_PORT', 8125))
+        self.prefix = prefix or getattr(settings, 'MARIMO_COMMENTS_STATS_PREFIX', 'marimo_comments')
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, name, value, kind):
+        try:
+            self.socket.sendto(('%s.%s:%s|%s' % (self.prefix, name, value, kind)).encode('utf-8'), self.address)
+        except socket.error:
+            pass
+
+    def timing(self, name, milliseconds):
+        self.send(name, int(milliseconds), 'ms')
+
+    def incr(self, name, count=1):
+        self.send(name, count, 'c')
+
+    def histogram(self, name, value):
+        # plain statsd has no histograms; timers give the same percentiles
+        self.send(name, value, 'ms')
+
+
+_sink = None
+_local = threading.local()
+
+
+def get_sink():
+    global _sink
+    if _sink is None:
+        path = getattr(settings, 'MARIMO_COMMENTS_STATS_SINK', 'marimo_comments.stats.NullSink')
+        module, name = path.rsplit('.', 1)
+        _sink = getattr(import_module(module), name)()
+    return _sink
+
+
+def set_sink(sink):
+    """ swap the sink, e.g. for a MemorySink in tests; None reloads it from settings """
+    global _sink
+    _sink = sink
+
+
+def _active():
+    if not hasattr(_local, 'measurements'):
+        _local.measurements = []
+    return _local.measurements
+
+
+def cache_hit(name):
+    """ record a cache hit against every measurement in progress """
+    for measurement in _active():
+        measurement.cache_hits += 1
+    get_sink().incr('cache.%s.hit' % name)
+
+
+def cache_miss(name):
+    """ record a cache miss against every measurement in progress """
+    for measurement in _active():
+        measurement.cache_misses += 1
+    get_sink().incr('cache.%s.miss' % name)
+
+
+def _query_count():
+    return sum(len(connection.queries) for connection in connections.all())
+
+
+class Measurement(object):
+    """ one instrumented call """
+
+    def __init__(self, name):
+        self.name = name
+        self.budget = getattr(settings, 'MARIMO_COMMENTS_QUERY_BUDGETS', {}).get(name)
+        self.count_queries = self.budget is not None or getattr(settings, 'MARIMO_COMMENTS_COUNT_QUERIES', False)
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.queries = None
+        self.duration = None
+        self.payload_size = None
+
+    def __enter__(self):
+        if self.count_queries:
+            self._debug_cursors = [(connection, connection.use_debug_cursor) for connection in connections.all()]
+            for (connection, debug_cursor) in self._debug_cursors:
+                connection.use_debug_cursor = True
+            self._queries_before = _query_count()
+        _active().append(self)
+        self._started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = (time.time() - self._started) * 1000
+        _active().remove(self)
+        if self.count_queries:
+            self.queries = _query_count() - self._queries_before
+            for (connection, debug_cursor) in self._debug_cursors:
+                connection.use_debug_cursor = debug_cursor
+
+        sink = get_sink()
+        sink.timing('%s.time' % self.name, self.duration)
+        if self.queries is not None:
+            sink.histogram('%s.queries' % self.name, self.queries)
+        if self.payload_size is not None:
+            sink.histogram('%s.payload' % self.name, self.payload_size)
+        hotpath_measured.send(sender=Measurement, name=self.name, duration=self.duration, queries=self.queries,
+                              cache_hits=self.cache_hits, cache_misses=self.cache_misses,
+                              payload_size=self.payload_size)
+
+        if exc_type is None and self.budget is not None and self.queries > self.budget:
+            raise QueryBudgetExceeded('%s ran %d queries, its budget is %d' % (self.name, self.queries, self.budget))
+
+
+def payload_size(result):
+    """
+    Size of what an instrumented function returned: bytes for responses and
+    the number of comments for widget responses.
+    """
+    if isinstance(result, HttpResponse):
+        return len(result.content)
+    if isinstance(result, dict) and 'context' in result:
+        return len(result['context'].get('comments', ()))
+    return None
+
+
+def instrument(name):
+    """ decorator measuring every call of the function as ``name`` """
+    def decorator(fun):
+        @wraps(fun)
+        def wrapper(*args, **kwargs):
+            with Measurement(name) as measurement:
+                result = fun(*args, **kwargs)
+                measurement.payload_size = payload_size(result)
+            return result
+        return wrapper
+
+    return decorator
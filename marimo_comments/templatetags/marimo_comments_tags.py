@@ -0,0 +1,102 @@
+"""
+Template tags for marimo comments
+"""
+from django import template
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ObjectDoesNotExist
+
+from marimo_comments import rollups
+from marimo_comments.resolver import get_content_object_url
+from marimo_comments.views import get_bulk_page_and_comment_counts
+
+register = template.Library()
+
+
+class CommentCountsNode(template.Node):
+
+    def __init__(self, objects, site_id, varname):
+        self.objects = template.Variable(objects)
+        self.site_id = template.Variable(site_id) if site_id else None
+        self.varname = varname
+
+    def render(self, context):
+        objects = list(self.objects.resolve(context) or [])
+        site_id = self.site_id.resolve(context) if self.site_id else settings.SITE_ID
+        site_id = int(getattr(site_id, 'pk', site_id))
+
+        # get_for_model is served from ContentType's own cache
+        keys = [(ContentType.objects.get_for_model(obj).pk, obj.pk, site_id) for obj in objects]
+        counts = get_bulk_page_and_comment_counts(keys)
+
+        context[self.varname] = [{
+            'object': obj,
+            'total_comments': counts[key][0],
+            'num_pages': counts[key][1],
+        } for (obj, key) in zip(objects, keys)]
+        return ''
+
+
+@register.tag
+def get_comment_counts(parser, token):
+    """
+    Fetch comment and page counts for a whole list of content objects with a
+    single cache round trip.
+
+    Usage::
+
+        {% get_comment_counts for object_list as counted %}
+        {% get_comment_counts for object_list site site_id as counted %}
+
+        {% for item in counted %}
+            {{ item.object }}: {{ item.total_comments }} ({{ item.num_pages }} pages)
+        {% endfor %}
+    """
+    bits = token.split_contents()
+    if len(bits) == 5 and bits[1] == 'for' and bits[3] == 'as':
+        return CommentCountsNode(bits[2], None, bits[4])
+    if len(bits) == 7 and bits[1] == 'for' and bits[3] == 'site' and bits[5] == 'as':
+        return CommentCountsNode(bits[2], bits[4], bits[6])
+    raise template.TemplateSyntaxError(
+        "%r tag expects 'for <objects> [site <site_id>] as <varname>'" % bits[0])
+
+
+class MostCommentedNode(template.Node):
+
+    def __init__(self, hours, limit, varname):
+        self.hours = template.Variable(hours)
+        self.limit = template.Variable(limit)
+        self.varname = varname
+
+    def render(self, context):
+        leaders = rollups.most_commented(settings.SITE_ID, int(self.hours.resolve(context)),
+                                         int(self.limit.resolve(context)))
+        context[self.varname] = []
+        for leader in leaders:
+            try:
+                url = get_content_object_url(leader['content_type_id'], leader['object_id'])
+            except ObjectDoesNotExist:
+                continue
+            context[self.varname].append(dict(leader, url=url))
+        return ''
+
+
+@register.tag
+def get_most_commented(parser, token):
+    """
+    Fetch the content objects of this site with the most comments over the
+    last few hours, from the leaderboard rollups.
+
+    Usage::
+
+        {% get_most_commented 24 hours limit 10 as leaders %}
+
+        {% for leader in leaders %}
+            <a href="{{ leader.url }}">{{ leader.comments }} comments</a>
+        {% endfor %}
+    """
+    bits = token.split_contents()
+    if len(bits) == 7 and bits[2] == 'hours' and bits[3] == 'limit' and bits[5] == 'as':
+        return MostCommentedNode(bits[1], bits[4], bits[6])
+    raise template.TemplateSyntaxError(
+        "%r tag expects '<hours> hours limit <limit> as <varname>'" % bits[0])
@@ -7,7 +7,12 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': 'db.sqlite3',
-    }
+    },
+    # stands in for a read replica of default, see test_routers.py
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'replica.sqlite3',
+    },
 }
 
 INSTALLED_APPS = (
@@ -0,0 +1,18 @@
+""" test_benchmarks.py """
+from unittest import TestCase
+
+from marimo_comments.benchmarks import hotpaths
+
+
+class HarnessTest(TestCase):
+
+    def test_percentile(self):
+        ordered = list(range(1, 101))
+        assert hotpaths.percentile(ordered, 50) == 51
+        assert hotpaths.percentile(ordered, 99) == 99
+        assert hotpaths.percentile([7], 90) == 7
+
+    def test_compare(self):
+        baseline = {'a': {'p50': 2.0, 'queries': 5.0}, 'gone': {'p50': 1.0, 'queries': 1.0}}
+        results = {'a': {'p50': 1.0, 'queries': 2.0}, 'new': {'p50': 1.0, 'queries': 1.0}}
+        assert hotpaths.compare(results, baseline) == [('a', 2.0, 1.0, 5.0, 2.0)]
@@ -0,0 +1,85 @@
+""" test_caching.py """
+from unittest import TestCase
+
+from marimo_comments import caching
+from marimo_comments.util.mocks import MockCache
+
+
+class GenerationTest(TestCase):
+
+    def setUp(self):
+        self.mc = MockCache()
+        self.mc.cache.clear()
+        self.real_cache, caching.cache = caching.cache, self.mc
+
+    def tearDown(self):
+        caching.cache = self.real_cache
+
+    def test_generation_is_stable(self):
+        assert caching.get_generation(1) == caching.get_generation(1)
+
+    def test_bump_changes_generation(self):
+        before = caching.get_generation(1)
+        caching.bump_generation(1)
+        assert caching.get_generation(1) == before + 1
+
+    def test_buckets_are_independent(self):
+        before = caching.get_generation(2)
+        caching.bump_generation(1)
+        assert caching.get_generation(2) == before
+
+    def test_evicted_generation_does_not_restart(self):
+        caching.get_generation(1)
+        caching.bump_generation(1)
+        self.mc.cache.clear()
+        # a fresh generation is seeded from the clock, never reusing low numbers
+        assert caching.get_generation(1) > 2
+
+
+class KeyTest(TestCase):
+
+    def test_keys_are_namespaced_and_versioned(self):
+        assert caching.count_key(101, 1, 2).startswith('marimo_comments:%s:counts:' % caching.constants.CACHE_VERSION)
+        assert caching.count_key(101, 1, 2) != caching.bucket_key(101, 1, 2)
+
+    def test_stats_namespace(self):
+        assert caching._namespace(caching.count_key(101, 1, 2)) == 'counts'
+        # keys built elsewhere are counted together
+        assert caching._namespace('k') == 'other'
+
+
+class StampedeTest(TestCase):
+
+    def setUp(self):
+        self.mc = MockCache()
+        self.mc.cache.clear()
+        self.real_cache, caching.cache = caching.cache, self.mc
+        self.calls = []
+
+    def tearDown(self):
+        caching.cache = self.real_cache
+
+    def recompute(self):
+        self.calls.append(1)
+        return len(self.calls)
+
+    def test_fresh_value_is_not_recomputed(self):
+        assert caching.get_or_set('k', self.recompute, 60) == 1
+        assert caching.get_or_set('k', self.recompute, 60) == 1
+        assert len(self.calls) == 1
+
+    def test_stale_value_recomputed_by_lock_holder(self):
+        caching.store('k', 'old', -1)
+        assert caching.get_or_set('k', self.recompute, 60) == 1
+        assert not self.mc.get('k:lock')
+
+    def test_stale_value_served_while_locked(self):
+        caching.store('k', 'old', -1)
+        self.mc.add('k:lock', 1)
+        assert caching.get_or_set('k', self.recompute, 60) == 'old'
+        assert not self.calls
+
+    def test_refresh_recomputes_fresh_value(self):
+        caching.store('k', 'old', 60)
+        assert caching.get_or_set('k', self.recompute, 60, refresh=True) == 1
+        assert caching.get_or_set('k', self.recompute, 60) == 1
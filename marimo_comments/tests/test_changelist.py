@@ -0,0 +1,161 @@
+""" test_changelist.py """
+import datetime
+from unittest import TestCase
+
+from django.contrib import admin as django_admin
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.test.client import RequestFactory
+
+from mockito import any, unstub, verify, when
+
+from marimo_comments import admin, constants, resolver, search
+from marimo_comments.models import MarimoComment, MarimoCommentBucket, MarimoCommentRollup
+from marimo_comments.util import changelist
+from marimo_comments.util.changelist import ChangeListQuerySet, date_range
+
+
+class DateRangeTest(TestCase):
+
+    def test_years(self):
+        assert date_range(datetime.datetime(2010, 5, 3), datetime.datetime(2012, 1, 9), 'year') == [
+            datetime.datetime(2010, 1, 1), datetime.datetime(2011, 1, 1), datetime.datetime(2012, 1, 1)]
+
+    def test_months_across_years(self):
+        assert date_range(datetime.datetime(2011, 11, 30), datetime.datetime(2012, 2, 1), 'month') == [
+            datetime.datetime(2011, 11, 1), datetime.datetime(2011, 12, 1), datetime.datetime(2012, 1, 1),
+            datetime.datetime(2012, 2, 1)]
+
+    def test_single_month(self):
+        assert date_range(datetime.datetime(2012, 3, 1), datetime.datetime(2012, 3, 31), 'month') == [
+            datetime.datetime(2012, 3, 1)]
+
+
+class ChangeListQuerySetTest(TestCase):
+
+    def tearDown(self):
+        unstub()
+
+    def queryset(self):
+        return MarimoComment.objects.all()._clone(klass=ChangeListQuerySet)
+
+    def test_unfiltered_count_uses_estimate(self):
+        when(changelist).estimated_row_count(MarimoComment, 'default').thenReturn(5000000)
+        assert self.queryset().count() == 5000000
+
+    def test_select_related_keeps_fields(self):
+        qs = self.queryset().select_related('user', 'bucket__originating_site').select_related()
+        assert qs.query.select_related == {'user': {}, 'bucket': {'originating_site': {}}}
+
+    def test_clones_keep_class(self):
+        assert isinstance(self.queryset().filter(pk=1).order_by('-submit_date'), ChangeListQuerySet)
+
+
+class BucketNameTest(TestCase):
+
+    def tearDown(self):
+        unstub()
+
+    def test_content_type_from_cache(self):
+        content_type = ContentType(pk=101, name='Entry', app_label='example', model='entry')
+        when(ContentType.objects).get_for_id(101).thenReturn(content_type)
+        bucket = MarimoCommentBucket(pk=1, content_type_id=101, object_id=7, originating_site=Site(pk=1))
+        assert unicode(bucket) == u'Entry:7'
+
+
+MODELS = (Site, ContentType, User, MarimoCommentBucket, MarimoComment, MarimoCommentRollup)
+
+
+class SearchChangeListTest(TestCase):
+    """ the admin search box, against real tables """
+
+    def setUp(self):
+        cursor = connection.cursor()
+        for model in MODELS:
+            for sql in connection.creation.sql_create_model(model, no_style())[0]:
+                cursor.execute(sql)
+        transaction.commit_unless_managed()
+        ContentType.objects.clear_cache()
+        Site.objects.create(pk=1, domain='example.com', name='example')
+        ContentType.objects.create(pk=101, app_label='auth', model='user')
+        bucket = MarimoCommentBucket.objects.create(content_type_id=101, object_id=1, originating_site_id=1)
+        for day in (1, 2, 3):
+            MarimoComment.objects.create(pk=day, bucket=bucket, text='comment %d' % day,
+                                         submit_date=datetime.datetime(2012, 5, day))
+        self.model_admin = admin.MarimoCommentAdmin(MarimoComment, django_admin.site)
+        when(self.model_admin).message_user(any(), any()).thenReturn(None)
+
+    def tearDown(self):
+        unstub()
+        cursor = connection.cursor()
+        for model in reversed(MODELS):
+            cursor.execute('DROP TABLE %s' % connection.ops.quote_name(model._meta.db_table))
+        transaction.commit_unless_managed()
+        ContentType.objects.clear_cache()
+
+    def changelist(self, **params):
+        model_admin = self.model_admin
+        return admin.SearchChangeList(
+            RequestFactory().get('/', params), MarimoComment, model_admin.list_display,
+            model_admin.list_display_links, model_admin.list_filter, model_admin.date_hierarchy, ('text',),
+            model_admin.list_select_related, model_admin.list_per_page, model_admin.list_max_show_all,
+            model_admin.list_editable, model_admin)
+
+    def test_best_match_first(self):
+        when(search).search_ids('comment', limit=constants.SEARCH_ADMIN_LIMIT + 1).thenReturn([2, 3, 1])
+        assert [comment.pk for comment in self.changelist(q='comment').result_list] == [2, 3, 1]
+        verify(self.model_admin, times=0).message_user(any(), any())
+
+    def test_sorted_column_wins(self):
+        when(search).search_ids('comment', limit=constants.SEARCH_ADMIN_LIMIT + 1).thenReturn([2, 3, 1])
+        assert [comment.pk for comment in self.changelist(q='comment', o='3').result_list] == [1, 2, 3]
+
+    def test_cut_off_at_the_limit(self):
+        when(search).search_ids('comment', limit=3).thenReturn([3, 1, 2])
+        old_limit, constants.SEARCH_ADMIN_LIMIT = constants.SEARCH_ADMIN_LIMIT, 2
+        try:
+            changelist = self.changelist(q='comment')
+        finally:
+            constants.SEARCH_ADMIN_LIMIT = old_limit
+        assert [comment.pk for comment in changelist.result_list] == [3, 1]
+        verify(self.model_admin).message_user(changelist.request, any())
+
+
+class BucketChangeListTest(TestCase):
+    """ the bucket changelist, against real tables """
+
+    def setUp(self):
+        cursor = connection.cursor()
+        for model in MODELS:
+            for sql in connection.creation.sql_create_model(model, no_style())[0]:
+                cursor.execute(sql)
+        transaction.commit_unless_managed()
+        ContentType.objects.clear_cache()
+        Site.objects.create(pk=1, domain='example.com', name='example')
+        ContentType.objects.create(pk=101, app_label='auth', model='user')
+        for object_id in (1, 2):
+            MarimoCommentBucket.objects.create(content_type_id=101, object_id=object_id, originating_site_id=1)
+        self.model_admin = admin.MarimoCommentBucketAdmin(MarimoCommentBucket, django_admin.site)
+
+    def tearDown(self):
+        unstub()
+        cursor = connection.cursor()
+        for model in reversed(MODELS):
+            cursor.execute('DROP TABLE %s' % connection.ops.quote_name(model._meta.db_table))
+        transaction.commit_unless_managed()
+        ContentType.objects.clear_cache()
+
+    def test_content_urls_in_bulk(self):
+        when(resolver).get_content_object_urls(any()).thenReturn({(101, 1): '/about/'})
+        model_admin = self.model_admin
+        changelist = admin.BucketChangeList(
+            RequestFactory().get('/'), MarimoCommentBucket, model_admin.list_display,
+            model_admin.list_display_links, model_admin.list_filter, model_admin.date_hierarchy,
+            model_admin.search_fields, model_admin.list_select_related, model_admin.list_per_page,
+            model_admin.list_max_show_all, model_admin.list_editable, model_admin)
+        verify(resolver, times=1).get_content_object_urls(any())
+        links = dict((bucket.object_id, model_admin.content_link(bucket)) for bucket in changelist.result_list)
+        assert links == {1: '<a href="/about/">/about/</a>', 2: '(deleted)'}
@@ -6,11 +6,14 @@ from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.flatpages.models import FlatPage
 from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.management.color import no_style
+from django.db import connection, reset_queries, transaction
 
-from mockito import mock, when
+from mockito import mock, times, unstub, verify, when
 
 from marimo_comments import constants
-from marimo_comments.models import MarimoCommentBucket, MarimoComment
+from marimo_comments.models import MarimoCommentBucket, MarimoComment, bucket_transaction, get_num_pages
 
 
 class MarimoCommentTest(TestCase):
@@ -30,6 +33,11 @@ class MarimoCommentTest(TestCase):
                                           object_id=self.flatpage.pk, originating_site=self.site)
         self.comment = MarimoComment(pk=1, text='Test Comment', bucket=self.bucket, user=self.user,
                                      submit_date=self.datetime)
+        # content object urls are cached
+        cache.clear()
+
+    def tearDown(self):
+        unstub()
 
     def test_comment_userinfo(self):
         assert self.comment.userinfo['name'] == self.user_data['username']
@@ -59,6 +67,115 @@ class MarimoCommentTest(TestCase):
         assert self.comment.get_page_number() == 2
 
     def test_comment_get_absolute_url(self):
-        when(ContentType.objects).get(id=101).thenReturn(self.test_content_type)
-        when(ContentType).get_object_for_this_type().thenReturn(self.flatpage)
+        mock_query_set = mock()
+        when(MarimoComment.objects).filter(bucket=self.bucket, submit_date__lt=self.datetime).thenReturn(mock_query_set)
+        when(mock_query_set).count().thenReturn(0)
+        when(ContentType.objects).get_for_id(101).thenReturn(self.test_content_type)
+        when(self.test_content_type).get_object_for_this_type(pk=1).thenReturn(self.flatpage)
         assert '#/comment/p1/c1/' == self.comment.get_absolute_url()
+
+    def test_bucket_page_and_comment_counts(self):
+        self.bucket.comment_count = constants.COMMENTS_PER_PAGE + 1
+        assert self.bucket.get_page_and_comment_counts() == (constants.COMMENTS_PER_PAGE + 1, 2)
+        # visible comments are numbered without gaps, so a full page is one page
+        self.bucket.comment_count = constants.COMMENTS_PER_PAGE
+        assert self.bucket.get_page_and_comment_counts() == (constants.COMMENTS_PER_PAGE, 1)
+
+    def test_num_pages_never_zero(self):
+        assert get_num_pages(0) == 1
+        assert get_num_pages(constants.COMMENTS_PER_PAGE) == 1
+        assert get_num_pages(constants.COMMENTS_PER_PAGE * 3) == 3
+
+    def test_bucket_comment_urls_resolve_content_once(self):
+        when(ContentType.objects).get_for_id(101).thenReturn(self.test_content_type)
+        when(self.test_content_type).get_object_for_this_type(pk=1).thenReturn(self.flatpage)
+        comments = [MarimoComment(pk=pk, text='Test Comment', bucket=self.bucket, user=self.user,
+                                  submit_date=self.datetime) for pk in range(1, constants.COMMENTS_PER_PAGE + 1)]
+
+        hrefs = self.bucket.get_comment_urls(comments, 3)
+
+        # one content object lookup for the whole page, not one per comment
+        verify(self.test_content_type, times(1)).get_object_for_this_type(pk=1)
+        assert hrefs == [c.get_absolute_url(3) for c in comments]
+        assert hrefs[4] == '#/comment/p3/c5/'
+
+    def test_get_page_number_from_position(self):
+        self.comment.position = constants.COMMENTS_PER_PAGE
+        assert self.comment.get_page_number() == 1
+        self.comment.position = constants.COMMENTS_PER_PAGE + 1
+        assert self.comment.get_page_number() == 2
+
+    def test_comment_urls_use_positions(self):
+        when(ContentType.objects).get_for_id(101).thenReturn(self.test_content_type)
+        when(self.test_content_type).get_object_for_this_type(pk=1).thenReturn(self.flatpage)
+        self.comment.position = constants.COMMENTS_PER_PAGE * 4
+        assert self.bucket.get_comment_urls([self.comment], 1) == ['#/comment/p4/c1/']
+
+
+class CommentUrlQueriesTest(TestCase):
+    """ permalinks for a page of comments, counted against a real content table """
+
+    def setUp(self):
+        cursor = connection.cursor()
+        for sql in connection.creation.sql_create_model(FlatPage, no_style())[0]:
+            cursor.execute(sql)
+        self.flatpage = FlatPage.objects.create(url='/about/', title='about', content='')
+        self.content_type = ContentType(pk=101, app_label='flatpages', model='flatpage')
+        when(ContentType.objects).get_for_id(101).thenReturn(self.content_type)
+        self.comments = [MarimoComment(pk=pk, position=pk) for pk in range(1, constants.COMMENTS_PER_PAGE + 1)]
+        cache.clear()
+        self.debug_cursor, connection.use_debug_cursor = connection.use_debug_cursor, True
+        reset_queries()
+
+    def tearDown(self):
+        connection.use_debug_cursor = self.debug_cursor
+        reset_queries()
+        connection.cursor().execute('DROP TABLE %s' % connection.ops.quote_name(FlatPage._meta.db_table))
+        unstub()
+
+    def bucket(self):
+        return MarimoCommentBucket(pk=1, content_type_id=101, object_id=self.flatpage.pk, originating_site_id=1)
+
+    def test_one_query_per_page(self):
+        hrefs = self.bucket().get_comment_urls(self.comments, 1)
+
+        assert len(connection.queries) == 1
+        assert hrefs[0] == '/about/#/comment/p1/c1/'
+
+    def test_no_queries_once_cached(self):
+        self.bucket().get_comment_urls(self.comments, 1)
+        reset_queries()
+
+        self.bucket().get_comment_urls(self.comments, 1)
+        assert len(connection.queries) == 0
+
+
+class BucketTransactionTest(TestCase):
+
+    def setUp(self):
+        connection.cursor().execute('CREATE TABLE marimo_comments_scratch (value integer)')
+        transaction.commit_unless_managed()
+
+    def tearDown(self):
+        connection.cursor().execute('DROP TABLE marimo_comments_scratch')
+        transaction.commit_unless_managed()
+
+    def values(self):
+        cursor = connection.cursor()
+        cursor.execute('SELECT value FROM marimo_comments_scratch')
+        return [row[0] for row in cursor.fetchall()]
+
+    def test_joins_the_callers_transaction(self):
+        with transaction.commit_manually():
+            connection.cursor().execute('INSERT INTO marimo_comments_scratch VALUES (1)')
+            with bucket_transaction('default'):
+                connection.cursor().execute('INSERT INTO marimo_comments_scratch VALUES (2)')
+            # nothing was committed on the caller's behalf
+            transaction.rollback()
+        assert self.values() == []
+
+    def test_commits_on_its_own(self):
+        with bucket_transaction('default'):
+            connection.cursor().execute('INSERT INTO marimo_comments_scratch VALUES (1)')
+        transaction.rollback_unless_managed()
+        assert self.values() == [1]
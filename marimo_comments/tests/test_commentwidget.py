@@ -8,11 +8,12 @@ from django.contrib.flatpages.models import FlatPage
 from django.contrib.sites.models import Site
 from django.http import HttpRequest
 
-from mockito import mock, when
+from mockito import any, mock, unstub, when
 
 from marimo_comments.models import MarimoCommentBucket, MarimoComment
 from marimo_comments.util.mocks import MockCache
-from marimo_comments.views import update_count_cache, post, get_page_and_comment_counts
+from marimo_comments import caching, resolver, views
+from marimo_comments.views import update_count_cache, post, get_page_and_comment_counts, get_bulk_page_and_comment_counts
 
 
 class CommentsWidgetTest(TestCase):
@@ -38,20 +39,48 @@ class CommentsWidgetTest(TestCase):
         self.ajax_req.is_ajax = lambda: True
 
         self.mc = MockCache()
+        when(resolver).get_content_object_url(101, 1).thenReturn('/about/')
+
+    def tearDown(self):
+        unstub()
 
     def test_update_count_cache(self):
         when(MarimoCommentBucket.objects).get(content_type__id=self.test_content_type.pk,
                                               object_id=self.flatpage.pk,
                                               originating_site__id=self.site.pk).thenReturn(self.bucket)
-
-        qs = mock()
-        when(qs).count().thenReturn(1)
-        when(MarimoComment.objects).filter(bucket=self.bucket).thenReturn(qs)
+        self.bucket.comment_count = 1
 
         (total_comments, total_pages) = update_count_cache(self.bucket.content_type_id, self.bucket.object_id, self.site.id)
 
         assert total_comments == 1 and total_pages == 1
 
+    def test_update_count_cache_missing_bucket(self):
+        when(MarimoCommentBucket.objects).get(content_type__id=self.test_content_type.pk,
+                                              object_id=self.flatpage.pk,
+                                              originating_site__id=self.site.pk).thenRaise(MarimoCommentBucket.DoesNotExist)
+
+        assert update_count_cache(self.test_content_type.pk, self.flatpage.pk, self.site.pk) == (0, 1)
+
+    def test_bulk_counts(self):
+        self.mc.cache.clear()
+        qs = mock()
+        when(MarimoCommentBucket.objects).filter(any()).thenReturn(qs)
+        when(qs).values_list('content_type', 'object_id', 'originating_site', 'comment_count').thenReturn([
+            (101, 2, 1, 5),
+        ])
+
+        real_cache = views.cache
+        views.cache = caching.cache = self.mc
+        try:
+            caching.store(caching.count_key(101, 1, 1), (45, 3), 60)
+            counts = get_bulk_page_and_comment_counts([(101, 1, 1), (101, 2, 1), (self.test_content_type, 3, self.site)])
+        finally:
+            views.cache = caching.cache = real_cache
+
+        self.assertEquals(counts, {(101, 1, 1): (45, 3), (101, 2, 1): (5, 1), (101, 3, 1): (0, 1)})
+        # misses are written back, including objects without a bucket
+        self.assertEquals(caching.unpack(self.mc.get(caching.count_key(101, 3, 1))), (0, 1))
+
     def test_posting(self):
         """
         Use the view as a standalone function by passing it a bare-minimum
@@ -72,10 +101,7 @@ class CommentsWidgetTest(TestCase):
             when(MarimoCommentBucket.objects).get(content_type__id=self.test_content_type.pk,
                                                   object_id=self.flatpage.pk,
                                                   originating_site__id=self.site.pk).thenReturn(self.bucket)
-
-            qs = mock()
-            when(qs).count().thenReturn(2)
-            when(MarimoComment.objects).filter(bucket=self.bucket).thenReturn(qs)
+            self.bucket.comment_count = 2
 
             resp = post(self.ajax_req)
             result = json.loads(resp.content)
@@ -87,3 +113,122 @@ class CommentsWidgetTest(TestCase):
 
             (total_comments, total_pages) = get_page_and_comment_counts(self.bucket.content_type_id, self.bucket.object_id, self.site.id)
             self.assertEquals(total_comments, 2)
+
+    def test_feed_not_modified(self):
+        """ a poll with a current ETag is answered from the bucket row alone """
+        qs = mock()
+        when(MarimoCommentBucket.objects).filter(pk=7).thenReturn(qs)
+        when(qs).values_list('last_modified', flat=True).thenReturn([self.datetime])
+
+        real_resolve, resolver.resolve_bucket_id = resolver.resolve_bucket_id, lambda *args: 7
+        try:
+            req = HttpRequest()
+            req.method = 'GET'
+            etag = views._feed_etag(req, '101', '1', '1')
+
+            req = HttpRequest()
+            req.method = 'GET'
+            req.META['HTTP_IF_NONE_MATCH'] = '"%s"' % etag
+            resp = views.feed(req, '101', '1', '1')
+        finally:
+            resolver.resolve_bucket_id = real_resolve
+
+        self.assertEquals(resp.status_code, 304)
+
+    def test_feed_etag_depends_on_page(self):
+        req = HttpRequest()
+        req.method = 'GET'
+        req._marimo_feed_state = (7, self.datetime)
+        first = views._feed_etag(req, '101', '1', '1')
+        req.GET['page'] = '2'
+        assert views._feed_etag(req, '101', '1', '1') != first
+
+    def test_page_cache_key_ignores_raw_cursor(self):
+        """ a garbage cursor is page 1, and never ends up in a cache key """
+        calls = []
+
+        def comment_page(bucket, page=1, cursor=None):
+            calls.append((page, cursor))
+            return {'page': page, 'comments': []}
+
+        self.mc.cache.clear()
+        when(MarimoCommentBucket.objects).get(pk=7).thenReturn(self.bucket)
+        real = (caching.cache, views.get_comment_page)
+        caching.cache, views.get_comment_page = self.mc, comment_page
+        try:
+            views.get_cached_comment_page(7, 3, 'not a cursor ' * 40)
+            views.get_cached_comment_page(7, 1)
+        finally:
+            (caching.cache, views.get_comment_page) = real
+            unstub()
+
+        assert calls == [(1, None)]
+        assert all(' ' not in key and len(key) < 250 for key in self.mc.cache)
+
+    def test_pages_past_the_end_share_the_last_page(self):
+        calls = []
+
+        def comment_page(bucket, page=1, cursor=None):
+            calls.append(page)
+            return {'page': page, 'comments': []}
+
+        self.mc.cache.clear()
+        when(MarimoCommentBucket.objects).get(pk=7).thenReturn(self.bucket)
+        real = (caching.cache, views.get_comment_page, views.get_bucket_num_pages)
+        caching.cache, views.get_comment_page, views.get_bucket_num_pages = self.mc, comment_page, lambda *args: 3
+        try:
+            pages = [views.get_cached_comment_page(7, page)['page'] for page in (999, 1000, 3)]
+        finally:
+            (caching.cache, views.get_comment_page, views.get_bucket_num_pages) = real
+            unstub()
+
+        assert pages == [3, 3, 3]
+        assert calls == [3]
+        assert len([key for key in self.mc.cache if ':page:' in key]) == 1
+
+    def test_feed_rejects_bad_cursor(self):
+        req = HttpRequest()
+        req.method = 'GET'
+        req.GET['cursor'] = 'not a cursor'
+        req._marimo_feed_state = (7, self.datetime)
+        self.assertEquals(views.feed(req, '101', '1', '1').status_code, 400)
+
+    def test_since_is_cached_per_generation(self):
+        """ polling a bucket nothing was posted to doesn't reach the database """
+        calls = []
+
+        def comments_since(bucket_id, field, after):
+            calls.append((bucket_id, field, after))
+            return {'comments': [], 'has_more': False, 'after_id': after}
+
+        self.mc.cache.clear()
+        real = (caching.cache, resolver.resolve_bucket_id, views.get_comments_since)
+        caching.cache, resolver.resolve_bucket_id, views.get_comments_since = self.mc, lambda *args: 7, comments_since
+        try:
+            req = HttpRequest()
+            req.method = 'GET'
+            req.GET['after_id'] = '41'
+            first = views.since(req, '101', '1', '1')
+            second = views.since(req, '101', '1', '1')
+            caching.bump_generation(7)
+            views.since(req, '101', '1', '1')
+        finally:
+            (caching.cache, resolver.resolve_bucket_id, views.get_comments_since) = real
+
+        assert json.loads(first.content) == {'comments': [], 'has_more': False, 'after_id': 41}
+        assert second.content == first.content
+        assert calls == [(7, 'id', 41), (7, 'id', 41)]
+
+    def test_since_needs_after(self):
+        req = HttpRequest()
+        req.method = 'GET'
+        resp = views.since(req, '101', '1', '1')
+        self.assertEquals(resp.status_code, 400)
+
+    def test_since_rejects_out_of_range_ts(self):
+        req = HttpRequest()
+        req.method = 'GET'
+        req.GET['after_ts'] = str(10 ** 20)
+        resp = views.since(req, '101', '1', '1')
+        self.assertEquals(resp.status_code, 400)
+        self.assertEquals(json.loads(resp.content), {'error': 'bad_after'})
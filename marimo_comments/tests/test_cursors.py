@@ -0,0 +1,55 @@
+""" test_cursors.py """
+import datetime
+from unittest import TestCase
+
+from marimo_comments.util import cursors
+
+
+class CursorTest(TestCase):
+
+    def setUp(self):
+        self.datetime = datetime.datetime(2010, 12, 13, 10, 15, 0, 123456)
+
+    def test_round_trip(self):
+        token = cursors.encode_cursor(cursors.NEXT, self.datetime, 42, 7)
+        assert cursors.decode_cursor(token) == (cursors.NEXT, self.datetime, 42, 7)
+
+    def test_cursor_is_opaque(self):
+        token = cursors.encode_cursor(cursors.PREV, self.datetime, 42, 7)
+        assert '42' not in token and '|' not in token
+
+    def test_tampered_cursor(self):
+        for token in ('', 'garbage', cursors.encode_cursor(cursors.NEXT, self.datetime, 42, 7)[:-4]):
+            self.assertRaises(cursors.InvalidCursor, cursors.decode_cursor, token)
+
+    def test_seek_backwards_returns_ascending(self):
+        qs = FakeQuerySet([5, 4, 3])
+
+        comments, has_more = cursors.seek(qs, self.datetime, 42, forward=False, limit=2)
+
+        assert qs.ordering == ('-submit_date', '-id')
+        assert comments == [4, 5]
+        assert has_more
+
+    def test_seek_first_page_is_unfiltered(self):
+        qs = FakeQuerySet([1, 2])
+
+        comments, has_more = cursors.seek(qs, limit=2)
+
+        assert not qs.filtered
+        assert comments == [1, 2]
+        assert not has_more
+
+
+class FakeQuerySet(list):
+    """ just enough of a queryset for seek() """
+    filtered = False
+    ordering = None
+
+    def filter(self, *args, **kwargs):
+        self.filtered = True
+        return self
+
+    def order_by(self, *ordering):
+        self.ordering = ordering
+        return self
@@ -0,0 +1,98 @@
+""" test_fanout.py """
+import json
+import socket
+from unittest import TestCase
+
+from marimo_comments import fanout
+
+
+class FanoutServerTest(TestCase):
+
+    def setUp(self):
+        self.server = fanout.FanoutServer(('127.0.0.1', 0), None, poll_timeout=1)
+        self.viewers = []
+
+    def tearDown(self):
+        for viewer in self.viewers:
+            viewer.close()
+        self.server.shutdown()
+
+    def request(self, target, headers=''):
+        viewer = socket.create_connection(self.server.address)
+        viewer.settimeout(5)
+        viewer.sendall(('GET %s HTTP/1.1\r\n%s\r\n' % (target, headers)).encode('ascii'))
+        self.viewers.append(viewer)
+        # accept, then read the request
+        self.server.run_once(0.1)
+        self.server.run_once(0.1)
+        return viewer
+
+    def read(self, viewer, until):
+        data = b''
+        while until not in data:
+            self.server.run_once(0.01)
+            data += viewer.recv(4096)
+        return data
+
+    def test_event_stream(self):
+        viewers = [self.request('/events/7') for i in range(3)]
+        other = self.request('/events/8')
+        self.server.publish(7, {'comment_id': 1, 'text': 'hi'})
+
+        for viewer in viewers:
+            data = self.read(viewer, b'data:')
+            assert b'Content-Type: text/event-stream' in data
+            (event, comment) = data.rsplit(b'\ndata: ', 1)
+            assert event.endswith(b'id: 1\nevent: comment') and comment.endswith(b'\n\n')
+            assert json.loads(comment.decode('utf-8')) == {'comment_id': 1, 'text': 'hi'}
+        assert self.server.delivered == 3
+        other.setblocking(0)
+        assert b'data:' not in other.recv(4096)
+
+    def test_replay(self):
+        self.server.publish(7, {'comment_id': 1})
+        self.server.publish(7, {'comment_id': 2})
+        data = self.read(self.request('/events/7', 'Last-Event-ID: 1\r\n'), b'data:')
+        assert b'"comment_id":1' not in data and b'"comment_id":2' in data
+
+    def test_idle_backlogs_expire(self):
+        self.server.publish(7, {'comment_id': 1})
+        self.server.publish(8, {'comment_id': 2})
+        self.server.published[7] -= self.server.backlog_ttl
+        self.server.housekeep(self.server.published[8])
+        assert list(self.server.backlogs) == [8] and list(self.server.published) == [8]
+
+    def test_long_poll(self):
+        viewer = self.request('/poll/7?after=0')
+        self.server.publish(7, {'comment_id': 1})
+        data = self.read(viewer, b']')
+        assert json.loads(data.split(b'\r\n\r\n', 1)[1].decode('utf-8')) == [{'id': 1, 'comment': {'comment_id': 1}}]
+        assert not self.server.subscribers
+
+    def test_long_poll_timeout(self):
+        viewer = self.request('/poll/7')
+        self.server.housekeep(self.server.connections[list(self.server.connections)[0]].opened + 1)
+        assert self.read(viewer, b'\r\n\r\n').startswith(b'HTTP/1.1 204')
+
+    def test_not_found(self):
+        assert self.read(self.request('/comments/7'), b'\r\n\r\n').startswith(b'HTTP/1.1 404')
+
+
+class ChannelTest(TestCase):
+
+    def tearDown(self):
+        fanout.set_channel(None)
+
+    def test_message(self):
+        assert fanout.decode_message(fanout.encode_message(7, {'text': u'\u2603'})) == (7, {'text': u'\u2603'})
+
+    def test_memory_channel(self):
+        channel = fanout.MemoryChannel()
+        fanout.set_channel(channel)
+        assert fanout.enabled()
+        fanout.publish(7, {'comment_id': 1})
+        assert channel.messages == [(7, {'comment_id': 1})]
+
+    def test_unix_socket_without_server(self):
+        # publishing never fails a post
+        fanout.UnixSocketChannel('/nonexistent/fanout.sock').send(7, {'comment_id': 1})
@@ -0,0 +1,61 @@
+""" test_history.py """
+import datetime
+from unittest import TestCase
+
+from mockito import any, mock, unstub, when
+
+from marimo_comments import history, resolver
+from marimo_comments.models import MarimoComment, MarimoCommentBucket
+from marimo_comments.util import cursors
+
+
+class UserHistoryTest(TestCase):
+
+    def setUp(self):
+        self.date = datetime.datetime(2012, 5, 1, 12, 0, 0)
+        self.comments = mock()
+        when(MarimoComment.objects).filter(user=5, is_removed=False).thenReturn(self.comments)
+        when(self.comments).values_list(*history.HISTORY_ROW_FIELDS).thenReturn(self.comments)
+        buckets = mock()
+        when(MarimoCommentBucket.objects).filter(pk__in=any()).thenReturn(buckets)
+        when(buckets).values_list('pk', 'content_type', 'object_id', 'originating_site', 'comment_count').thenReturn(
+            [(7, 101, 1, 1, 40), (8, 101, 2, 1, 3)])
+        # the content object of bucket 8 is gone
+        when(resolver).get_content_object_urls(any()).thenReturn({(101, 1): '/about/'})
+
+    def tearDown(self):
+        unstub()
+
+    def values(self, *comment_ids):
+        """ ascending, as seek() returns them """
+        return [(comment_id, 'someone', 'text', self.date, comment_id, 7 if comment_id % 2 else 8)
+                for comment_id in comment_ids]
+
+    def test_newest_page(self):
+        when(cursors).seek(self.comments, None, None, forward=False, limit=2).thenReturn(
+            (self.values(31, 32), True))
+
+        payload = history.get_user_history(5, per_page=2)
+
+        assert [comment['comment_id'] for comment in payload['comments']] == [32, 31]
+        assert payload['comments'][1]['comment_href'] == '/about/#/comment/p2/c31/'
+        assert payload['comments'][1]['content_url'] == '/about/'
+        assert payload['comments'][0]['comment_href'] is None
+        assert payload['comments'][0]['bucket_id'] == 8
+        assert payload['prev_cursor'] is None
+        assert cursors.decode_cursor(payload['next_cursor']) == (cursors.PREV, self.date, 31, 2)
+
+    def test_newer_page(self):
+        cursor = cursors.encode_cursor(cursors.NEXT, self.date, 33, 2)
+        when(cursors).seek(self.comments, self.date, 33, forward=True, limit=2).thenReturn(
+            (self.values(34, 35), False))
+
+        payload = history.get_user_history(5, cursor, per_page=2)
+
+        assert [comment['comment_id'] for comment in payload['comments']] == [35, 34]
+        assert payload['page'] == 2
+        assert payload['prev_cursor'] is None
+        assert cursors.decode_cursor(payload['next_cursor']) == (cursors.PREV, self.date, 34, 3)
+
+    def test_bad_cursor(self):
+        self.assertRaises(cursors.InvalidCursor, history.get_user_history, 5, 'garbage')
@@ -0,0 +1,58 @@
+""" test_import.py """
+import datetime
+from unittest import TestCase
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+from django.core.management.color import no_style
+from django.db import DatabaseError, connection, transaction
+
+from mockito import any, unstub, when
+
+from marimo_comments.management.commands import import_contrib_comments
+from marimo_comments.management.commands.import_contrib_comments import import_chunk, read_checkpoint
+from marimo_comments.models import MarimoComment, MarimoCommentBucket, MarimoCommentImportCheckpoint
+
+MODELS = (Site, ContentType, User, MarimoCommentBucket, MarimoComment, MarimoCommentImportCheckpoint)
+
+
+class ImportChunkTest(TestCase):
+    """ one chunk of django.contrib.comments rows, against real tables """
+
+    def setUp(self):
+        cursor = connection.cursor()
+        for model in MODELS:
+            for sql in connection.creation.sql_create_model(model, no_style())[0]:
+                cursor.execute(sql)
+        transaction.commit_unless_managed()
+        self.date = datetime.datetime(2012, 5, 1, 12, 0, 0)
+
+    def tearDown(self):
+        unstub()
+        cursor = connection.cursor()
+        for model in reversed(MODELS):
+            cursor.execute('DROP TABLE %s' % connection.ops.quote_name(model._meta.db_table))
+        transaction.commit_unless_managed()
+
+    def row(self, pk, object_pk, ip_address):
+        return (pk, 101, object_pk, 1, 1, 'comment %d' % pk, self.date, ip_address, True, False)
+
+    def test_reports_what_it_leaves_out(self):
+        rows = [self.row(1, '7', '10.0.0.1'), self.row(2, 'slug', '10.0.0.2'),
+                self.row(3, '7', '2001:db8::ff00:42:8329'), self.row(4, '8', None)]
+
+        assert import_chunk(rows) == (3, [2], [3])
+        addresses = MarimoComment.objects.order_by().values_list('text', 'ip_address')
+        assert sorted(addresses) == [('comment 1', '10.0.0.1'), ('comment 3', None), ('comment 4', None)]
+        assert MarimoCommentBucket.objects.order_by().count() == 2
+
+    def test_checkpoint_moves_with_the_chunk(self):
+        assert import_chunk([self.row(1, '7', None), self.row(2, 'slug', None)], 'contrib') == (1, [2], [])
+        assert read_checkpoint('contrib') == 2
+
+        when(import_contrib_comments).write_checkpoint('contrib', 4, any()).thenRaise(DatabaseError)
+        self.assertRaises(DatabaseError, import_chunk, [self.row(3, '7', None), self.row(4, '7', None)], 'contrib')
+        # neither the comments nor the checkpoint were written, so a resume imports them once
+        assert read_checkpoint('contrib') == 2
+        assert MarimoComment.objects.order_by().count() == 1
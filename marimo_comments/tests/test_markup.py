@@ -0,0 +1,120 @@
+""" test_markup.py """
+import random
+from unittest import TestCase
+
+from marimo_comments.markup import clean_comment_text
+
+try:
+    from BeautifulSoup import BeautifulSoup, NavigableString
+    from sanitizer.templatetags.sanitizer import allowtags
+except ImportError:
+    allowtags = None
+
+FUZZ_FRAGMENTS = (
+    'hello', 'world', ' ', '  ', '\n', '\n\n', '\t', '"', "'", '=', '/', u'\xe9', u'\u2603',
+    '<b>', '</b>', '<B>', '</B >', '<b class="x">', '<b/>', '<b', '</b', '<br>', '<br/>', '<br />', '<BR>',
+    '</br>', '<i>', '</i>', '<p>', '</p>', '<div>', '</div>', '<a href="http://x/?a=1&b=2">', '</a>',
+    '<span>', '</span>', '<ul>', '<li>', '</li>', '<table>', '<tr>', '<td>', '</table>', '<pre>', '</pre>',
+    '<img src=x onerror="y">', '<script>', '</script>', '<textarea>', '</textarea>', '<!-- c -->', '<!--',
+    '-->', '<', '>', ' < ', '<3', '</>', '<>', '&', '&amp;', '&amp', '&lt;', '&#65;', '&#65', '&#x41;',
+    'AT&T', '&nbsp;', '& ', '&a-b', '<b title="1>2">',
+)
+
+
+def fuzz_corpus(count, seed=0):
+    rand = random.Random(seed)
+    for i in range(count):
+        yield u''.join(rand.choice(FUZZ_FRAGMENTS) for j in range(rand.randint(1, 40)))
+
+
+class CleanCommentTextTest(TestCase):
+
+    def test_plain_text_is_untouched(self):
+        assert clean_comment_text(u'just some text, nothing else') == u'just some text, nothing else'
+
+    def test_bold_is_kept_without_attributes(self):
+        assert clean_comment_text('a <B class="x" onclick="y">b</b> c') == 'a <b>b</b> c'
+
+    def test_br_becomes_newline(self):
+        assert clean_comment_text('a<br>b<br/>c<BR />d') == 'a\nb\nc\nd'
+
+    def test_other_tags_keep_their_text(self):
+        assert clean_comment_text('<p>a <a href="x">link</a></p>') == 'a link'
+
+    def test_comments_are_removed(self):
+        assert clean_comment_text('a<!-- hidden -->b') == 'ab'
+
+    def test_unclosed_bold_is_closed(self):
+        assert clean_comment_text('<b>bold') == '<b>bold</b>'
+        assert clean_comment_text('<i><b>bold</i> not') == '<b>bold</b> not'
+
+    def test_bold_does_not_nest(self):
+        assert clean_comment_text('<b>a<b>b</b>c</b>') == '<b>a</b><b>b</b>c'
+
+    def test_stray_end_tag_is_dropped(self):
+        assert clean_comment_text('a</b>b') == 'ab'
+
+    def test_bare_characters_are_escaped(self):
+        assert clean_comment_text('a < b & c > d') == 'a &lt; b &amp; c &gt; d'
+        # unterminated markup at the end is dropped
+        assert clean_comment_text('a <b') == 'a '
+
+    def test_entities(self):
+        assert clean_comment_text('&amp; &#65; &#x41; &eacute;') == u'&amp; A &amp;#x41; \xe9'
+        assert clean_comment_text('AT&T rocks') == 'AT&amp;T rocks'
+
+    def test_br_splits_bold(self):
+        assert clean_comment_text('<b>a<br>b</b>') == '<b>a</b>\n<b>b</b>'
+
+    def test_whitespace_between_tags_collapses(self):
+        assert clean_comment_text('<b>a</b>   <b>b</b>') == '<b>a</b> <b>b</b>'
+        assert clean_comment_text('a<br>\n\n<br>b') == 'a\n\n\nb'
+
+    def test_script_content_is_escaped(self):
+        assert clean_comment_text('<script><img src=x onerror=y></script>') == '&lt;img src=x onerror=y&gt;'
+
+    def test_declarations_are_text(self):
+        assert clean_comment_text('a<!DOCTYPE html>b<?php x ?>c<![CDATA[d]]>e') == 'aDOCTYPE htmlbphp x ?cde'
+
+    def test_javascript_urls_are_defused(self):
+        assert clean_comment_text('javascript:alert(1)') == 'alert(1)'
+
+    def test_empty_text_does_not_stop_cleaning(self):
+        # allowtags stops sanitizing here, see allowtags_output
+        assert clean_comment_text('<pre><!----></pre><script>x</script><img src=x onerror=y>') == 'x'
+
+    def test_matches_allowtags(self):
+        assert allowtags is not None, 'django-sanitizer (see tox.ini) is needed to compare with allowtags'
+        compared = 0
+        for text in fuzz_corpus(5000):
+            expected = allowtags_output(text)
+            if expected is not None:
+                assert clean_comment_text(text) == expected, repr(text)
+                compared += 1
+        assert compared > 4500
+
+
+def allowtags_output(text):
+    """
+    post()'s output before clean_comment_text, or None where allowtags has no
+    output to match: where it raises, and after an empty text node (an empty
+    comment in <pre>, say). BeautifulSoup links the nodes it parses only
+    behind non-empty ones, so allowtags never sees the rest of the text and
+    passes its tags and attributes through.
+    """
+    def has_empty_text(tag):
+        for child in tag.contents:
+            if isinstance(child, NavigableString):
+                if not child:
+                    return True
+            elif has_empty_text(child):
+                return True
+        return False
+
+    try:
+        if has_empty_text(BeautifulSoup(text, convertEntities=BeautifulSoup.HTML_ENTITIES)):
+            return None
+        return allowtags(text, 'b br').replace('<br />', '\n')
+    except (UnicodeError, ValueError, OverflowError, AttributeError, IndexError):
+        # non-ASCII end tag names, huge character references, a <br> in <b> followed by another tag
+        return None
@@ -0,0 +1,32 @@
+""" test_moderation.py """
+from unittest import TestCase
+
+from mockito import any, mock, unstub, verify, when
+
+from marimo_comments import moderation, rollups
+from marimo_comments.models import MarimoComment, MarimoCommentBucket
+
+
+class ModerationTest(TestCase):
+
+    def tearDown(self):
+        unstub()
+
+    def test_nothing_selected(self):
+        self.assertRaises(ValueError, moderation.select_comments)
+
+    def test_hide(self):
+        comments = mock()
+        visible = mock()
+        distinct = mock()
+        when(comments).filter(is_removed=False).thenReturn(visible)
+        when(visible).order_by().thenReturn(visible)
+        when(visible).values_list('bucket', flat=True).thenReturn(distinct)
+        when(distinct).distinct().thenReturn([7, 8])
+        when(visible).update(is_removed=True).thenReturn(3)
+        when(MarimoCommentBucket.objects).recount([7, 8]).thenReturn(None)
+        when(rollups).reconcile([7, 8]).thenReturn(0)
+
+        assert moderation.hide_comments(comments) == 3
+        verify(MarimoCommentBucket.objects).recount([7, 8])
+        verify(rollups).reconcile([7, 8])
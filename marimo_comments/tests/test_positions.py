@@ -0,0 +1,132 @@
+""" test_positions.py """
+import datetime
+from unittest import TestCase
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from marimo_comments import constants, moderation
+from marimo_comments.models import MarimoComment, MarimoCommentBucket, MarimoCommentRollup
+from marimo_comments.views import get_comment_page
+
+# the default ordering of buckets goes through their site and content type
+MODELS = (Site, ContentType, User, MarimoCommentBucket, MarimoComment, MarimoCommentRollup)
+
+
+class PositionTest(TestCase):
+    """ positions and pages against real tables """
+
+    def setUp(self):
+        cursor = connection.cursor()
+        for model in MODELS:
+            for sql in connection.creation.sql_create_model(model, no_style())[0]:
+                cursor.execute(sql)
+        # the unique index from sql/marimocomment.sql
+        cursor.execute('CREATE UNIQUE INDEX marimo_comments_test_position ON marimo_comments_marimocomment '
+                       '(bucket_id, position)')
+        transaction.commit_unless_managed()
+        cache.clear()
+        User.objects.create(pk=1, username='poster')
+        Site.objects.create(pk=1, domain='example.com', name='example')
+        ContentType.objects.create(pk=101, app_label='flatpages', model='flatpage')
+        self.bucket = MarimoCommentBucket.objects.create(content_type_id=101, object_id=1, originating_site_id=1)
+        self.bucket._content_object_url = '/about/'
+        self.start = datetime.datetime(2012, 5, 1, 12, 0, 0)
+
+    def tearDown(self):
+        cursor = connection.cursor()
+        for model in reversed(MODELS):
+            cursor.execute('DROP TABLE %s' % connection.ops.quote_name(model._meta.db_table))
+        transaction.commit_unless_managed()
+
+    def post(self, count):
+        return [MarimoComment.objects.create(bucket=self.bucket, text='comment %d' % i, user_id=1,
+                                             submit_date=self.start + datetime.timedelta(minutes=i))
+                for i in range(count)]
+
+    def positions(self):
+        return list(MarimoComment.objects.filter(bucket=self.bucket).order_by('submit_date').values_list(
+            'position', flat=True))
+
+    def page(self, page=1, cursor=None):
+        self.bucket = MarimoCommentBucket.objects.get(pk=self.bucket.pk)
+        self.bucket._content_object_url = '/about/'
+        return get_comment_page(self.bucket, page, cursor)
+
+    def test_posts_are_numbered(self):
+        self.post(3)
+        assert self.positions() == [1, 2, 3]
+
+    def test_deletes_close_gaps_in_any_order(self):
+        comments = self.post(6)
+        MarimoComment.objects.filter(pk__in=[comments[1].pk, comments[3].pk]).delete()
+        comments[5].delete()
+
+        assert self.positions() == [1, 2, 3]
+        assert MarimoCommentBucket.objects.get(pk=self.bucket.pk).comment_seq == 3
+        assert self.post(1)[0].position == 4
+
+    def test_hidden_comments_leave_no_gap(self):
+        comments = self.post(4)
+        moderation.hide_comments(MarimoComment.objects.filter(pk=comments[1].pk))
+        assert self.positions() == [1, None, 2, 3]
+
+        moderation.show_comments(MarimoComment.objects.filter(pk=comments[1].pk))
+        assert self.positions() == [1, 2, 3, 4]
+
+    def test_hiding_moves_later_comments_a_run_at_a_time(self):
+        comments = self.post(30)
+        connection.use_debug_cursor = True
+        try:
+            del connection.queries[:]
+            moderation.hide_comments(MarimoComment.objects.filter(pk__in=[comments[1].pk, comments[20].pk]))
+            comments[9].delete()
+            # executemany is logged once, as "<n> times: <sql>"
+            updates = sum(int(query['sql'].split(' times: ')[0]) if ' times: ' in query['sql'] else 1
+                          for query in connection.queries if 'SET "position"' in query['sql'])
+        finally:
+            connection.use_debug_cursor = None
+        assert self.positions() == [1, None] + range(2, 19) + [None] + range(19, 28)
+        # clear the hidden comments, lift and lower the two runs after them; then the same for the deleted one
+        assert updates == 2 + 2 * 2 + 1 + 2
+
+    def test_recount(self):
+        comments = self.post(3)
+        other = MarimoCommentBucket.objects.create(content_type_id=101, object_id=2, originating_site_id=1)
+        MarimoComment.objects.create(bucket=other, text='other', user_id=1, submit_date=self.start)
+        MarimoComment.objects.filter(bucket=other).update(is_removed=True)
+        MarimoComment.objects.filter(pk=comments[2].pk).update(is_removed=True)
+
+        MarimoCommentBucket.objects.recount([self.bucket.pk, other.pk])
+        assert list(MarimoCommentBucket.objects.filter(pk__in=[self.bucket.pk, other.pk]).order_by('pk').values_list(
+            'comment_count', 'last_comment_at', 'comment_seq')) == [
+            (2, self.start + datetime.timedelta(minutes=1), 2), (0, None, 0)]
+
+    def test_pages_stay_full(self):
+        per_page = constants.COMMENTS_PER_PAGE
+        comments = self.post(per_page * 2 + 5)
+        moderation.hide_comments(MarimoComment.objects.filter(pk__in=[c.pk for c in comments[:5]]))
+
+        first = self.page(1)
+        second = self.page(2)
+        assert first['num_pages'] == 2
+        assert len(first['comments']) == len(second['comments']) == per_page
+        assert second['next_cursor'] is None
+        # the cursor leads to the same page as its page number
+        assert self.page(cursor=first['next_cursor'])['comments'] == second['comments']
+        assert self.page(cursor=second['prev_cursor'])['comments'] == first['comments']
+
+    def test_unnumbered_comments_are_not_dropped(self):
+        comments = self.post(3)
+        # as before backfill_comment_positions has run
+        MarimoComment.objects.filter(pk=comments[1].pk).update(position=None)
+
+        page = self.page(1)
+        assert [comment['comment_id'] for comment in page['comments']] == [c.pk for c in comments]
+
+        MarimoCommentBucket.objects.renumber([self.bucket.pk])
+        assert self.positions() == [1, 2, 3]
@@ -0,0 +1,110 @@
+""" test_ratelimit.py """
+import json
+from unittest import TestCase
+
+from django.contrib.auth.models import User
+from django.http import HttpRequest
+
+from marimo_comments import caching, constants, ratelimit, views
+from marimo_comments.util.mocks import MockCache
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1300000000.0
+
+    def time(self):
+        return self.now
+
+
+class RacingCache(MockCache):
+    """ runs ``race`` right after the first reset lock is taken, as if its takes came in meanwhile """
+    race = None
+
+    def add(self, key, value, expiration=None):
+        added = MockCache.add(self, key, value, expiration)
+        if added and key.endswith(':reset') and self.race:
+            (race, self.race) = (self.race, None)
+            race()
+        return added
+
+
+class RateLimitTest(TestCase):
+
+    def setUp(self):
+        self.cache = MockCache()
+        self.cache.cache.clear()
+        self.clock = FakeClock()
+        self.real = (ratelimit.cache, ratelimit.time, constants.RATE_LIMITS)
+        ratelimit.cache = self.cache
+        ratelimit.time = self.clock
+        constants.RATE_LIMITS = {'user': (1, 10, 3), 'ip': (1, 10, 5)}
+
+        self.request = HttpRequest()
+        self.request.user = User(pk=1, username='bharo')
+        self.request.META['REMOTE_ADDR'] = '10.0.0.1'
+
+    def tearDown(self):
+        (ratelimit.cache, ratelimit.time, constants.RATE_LIMITS) = self.real
+
+    def test_burst_then_reject(self):
+        for i in range(3):
+            assert ratelimit.take('k', 1, 10, 3) == 0
+        assert ratelimit.take('k', 1, 10, 3) == 10
+
+    def test_refill(self):
+        for i in range(3):
+            ratelimit.take('k', 1, 10, 3)
+        self.clock.now += 10
+        assert ratelimit.take('k', 1, 10, 3) == 0
+        assert ratelimit.take('k', 1, 10, 3) == 10
+
+    def test_idle_time_does_not_pile_up(self):
+        ratelimit.take('k', 1, 10, 3)
+        self.clock.now += 3600
+        for i in range(3):
+            assert ratelimit.take('k', 1, 10, 3) == 0
+        assert ratelimit.take('k', 1, 10, 3) > 0
+
+    def test_concurrent_takes_on_idle_bucket(self):
+        ratelimit.cache = self.cache = RacingCache()
+        ratelimit.take('k', 1, 10, 3)
+        self.clock.now += 3600
+        raced = []
+        self.cache.race = lambda: raced.extend(ratelimit.take('k', 1, 10, 3) for i in range(4))
+
+        # racing the reset, they get through, but they are charged
+        assert ratelimit.take('k', 1, 10, 3) == 0
+        assert raced == [0, 0, 0, 0]
+        assert self.cache.get('k') == int(self.clock.now * 1000) + 5 * 10000
+        assert ratelimit.take('k', 1, 10, 3) == 30
+        assert self.cache.get('k:reset') is None
+
+    def test_rejected_posts_are_not_charged(self):
+        for i in range(3):
+            assert ratelimit.check_post(self.request) is None
+        ip_key = caching.rate_key('ip', '10.0.0.1')
+        full_at = self.cache.get(ip_key)
+        assert ratelimit.check_post(self.request) == 10
+        assert self.cache.get(ip_key) == full_at
+
+    def test_ip_limit_gives_back_user_token(self):
+        constants.RATE_LIMITS = {'user': (1, 10, 5), 'ip': (1, 10, 1)}
+        user_key = caching.rate_key('user', 1)
+        assert ratelimit.check_post(self.request) is None
+        full_at = self.cache.get(user_key)
+        assert ratelimit.check_post(self.request)
+        assert self.cache.get(user_key) == full_at
+
+    def test_post_rejected_before_database(self):
+        self.request.method = 'POST'
+        self.request.is_ajax = lambda: True
+        self.request.POST.update({'text': 'spam', 'content_type_id': 1, 'object_id': 1, 'site_id': 1})
+        constants.RATE_LIMITS = {'user': (1, 10, 1)}
+        ratelimit.check_post(self.request)
+
+        response = views.post(self.request)
+        assert response.status_code == 429
+        assert response['Retry-After'] == '10'
+        assert json.loads(response.content) == {'error': 'rate_limited'}
@@ -0,0 +1,169 @@
+""" test_resolver.py """
+from unittest import TestCase
+
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.flatpages.models import FlatPage
+from django.db.models.signals import post_save
+
+from mockito import any, mock, times, unstub, verify, when
+
+from marimo_comments import caching, resolver
+from marimo_comments.models import MarimoCommentBucket, MarimoCommentSnapshot
+from marimo_comments.util.lru import LRUCache
+from marimo_comments.util.mocks import MockCache
+
+
+class LRUCacheTest(TestCase):
+
+    def test_evicts_least_recently_used(self):
+        lru = LRUCache(max_size=2)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        assert lru.get('a') == 1
+        assert lru.get('b') is None
+        assert lru.get('c') == 3
+        assert len(lru) == 2
+
+    def test_expiry(self):
+        lru = LRUCache()
+        lru.set('a', 1, timeout=-1)
+        lru.set('b', 2, timeout=60)
+        assert lru.get('a') is None
+        assert lru.get('b') == 2
+
+    def test_delete(self):
+        lru = LRUCache()
+        lru.set('a', 1)
+        lru.delete('a')
+        lru.delete('missing')
+        assert lru.get('a') is None
+
+
+class ResolverTest(TestCase):
+
+    def setUp(self):
+        self.mc = MockCache()
+        self.mc.cache.clear()
+        resolver.local_cache.clear()
+        self.real_cache, resolver.cache = resolver.cache, self.mc
+        self.qs = mock()
+        when(MarimoCommentBucket.objects).values_list('pk', flat=True).thenReturn(self.qs)
+
+    def tearDown(self):
+        resolver.cache = self.real_cache
+
+    def test_resolves_once(self):
+        when(self.qs).get(content_type=101, object_id=1, originating_site=1).thenReturn(7)
+
+        assert resolver.resolve_bucket_id(101, 1, 1) == 7
+        assert resolver.resolve_bucket_id(101, 1, 1) == 7
+        verify(self.qs, times(1)).get(content_type=101, object_id=1, originating_site=1)
+
+    def test_negative_caching(self):
+        when(self.qs).get(content_type=101, object_id=2, originating_site=1).thenRaise(
+            MarimoCommentBucket.DoesNotExist)
+
+        assert resolver.resolve_bucket_id(101, 2, 1) is None
+        assert resolver.resolve_bucket_id(101, 2, 1) is None
+        verify(self.qs, times(1)).get(content_type=101, object_id=2, originating_site=1)
+
+    def test_shared_tier_fills_local_tier(self):
+        self.mc.set(caching.bucket_key(101, 3, 1), 9)
+
+        assert resolver.resolve_bucket_id(101, 3, 1) == 9
+        self.mc.cache.clear()
+        assert resolver.resolve_bucket_id(101, 3, 1) == 9
+
+    def test_created_bucket_replaces_negative_entry(self):
+        when(self.qs).get(content_type=101, object_id=4, originating_site=1).thenRaise(
+            MarimoCommentBucket.DoesNotExist)
+        assert resolver.resolve_bucket_id(101, 4, 1) is None
+
+        resolver.bucket_created(MarimoCommentBucket(pk=11, content_type_id=101, object_id=4, originating_site_id=1))
+
+        assert resolver.resolve_bucket_id(101, 4, 1) == 11
+
+
+class ContentUrlTest(TestCase):
+
+    def setUp(self):
+        self.mc = MockCache()
+        self.mc.cache.clear()
+        self.real_cache, resolver.cache = resolver.cache, self.mc
+        self.real_caching_cache, caching.cache = caching.cache, self.mc
+        self.content_type = ContentType(pk=101, app_label='flatpages', model='flatpage')
+        self.flatpage = FlatPage(pk=1, url='/about/')
+        when(ContentType.objects).get_for_id(101).thenReturn(self.content_type)
+        when(ContentType.objects).get_for_model(self.flatpage).thenReturn(self.content_type)
+        resolver.register_content_model(FlatPage)
+
+    def tearDown(self):
+        resolver.cache = self.real_cache
+        caching.cache = self.real_caching_cache
+        resolver.unregister_content_model(FlatPage)
+        unstub()
+
+    def test_resolves_once(self):
+        when(self.content_type).get_object_for_this_type(pk=1).thenReturn(self.flatpage)
+
+        assert resolver.get_content_object_url(101, 1) == '/about/'
+        assert resolver.get_content_object_url(101, 1) == '/about/'
+        verify(self.content_type, times(1)).get_object_for_this_type(pk=1)
+
+    def test_bulk_urls(self):
+        caching.store(caching.content_url_key(101, 1), '/about/', 60)
+        flatpages = mock()
+        when(self.content_type).get_all_objects_for_this_type().thenReturn(flatpages)
+        # 3 is gone
+        when(flatpages).in_bulk(any()).thenReturn({2: FlatPage(pk=2, url='/contact/')})
+
+        assert resolver.get_content_object_urls([(101, 1), (101, 2), (101, 3), (101, 1)]) == {
+            (101, 1): '/about/', (101, 2): '/contact/'}
+        assert resolver.get_content_object_url(101, 2) == '/contact/'
+
+    def test_unchanged_save_keeps_pages(self):
+        caching.store(caching.content_url_key(101, 1), '/about/', 60)
+        generation = caching.get_generation(7)
+
+        resolver.content_object_saved(self.flatpage)
+        assert caching.get_generation(7) == generation
+
+    def test_moved_object_keeps_pages(self):
+        """ pages don't hold the url, see views.add_content_url """
+        caching.store(caching.content_url_key(101, 1), '/about/', 60)
+        generation = caching.get_generation(7)
+        self.flatpage.url = '/about-us/'
+
+        resolver.content_object_saved(self.flatpage)
+        assert resolver.get_content_object_url(101, 1) == '/about-us/'
+        assert caching.get_generation(7) == generation
+
+    def test_delete_forgets_url(self):
+        caching.store(caching.content_url_key(101, 1), '/about/', 60)
+        resolver.content_object_deleted(self.flatpage)
+        assert self.mc.get(caching.content_url_key(101, 1)) is None
+
+    def test_registration(self):
+        assert resolver.is_content_model(FlatPage)
+        assert not resolver.is_content_model(MarimoCommentBucket)
+
+    def test_receivers_only_for_registered_models(self):
+        saved = []
+        real = resolver.content_object_saved
+        resolver.content_object_saved = lambda instance, created=False, raw=False: saved.append(instance)
+        try:
+            post_save.send(sender=FlatPage, instance=self.flatpage, created=False)
+            post_save.send(sender=MarimoCommentSnapshot, instance=MarimoCommentSnapshot(), created=False)
+            resolver.unregister_content_model(FlatPage)
+            post_save.send(sender=FlatPage, instance=self.flatpage, created=False)
+        finally:
+            resolver.content_object_saved = real
+        assert saved == [self.flatpage]
+
+    def test_listed_models_are_registered_as_they_load(self):
+        resolver.unregister_content_model(FlatPage)
+        resolver._pending_content_models.add('flatpages.flatpage')
+        resolver._register_content_models()
+        assert resolver.is_content_model(FlatPage) and not resolver._pending_content_models
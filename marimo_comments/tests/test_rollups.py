@@ -0,0 +1,76 @@
+""" test_rollups.py """
+import datetime
+from unittest import TestCase
+
+from mockito import any, mock, never, times, unstub, verify, when
+
+from marimo_comments import caching, constants, rollups
+from marimo_comments.models import MarimoCommentRollup
+
+
+class SliceTest(TestCase):
+
+    def test_slice_start(self):
+        assert constants.LEADERBOARD_SLICE == 600
+        assert rollups.slice_start(datetime.datetime(2012, 5, 1, 12, 19, 59, 999)) == \
+            datetime.datetime(2012, 5, 1, 12, 10)
+        assert rollups.slice_start(datetime.datetime(2012, 5, 1, 0, 0)) == datetime.datetime(2012, 5, 1, 0, 0)
+
+    def test_window_start(self):
+        now = datetime.datetime(2012, 5, 1, 12, 15)
+        assert rollups.window_start(1, now) == datetime.datetime(2012, 5, 1, 11, 10)
+        assert rollups.window_start(24, now) == datetime.datetime(2012, 4, 30, 12, 10)
+
+
+class RecordTest(TestCase):
+
+    def setUp(self):
+        self.submit_date = datetime.datetime(2012, 5, 1, 12, 15)
+        self.rollups = mock()
+        when(MarimoCommentRollup.objects).filter(bucket=7, slice=datetime.datetime(2012, 5, 1, 12, 10)).thenReturn(
+            self.rollups)
+
+    def tearDown(self):
+        unstub()
+
+    def test_increments(self):
+        when(self.rollups).update(count=any()).thenReturn(1)
+        when(MarimoCommentRollup.objects).get_or_create(bucket_id=any(), slice=any(), defaults=any())
+
+        rollups.record(7, 1, self.submit_date)
+
+        verify(self.rollups).update(count=any())
+        verify(MarimoCommentRollup.objects, never).get_or_create(bucket_id=any(), slice=any(), defaults=any())
+
+    def test_creates_first_slice(self):
+        when(self.rollups).update(count=any()).thenReturn(0)
+        when(MarimoCommentRollup.objects).get_or_create(bucket_id=any(), slice=any(), defaults=any()).thenReturn(
+            (mock(), True))
+
+        rollups.record(7, 1, self.submit_date)
+
+        verify(MarimoCommentRollup.objects).get_or_create(
+            bucket_id=7, slice=datetime.datetime(2012, 5, 1, 12, 10), defaults={'site_id': 1})
+        verify(self.rollups, times(2)).update(count=any())
+
+    def test_decrement_never_goes_negative(self):
+        positive = mock()
+        when(self.rollups).filter(count__gte=1).thenReturn(positive)
+
+        rollups.record(7, None, self.submit_date, -1)
+
+        verify(positive).update(count=any())
+        verify(self.rollups, never).update(count=any())
+
+
+class MostCommentedTest(TestCase):
+
+    def tearDown(self):
+        unstub()
+
+    def test_cached(self):
+        leaders = [{'bucket_id': 7, 'content_type_id': 101, 'object_id': 1, 'comments': 3}]
+        when(caching).get_or_set(caching.leaderboard_key(1, 24, 10), any(),
+                                 constants.LEADERBOARD_CACHE_TIMEOUT).thenReturn(leaders)
+
+        assert rollups.most_commented(1, 24) == leaders
@@ -0,0 +1,159 @@
+""" test_routers.py """
+import datetime
+from unittest import TestCase
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.management.color import no_style
+from django.db import connections, router, transaction
+from django.http import HttpRequest, HttpResponse
+
+from marimo_comments import caching, constants, routers, views
+from marimo_comments.models import MarimoComment, MarimoCommentBucket, MarimoCommentRollup
+
+# the default ordering of buckets goes through their site and content type
+MODELS = (Site, ContentType, User, MarimoCommentBucket, MarimoComment, MarimoCommentRollup)
+
+
+class ReplicaRouterTest(TestCase):
+    """ the test settings' default and replica databases as primary and replica """
+
+    def setUp(self):
+        self.real = (router.routers, constants.DB_PRIMARY, constants.DB_REPLICAS)
+        router.routers = [routers.ReplicaRouter()]
+        constants.DB_PRIMARY = 'default'
+        constants.DB_REPLICAS = ['replica']
+        routers.unpin()
+
+    def tearDown(self):
+        (router.routers, constants.DB_PRIMARY, constants.DB_REPLICAS) = self.real
+        routers.unpin()
+
+    def test_reads_go_to_replica(self):
+        assert MarimoComment.objects.all().db == 'replica'
+        assert MarimoCommentBucket.objects.filter(pk=1).db == 'replica'
+
+    def test_writes_go_to_primary(self):
+        assert router.db_for_write(MarimoComment) == 'default'
+
+    def test_write_pins_reads(self):
+        router.db_for_write(MarimoComment)
+        assert MarimoComment.objects.all().db == 'default'
+
+    def test_other_apps_are_not_routed(self):
+        assert router.db_for_read(User) == 'default'
+        router.db_for_write(User)
+        assert not routers.is_pinned()
+
+    def test_no_replicas(self):
+        constants.DB_REPLICAS = []
+        assert MarimoComment.objects.all().db == 'default'
+
+    def test_relation_across_replica(self):
+        bucket = MarimoCommentBucket(pk=1)
+        bucket._state.db = 'replica'
+        user = User(pk=1)
+        user._state.db = 'default'
+        assert router.allow_relation(bucket, user)
+
+    def test_replicas_are_not_synced(self):
+        assert not routers.ReplicaRouter().allow_syncdb('replica', MarimoComment)
+        assert routers.ReplicaRouter().allow_syncdb('default', MarimoComment) is None
+        # other apps' tables on a replica alias are up to the other routers
+        assert routers.ReplicaRouter().allow_syncdb('replica', User) is None
+
+
+class ReplicaPagesTest(TestCase):
+    """ cached pages against a primary and a replica that hasn't caught up """
+
+    def setUp(self):
+        self.real = (router.routers, constants.DB_PRIMARY, constants.DB_REPLICAS)
+        router.routers = [routers.ReplicaRouter()]
+        constants.DB_PRIMARY = 'default'
+        constants.DB_REPLICAS = ['replica']
+        for alias in ('default', 'replica'):
+            cursor = connections[alias].cursor()
+            for model in MODELS:
+                for sql in connections[alias].creation.sql_create_model(model, no_style())[0]:
+                    cursor.execute(sql)
+            User.objects.using(alias).create(pk=1, username='poster')
+            Site.objects.using(alias).create(pk=1, domain='example.com', name='example')
+            ContentType.objects.using(alias).create(pk=101, app_label='auth', model='user')
+            MarimoCommentBucket.objects.using(alias).create(pk=1, content_type_id=101, object_id=1,
+                                                            originating_site_id=1)
+            transaction.commit_unless_managed(using=alias)
+        cache.clear()
+        ContentType.objects.clear_cache()
+        caching.store(caching.content_url_key(101, 1), '/about/', 60)
+        routers.unpin()
+
+    def tearDown(self):
+        for alias in ('default', 'replica'):
+            cursor = connections[alias].cursor()
+            for model in reversed(MODELS):
+                cursor.execute('DROP TABLE %s' % connections[alias].ops.quote_name(model._meta.db_table))
+            transaction.commit_unless_managed(using=alias)
+        (router.routers, constants.DB_PRIMARY, constants.DB_REPLICAS) = self.real
+        routers.unpin()
+        cache.clear()
+        ContentType.objects.clear_cache()
+
+    def post(self):
+        comment = MarimoComment.objects.create(bucket_id=1, text='new', user_id=1,
+                                               submit_date=datetime.datetime(2012, 5, 1, 12, 0, 0))
+        transaction.commit_unless_managed()
+        # the next reader is somebody else
+        routers.unpin()
+        return comment
+
+    def comment_ids(self):
+        return [comment['comment_id'] for comment in views.get_cached_comment_page(1)['comments']]
+
+    def test_pages_are_read_from_the_replica(self):
+        self.post()
+        # once replicas have had their time to catch up, which this one never does
+        cache.delete(caching.bumped_key(1))
+        cache.incr(caching.generation_key(1))
+        assert self.comment_ids() == []
+
+    def test_bumped_pages_are_built_from_the_primary(self):
+        assert self.comment_ids() == []
+        comment = self.post()
+        assert caching.get_generation_state(1)[1]
+        assert self.comment_ids() == [comment.pk]
+        # and cached like that
+        assert self.comment_ids() == [comment.pk]
+        assert not routers.is_pinned()
+
+
+class PinningMiddlewareTest(TestCase):
+
+    def setUp(self):
+        self.middleware = routers.PinningMiddleware()
+        routers.unpin()
+
+    def tearDown(self):
+        routers.unpin()
+
+    def test_write_sets_cookie(self):
+        request = HttpRequest()
+        self.middleware.process_request(request)
+        routers.ReplicaRouter().db_for_write(MarimoComment)
+        response = self.middleware.process_response(request, HttpResponse())
+        assert response.cookies[routers.PIN_COOKIE]['max-age'] == constants.DB_PIN_SECONDS
+        assert not routers.is_pinned()
+
+    def test_cookie_pins_request(self):
+        request = HttpRequest()
+        request.COOKIES[routers.PIN_COOKIE] = '1'
+        self.middleware.process_request(request)
+        assert routers.is_pinned()
+        # reading doesn't extend the pin
+        assert routers.PIN_COOKIE not in self.middleware.process_response(request, HttpResponse()).cookies
+
+    def test_reads_do_not_pin(self):
+        request = HttpRequest()
+        self.middleware.process_request(request)
+        assert routers.PIN_COOKIE not in self.middleware.process_response(request, HttpResponse()).cookies
@@ -0,0 +1,61 @@
+""" test_search.py """
+from unittest import TestCase
+
+from django.db import connections
+
+from mockito import unstub, when
+
+from marimo_comments import search
+from marimo_comments.models import MarimoComment
+
+
+class SqliteSearchTest(TestCase):
+
+    def setUp(self):
+        self.backend = search.SqliteSearch(connections['default'])
+        self.backend.install()
+        self.backend.index([(90001, 'buy cheap watches now'), (90002, 'cheap cheap watches'),
+                            (90003, 'a comment about watches')])
+
+    def tearDown(self):
+        self.backend.forget([90001, 90002, 90003])
+
+    def test_ranked(self):
+        assert self.backend.search('cheap watches', 0, 10) == [90002, 90001]
+
+    def test_paged(self):
+        assert len(self.backend.search('watches', 0, 2)) == 2
+        assert len(self.backend.search('watches', 2, 2)) == 1
+
+    def test_query_syntax_is_literal(self):
+        assert self.backend.search('"cheap" OR -watches*', 0, 10) == [90002, 90001]
+        assert self.backend.search('!!!', 0, 10) == []
+        assert self.backend.search('OR', 0, 10) == []
+
+    def test_reindex_replaces(self):
+        self.backend.index([(90003, 'now about clocks')])
+        assert self.backend.search('watches', 0, 10) == [90002, 90001]
+        assert self.backend.search('clocks', 0, 10) == [90003]
+
+    def test_forget(self):
+        self.backend.forget([90001])
+        assert self.backend.search('cheap', 0, 10) == [90002]
+
+
+class SearchCommentsTest(TestCase):
+
+    def tearDown(self):
+        unstub()
+
+    def test_page(self):
+        when(search).search_ids('spam', 20, 21).thenReturn(list(range(21, 42)))
+        comments = dict((pk, MarimoComment(pk=pk)) for pk in range(21, 41))
+        # 40 went missing since it was indexed
+        del comments[40]
+        qs = MarimoComment.objects.select_related('user')
+        when(MarimoComment.objects).select_related('user').thenReturn(qs)
+        when(qs).in_bulk(list(range(21, 41))).thenReturn(comments)
+
+        (page, has_more) = search.search_comments('spam', 2)
+        assert [comment.pk for comment in page] == list(range(21, 40))
+        assert has_more
@@ -0,0 +1,35 @@
+""" test_serialization.py """
+import datetime
+from unittest import TestCase
+
+from marimo_comments import serialization
+
+
+class SerializationTest(TestCase):
+
+    def test_submit_date_matches_strftime(self):
+        for hour in range(24):
+            date = datetime.datetime(2010, 12, 3, hour, 5, 0)
+            legacy = date.strftime("%l:%M %p %b. %e, %Y").replace('AM', 'a.m.').replace('PM', 'p.m.')
+            assert serialization.format_submit_date(date) == legacy
+
+    def test_timestamp_matches_strftime(self):
+        date = datetime.datetime(2010, 7, 13, 10, 15, 0)
+        assert serialization.timestamp(date) == int(date.strftime('%s'))
+
+    def test_serialize_comments(self):
+        date = datetime.datetime(2010, 12, 13, 22, 15, 0)
+        rows = serialization.to_rows([(1, 'bharo', 'Test Comment', date, 1)])
+
+        assert serialization.serialize_comments(rows, ['#/comment/p1/c1/']) == [{
+            'comment_href': '#/comment/p1/c1/',
+            'poster': 'bharo',
+            'submit_date': '10:15 p.m. Dec. 13, 2010',
+            'submitted_ts': serialization.timestamp(date),
+            'text': 'Test Comment',
+            'comment_id': 1,
+        }]
+
+    def test_rows_have_no_dict(self):
+        row = serialization.CommentRow(1, 'bharo', 'Test Comment', None, 1)
+        assert not hasattr(row, '__dict__')
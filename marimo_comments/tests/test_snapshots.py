@@ -0,0 +1,146 @@
+""" test_snapshots.py """
+import datetime
+import json
+from unittest import TestCase
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.http import HttpRequest
+
+from mockito import times, unstub, verify, when
+
+from marimo_comments import caching, constants, resolver, snapshots
+from marimo_comments.models import (MarimoComment, MarimoCommentBucket, MarimoCommentRollup,
+                                    MarimoCommentSnapshot)
+from marimo_comments.util import cursors
+from marimo_comments.views import feed, get_cached_comment_page, post
+
+# the default ordering of buckets goes through their site and content type
+MODELS = (Site, ContentType, User, MarimoCommentBucket, MarimoComment, MarimoCommentRollup, MarimoCommentSnapshot)
+
+
+class SnapshotTest(TestCase):
+
+    def setUp(self):
+        self.modified = datetime.datetime(2011, 4, 1, 12, 0, 0)
+        self.bucket = MarimoCommentBucket(pk=1, content_type_id=101, object_id=1, originating_site=Site(pk=1),
+                                          status=constants.COMMENTS_FROZEN_STATUS, last_modified=self.modified)
+        self.snapshot = MarimoCommentSnapshot(bucket=self.bucket, bucket_modified=self.modified)
+        self.snapshot.dump({
+            'total_comments': 3,
+            'num_pages': 2,
+            'pages': [
+                {'comments': [{'comment_id': 1}, {'comment_id': 2}], 'next_cursor': 'n2', 'prev_cursor': None},
+                {'comments': [{'comment_id': 3}], 'next_cursor': None, 'prev_cursor': 'p1'},
+            ],
+        })
+        when(MarimoCommentSnapshot.objects).filter(bucket=1).thenReturn([self.snapshot])
+
+    def tearDown(self):
+        unstub()
+
+    def test_dump_load(self):
+        assert self.snapshot.load()['pages'][1]['comments'] == [{'comment_id': 3}]
+
+    def test_page(self):
+        context = snapshots.get_snapshot_page(self.bucket, 2)
+        assert context['comments'] == [{'comment_id': 3}]
+        assert context['prev_cursor'] == 'p1'
+        assert context['total_comments'] == 3
+        assert context['frozen']
+
+    def test_page_past_end(self):
+        assert snapshots.get_snapshot_page(self.bucket, 9)['page'] == 2
+
+    def test_cursor_page(self):
+        cursor = cursors.encode_cursor(cursors.NEXT, self.modified, 2, 2)
+        assert snapshots.get_snapshot_page(self.bucket, 1, cursor)['page'] == 2
+
+    def test_stale_snapshot_is_not_served(self):
+        self.bucket.last_modified = self.modified + datetime.timedelta(seconds=1)
+        assert snapshots.get_snapshot_page(self.bucket, 1) is None
+
+    def test_post_to_frozen_bucket(self):
+        request = HttpRequest()
+        request.method = 'POST'
+        request.is_ajax = lambda: True
+        request.user = User(pk=1, username='bharo')
+        request.POST.update({'text': 'too late', 'content_type_id': 101, 'object_id': 1, 'site_id': 1})
+        when(resolver).resolve_bucket_id(101, 1, 1).thenReturn(1)
+        when(MarimoCommentBucket.objects).get(pk=1).thenReturn(self.bucket)
+
+        response = post(request)
+        assert response.status_code == 403
+        assert json.loads(response.content) == {'error': 'comments_frozen'}
+        # turned away before get_or_create could write
+        verify(MarimoCommentBucket.objects, times(0)).get_or_create(content_type_id=101, object_id=1,
+                                                                     originating_site_id=1)
+
+
+class FrozenFeedTest(TestCase):
+    """ feed pollers across a freeze and a thaw, against real tables """
+
+    def setUp(self):
+        cursor = connection.cursor()
+        for model in MODELS:
+            for sql in connection.creation.sql_create_model(model, no_style())[0]:
+                cursor.execute(sql)
+        transaction.commit_unless_managed()
+        cache.clear()
+        ContentType.objects.clear_cache()
+        User.objects.create(pk=1, username='poster')
+        Site.objects.create(pk=1, domain='example.com', name='example')
+        ContentType.objects.create(pk=101, app_label='auth', model='user')
+        self.bucket = MarimoCommentBucket.objects.create(content_type_id=101, object_id=1, originating_site_id=1)
+        MarimoComment.objects.create(bucket=self.bucket, text='first', user_id=1,
+                                     submit_date=datetime.datetime(2012, 5, 1, 12, 0, 0))
+        self.bucket = MarimoCommentBucket.objects.get(pk=self.bucket.pk)
+        caching.store(caching.content_url_key(101, 1), '/about/', 60)
+        when(resolver).resolve_bucket_id('101', '1', '1').thenReturn(self.bucket.pk)
+
+    def tearDown(self):
+        unstub()
+        cursor = connection.cursor()
+        for model in reversed(MODELS):
+            cursor.execute('DROP TABLE %s' % connection.ops.quote_name(model._meta.db_table))
+        transaction.commit_unless_managed()
+        cache.clear()
+        ContentType.objects.clear_cache()
+
+    def poll(self, etag=None):
+        request = HttpRequest()
+        request.method = 'GET'
+        if etag:
+            request.META['HTTP_IF_NONE_MATCH'] = etag
+        return feed(request, '101', '1', '1')
+
+    def test_freeze_and_thaw_change_the_etag(self):
+        etag = self.poll()['ETag']
+        assert self.poll(etag).status_code == 304
+
+        snapshots.freeze(self.bucket)
+        response = self.poll(etag)
+        assert response.status_code == 200
+        assert json.loads(response.content)['frozen']
+        # served from the snapshot, which is still current
+        assert MarimoCommentSnapshot.objects.get(bucket=self.bucket).bucket_modified == \
+            MarimoCommentBucket.objects.get(pk=self.bucket.pk).last_modified
+
+        etag = response['ETag']
+        snapshots.thaw(self.bucket)
+        response = self.poll(etag)
+        assert response.status_code == 200
+        assert not json.loads(response.content)['frozen']
+
+    def test_permalinks_follow_the_content_url(self):
+        snapshots.freeze(self.bucket)
+        assert get_cached_comment_page(self.bucket.pk)['comments'][0]['comment_href'].startswith('/about/#')
+
+        # the url's own cache entry refreshed, the page and the snapshot untouched
+        caching.store(caching.content_url_key(101, 1), '/about-us/', 60)
+        assert get_cached_comment_page(self.bucket.pk)['comments'][0]['comment_href'] == \
+            '/about-us/#/comment/p1/c%d/' % MarimoComment.objects.get().pk
@@ -0,0 +1,61 @@
+""" test_stats.py """
+from unittest import TestCase
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from marimo_comments import stats
+from marimo_comments.signals import hotpath_measured
+
+
+class StatsTest(TestCase):
+
+    def setUp(self):
+        self.sink = stats.MemorySink()
+        stats.set_sink(self.sink)
+
+    def tearDown(self):
+        stats.set_sink(None)
+
+    def test_instrument_records_time_and_payload(self):
+        @stats.instrument('thing')
+        def thing():
+            return HttpResponse('12345')
+
+        thing()
+
+        assert len(self.sink.values('thing.time')) == 1
+        assert self.sink.values('thing.payload') == [5]
+
+    def test_cache_hits_are_attributed_to_the_call(self):
+        measured = []
+
+        def receiver(sender, **kwargs):
+            measured.append(kwargs)
+        hotpath_measured.connect(receiver)
+
+        @stats.instrument('thing')
+        def thing():
+            stats.cache_hit('counts')
+            stats.cache_miss('page')
+            stats.cache_miss('page')
+
+        try:
+            thing()
+        finally:
+            hotpath_measured.disconnect(receiver)
+
+        assert measured[0]['name'] == 'thing'
+        assert (measured[0]['cache_hits'], measured[0]['cache_misses']) == (1, 2)
+        assert self.sink.values('cache.page.miss') == [1, 1]
+
+    def test_query_budget(self):
+        counts = iter([0, 4])
+        real_count, stats._query_count = stats._query_count, lambda: next(counts)
+        settings.MARIMO_COMMENTS_QUERY_BUDGETS = {'thing': 3}
+        try:
+            self.assertRaises(stats.QueryBudgetExceeded, stats.instrument('thing')(lambda: None))
+        finally:
+            stats._query_count = real_count
+            del settings.MARIMO_COMMENTS_QUERY_BUDGETS
+        assert self.sink.values('thing.queries') == [4]
@@ -0,0 +1,8 @@
+from django.conf.urls import patterns, url
+
+urlpatterns = patterns('marimo_comments.views',
+    url(r'^feed/(?P<content_type_id>\d+)/(?P<object_id>\d+)/(?P<site_id>\d+)/$', 'feed', name='marimo_comments_feed'),
+    url(r'^since/(?P<content_type_id>\d+)/(?P<object_id>\d+)/(?P<site_id>\d+)/$', 'since', name='marimo_comments_since'),
+    url(r'^search/$', 'search', name='marimo_comments_search'),
+    url(r'^history/(?P<user_id>\d+)/$', 'user_history', name='marimo_comments_history'),
+)
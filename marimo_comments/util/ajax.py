@@ -52,6 +52,18 @@ def ajax_auth_required(fun):
 
     return wrapper
 
+def ajax_staff_required(fun):
+    """
+    View decorator that will require a view to be accessed by a staff member.
+    Uses ajax_error to respond to everybody else.
+    """
+    def wrapper(*args, **kwargs):
+        if not args[0].user.is_staff:
+            return ajax_error(403, 'staff_required')
+        return fun(*args, **kwargs)
+
+    return wrapper
+
 def ajax_method(method):
     """
     View decorator that will require a view to be accessed only by the
@@ -0,0 +1,73 @@
+""" keyset (seek) pagination over comments ordered by (submit_date, id).
+
+Cursors are opaque to clients: a urlsafe base64 string which encodes the
+direction to seek in, the (submit_date, id) of the comment to seek from, and
+the page number the resulting page should be labelled with.
+"""
+import base64
+import binascii
+import datetime
+
+from django.db.models import Q
+
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+NEXT = 'n'
+PREV = 'p'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(direction, submit_date, comment_id, page):
+    """
+    :param direction: NEXT to seek past the comment, PREV to seek before it
+    :param submit_date: submit_date of the comment to seek from
+    :param comment_id: id of the comment to seek from
+    :param page: 1-based page number of the page the cursor leads to
+    :returns: opaque cursor string
+    """
+    raw = '%s|%s|%d|%d' % (direction, submit_date.strftime(DATE_FORMAT), comment_id, page)
+    return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    :param cursor: string produced by encode_cursor
+    :returns: tuple of (direction, submit_date, comment_id, page)
+    :raises InvalidCursor: if the cursor was tampered with or truncated
+    """
+    try:
+        cursor = str(cursor)
+        raw = base64.urlsafe_b64decode((cursor + '=' * (-len(cursor) % 4)).encode('ascii')).decode('ascii')
+        direction, submit_date, comment_id, page = raw.split('|')
+        if direction not in (NEXT, PREV):
+            raise ValueError(direction)
+        return (direction, datetime.datetime.strptime(submit_date, DATE_FORMAT), int(comment_id), max(1, int(page)))
+    except (TypeError, ValueError, UnicodeError, binascii.Error):
+        raise InvalidCursor(cursor)
+
+
+def seek(queryset, submit_date=None, comment_id=None, forward=True, limit=20):
+    """
+    Fetch up to ``limit`` comments strictly after (or before) the given
+    (submit_date, id) position. This is an index range scan, so its cost does
+    not depend on how deep into the bucket the position is.
+
+    :returns: tuple of (comments in ascending order, whether more comments
+        exist past the end of this page in the seek direction)
+    """
+    if submit_date is not None:
+        if forward:
+            queryset = queryset.filter(Q(submit_date__gt=submit_date) | Q(submit_date=submit_date, id__gt=comment_id))
+        else:
+            queryset = queryset.filter(Q(submit_date__lt=submit_date) | Q(submit_date=submit_date, id__lt=comment_id))
+
+    ordering = ('submit_date', 'id') if forward else ('-submit_date', '-id')
+    comments = list(queryset.order_by(*ordering)[:limit + 1])
+    has_more = len(comments) > limit
+    comments = comments[:limit]
+    if not forward:
+        comments.reverse()
+    return comments, has_more
@@ -0,0 +1,70 @@
+""" a small thread safe, size bounded, in-process LRU cache with per-entry expiry.
+"""
+import threading
+import time
+
+_PREV, _NEXT, _KEY, _VALUE, _EXPIRES = range(5)
+
+
+class LRUCache(object):
+    """
+    Least recently used cache. Entries are kept in a circular doubly linked
+    list so that lookups, inserts and evictions are all O(1).
+    """
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._map = {}
+            self._root = root = []
+            root[:] = [root, root, None, None, None]
+
+    def __len__(self):
+        return len(self._map)
+
+    def get(self, key, default=None):
+        with self._lock:
+            link = self._map.get(key)
+            if link is None:
+                return default
+            if link[_EXPIRES] is not None and link[_EXPIRES] <= time.time():
+                self._unlink(link)
+                del self._map[key]
+                return default
+            # move to the most recently used end
+            self._unlink(link)
+            self._append(link)
+            return link[_VALUE]
+
+    def set(self, key, value, timeout=None):
+        expires = time.time() + timeout if timeout is not None else None
+        with self._lock:
+            link = self._map.get(key)
+            if link is not None:
+                self._unlink(link)
+            elif len(self._map) >= self.max_size:
+                oldest = self._root[_NEXT]
+                self._unlink(oldest)
+                del self._map[oldest[_KEY]]
+            link = [None, None, key, value, expires]
+            self._append(link)
+            self._map[key] = link
+
+    def delete(self, key):
+        with self._lock:
+            link = self._map.pop(key, None)
+            if link is not None:
+                self._unlink(link)
+
+    def _unlink(self, link):
+        link[_PREV][_NEXT] = link[_NEXT]
+        link[_NEXT][_PREV] = link[_PREV]
+
+    def _append(self, link):
+        last = self._root[_PREV]
+        link[_PREV], link[_NEXT] = last, self._root
+        last[_NEXT] = self._root[_PREV] = link
@@ -7,7 +7,23 @@ class MockCache(object):
     def get(self, key, default=None):
         return self.cache.get(key)
     def delete(self, key):
-        del self.cache[key]
+        self.cache.pop(key, None)
     def delete_many(self, keys):
         for key in keys:
             self.delete(key)
+    def get_many(self, keys):
+        return dict((key, self.cache[key]) for key in keys if key in self.cache)
+    def set_many(self, data, expiration=None):
+        self.cache.update(data)
+    def add(self, key, value, expiration=None):
+        if key in self.cache:
+            return False
+        self.cache[key] = value
+        return True
+    def incr(self, key, delta=1):
+        if key not in self.cache:
+            raise ValueError("Key '%s' not found" % key)
+        self.cache[key] += delta
+        return self.cache[key]
+    def decr(self, key, delta=1):
+        return self.incr(key, -delta)
@@ -1,21 +1,26 @@
 """
 Comment Widget Views
 """
+import datetime
+import hashlib
+
 from django.conf import settings
-from django.contrib.contenttypes.models import ContentType
-from django.contrib.sites.models import Site
 from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
-from django.core.paginator import Paginator, EmptyPage
+from django.db.models import Q
+from django.views.decorators.http import condition
 
 from marimo.views.base import BaseWidget
 from marimo.template_loader import template_loader
 
-from marimo_comments import constants
-from marimo_comments.models import MarimoCommentBucket, MarimoComment
-from marimo_comments.util.ajax import ajax_auth_required, ajax_error, ajax_only, ajax_required_data, ajax_resp
-
-from sanitizer.templatetags.sanitizer import allowtags
+from marimo_comments import (caching, constants, fanout, history, markup, ratelimit, resolver, routers, serialization,
+                             snapshots, stats)
+from marimo_comments import search as comment_search
+from marimo_comments.models import (MarimoCommentBucket, MarimoComment, get_num_pages, get_page_for_position,
+                                    join_comment_url)
+from marimo_comments.util import cursors
+from marimo_comments.util.ajax import (ajax_auth_required, ajax_error, ajax_method, ajax_only, ajax_required_data,
+                                       ajax_resp, ajax_staff_required)
 
 
 class CommentsWidget(BaseWidget):
@@ -23,25 +28,31 @@ class CommentsWidget(BaseWidget):
 
     def cache_key(self, *args, **kwargs):
         """
-        There is nothing cacheable here: the content is either generated
-        from in memory variables or dependent on request.user.
+        The rendered widget depends on request.user, so it is never cached
+        whole. The comment pages themselves are cached per bucket
+        generation, see get_cached_comment_page.
         """
         return None
 
     def cacheable(self, response, *args, **kwargs):
         """
-        There is nothing cacheable here: the content is either generated
-        from in memory variables or dependent on request.user.
+        The rendered widget depends on request.user, so it is never cached
+        whole. The comment pages themselves are cached per bucket
+        generation, see get_cached_comment_page.
         """
         return response
 
+    @stats.instrument('widget')
     def uncacheable(self, request, response, *args, **kwargs):
         """
         Given a request for a page of comments for some object, collect all the
         information needed to render a marimo comments widget.
 
         Expects to find mandatory args ``[content_type_id, object_id]``
-        and an optional kwargs ``{site_id:123, page:321}``
+        and an optional kwargs ``{site_id:123, page:321, cursor:'...'}``. A
+        ``cursor`` (as handed out in ``next_cursor``/``prev_cursor``) seeks
+        straight to its page and takes precedence over ``page``, which is
+        kept for old permalinks.
 
         This results in response's context dictionary getting the following
         keys::
@@ -50,6 +61,9 @@ class CommentsWidget(BaseWidget):
             object_id
             site_id
             page
+            next_cursor (None on the last page)
+            prev_cursor (None on the first page)
+            frozen (no new comments are taken)
             comments (being a list, containing dicts with:
                 comment_href
                 poster
@@ -66,45 +80,22 @@ class CommentsWidget(BaseWidget):
         content_type_id = args[0]
         object_id = args[1]
         site_id = kwargs.get('site_id', settings.SITE_ID)
-        page = kwargs.get('page', 1)
+        page = max(1, int(kwargs.get('page', 1)))
+        cursor = kwargs.get('cursor')
 
-        ct = ContentType.objects.get(pk=content_type_id)
-        site = Site.objects.get(pk=site_id)
+        bucket_id = resolver.resolve_bucket_id(content_type_id, object_id, site_id)
 
         try:
-            bucket = MarimoCommentBucket.objects.get(content_type=ct, object_id=object_id, originating_site=site)
-            comments = MarimoComment.objects.select_related('user').filter(bucket=bucket)
-            pages = Paginator(comments, constants.COMMENTS_PER_PAGE)
-            try:
-                comments = pages.page(page).object_list
-            except EmptyPage:
-                # fall back to last page if page past end requested
-                comments = pages.page(pages.num_pages).object_list
+            if bucket_id is None:
+                raise MarimoCommentBucket.DoesNotExist
+            response['context'].update(get_cached_comment_page(bucket_id, page, cursor))
         except ObjectDoesNotExist:
-            bucket = None
-            comments = []
-
-        response['context']['comments'] = [{
-            # href of permalink to comment
-            'comment_href': c.get_absolute_url(page),
-            # screen_name or username of poster.
-            'poster': c.user.username,
-            # date comment was submitted
-            'submit_date': c.submit_date.strftime("%l:%M %p %b. %e, %Y").replace('AM', 'a.m.').replace('PM', 'p.m.'),
-            # date comment was submitted in timestamp
-            'submitted_ts': int(c.submit_date.strftime('%s')),
-            # text of comment
-            'text': c.text,
-            # comment's id for permalinking and other targeting
-            'comment_id': c.pk,
-        } for c in comments]
+            response['context'].update(get_empty_comment_page())
 
         # comment edit expiration (minutes)
         response['context']['edit_expiration'] = int(constants.EDIT_EXPIRATION)
         # number of comments per page
         response['context']['comments_per_page'] = int(constants.COMMENTS_PER_PAGE)
-        # current page, 1-indexed
-        response['context']['page'] = int(page)
         # used to reference in comment post form
         response['context']['content_type_id'] = content_type_id
         response['context']['object_id'] = object_id
@@ -112,24 +103,184 @@ class CommentsWidget(BaseWidget):
         # url to redirect to signin
         response['context']['redirect'] = settings.LOGIN_URL
 
-        (total_comments, total_pages) = get_page_and_comment_counts(content_type_id, object_id, site_id)
+        return response
+
+
+def get_cached_comment_page(bucket_id, page=1, cursor=None):
+    """
+    get_comment_page, cached under the bucket's current generation. Any
+    change to the bucket's comments bumps the generation, which orphans every
+    cached page of the bucket at once without having to find or delete them.
+    Readers pinned to the primary after posting rebuild the page, and
+    everybody builds it from the primary while replicas may still be behind
+    the latest generation bump, see routers.py. The content object's url is
+    joined onto the permalinks as the page is served, see add_content_url.
+
+    :raises ObjectDoesNotExist: if the bucket or its content object is gone
+    """
+    if cursor:
+        # keyed on the re-encoded cursor, never on what the client sent
+        try:
+            cursor = cursors.encode_cursor(*cursors.decode_cursor(cursor))
+        except cursors.InvalidCursor:
+            (cursor, page) = (None, 1)
+    (generation, bumped) = caching.get_generation_state(bucket_id)
+    if not cursor and page > 1:
+        # pages past the end are the last page; one cache entry for all of them
+        page = min(page, caching.get_or_set(caching.page_count_key(bucket_id, generation),
+                                            lambda: get_bucket_num_pages(bucket_id, bumped),
+                                            constants.PAGE_CACHE_TIMEOUT, refresh=routers.is_pinned()))
+    cache_key = caching.page_key(bucket_id, generation, ('c' + cursor) if cursor else page)
+
+    def build():
+        with routers.reading_primary(bumped):
+            bucket = MarimoCommentBucket.objects.get(pk=bucket_id)
+            content = (bucket.content_type_id, bucket.object_id)
+            if bucket.is_frozen:
+                context = snapshots.get_snapshot_page(bucket, page, cursor)
+                if context is not None:
+                    return (content, context)
+            return (content, get_comment_page(bucket, page, cursor))
+
+    (content, context) = caching.get_or_set(cache_key, build, constants.PAGE_CACHE_TIMEOUT,
+                                            refresh=routers.is_pinned())
+    return dict(context, comments=add_content_url(context['comments'], *content))
+
+
+def add_content_url(comments, content_type_id, object_id):
+    """
+    Cached pages, ``since`` answers and snapshots hold only the part of each
+    ``comment_href`` after the content object's url. The url is cached on
+    its own (resolver.get_content_object_url) and joined on here, so a page
+    never outlives a change of url by more than that cache entry does.
+
+    :raises ObjectDoesNotExist: if the content object is gone
+    """
+    if not comments:
+        return comments
+    burl = resolver.get_content_object_url(content_type_id, object_id)
+    return [dict(comment, comment_href=join_comment_url(burl, comment['comment_href'])) for comment in comments]
+
+
+def get_bucket_num_pages(bucket_id, primary=False):
+    """
+    :raises MarimoCommentBucket.DoesNotExist: if the bucket is gone
+    """
+    with routers.reading_primary(primary):
+        return get_num_pages(MarimoCommentBucket.objects.only('comment_count').get(pk=bucket_id).comment_count)
+
 
+def get_empty_comment_page():
+    """ what get_comment_page returns for content that has no comments """
+    return {
+        'comments': [],
+        'page': 1,
+        'next_cursor': None,
+        'prev_cursor': None,
+        'total_comments': 0,
+        'num_pages': 1,
+        'frozen': False,
+    }
+
+
+def get_comment_page(bucket, page=1, cursor=None):
+    """
+    Build the user independent part of the widget's context for one page of
+    a bucket's comments: ``comments``, ``page``, ``next_cursor``,
+    ``prev_cursor``, ``total_comments``, ``num_pages`` and ``frozen``.
+
+    Pages are ranges of positions (see MarimoComment.position), read through
+    the (bucket, position) index; cursors seek from the position their
+    comment has now, so both agree on what is on a page. Buckets with
+    visible comments that have no position yet are paged in
+    (submit_date, id) order with OFFSET until backfill_comment_positions
+    numbers them.
+
+    Permalinks are left without the content object's url, see add_content_url.
+    """
+    (total_comments, total_pages) = bucket.get_page_and_comment_counts()
+    visible = MarimoComment.objects.filter(bucket=bucket, is_removed=False)
+    comments = serialization.comment_rows(visible)
+    per_page = constants.COMMENTS_PER_PAGE
+    next_cursor = prev_cursor = None
+
+    direction = None
+    if cursor:
+        try:
+            (direction, submit_date, comment_id, page) = cursors.decode_cursor(cursor)
+        except cursors.InvalidCursor:
+            page = 1
+    # fall back to last page if page past end requested
+    page = min(page, total_pages)
+
+    if visible.filter(position__isnull=True).exists():
+        if direction is None:
+            comments = serialization.to_rows(comments.order_by('submit_date', 'id')[(page - 1) * per_page:
+                                                                                    page * per_page])
+            has_next, has_prev = page < total_pages, page > 1
+        else:
+            forward = direction == cursors.NEXT
+            comments, has_more = cursors.seek(comments, submit_date, comment_id, forward, per_page)
+            comments = serialization.to_rows(comments)
+            # we arrived from a neighbouring page, so there is one in the opposite direction
+            has_next, has_prev = (has_more, True) if forward else (True, has_more)
+            has_prev = has_prev and page > 1
+    else:
+        (start, end) = ((page - 1) * per_page + 1, page * per_page)
+        if direction is not None:
+            anchor = list(visible.filter(pk=comment_id).values_list('position', flat=True))
+            # a cursor whose comment is gone leads to the page it was labelled with
+            if anchor and direction == cursors.NEXT:
+                (start, end) = (anchor[0] + 1, anchor[0] + per_page)
+            elif anchor:
+                (start, end) = (max(1, anchor[0] - per_page), anchor[0] - 1)
+        comments = serialization.to_rows(comments.filter(position__gte=start, position__lte=end).order_by('position'))
+        if comments:
+            page = get_page_for_position(comments[0].position)
+        has_next = bool(comments) and comments[-1].position < total_comments
+        has_prev = bool(comments) and comments[0].position > 1
+
+    if comments and has_next:
+        last = comments[-1]
+        next_cursor = cursors.encode_cursor(cursors.NEXT, last.submit_date, last.pk, page + 1)
+    if comments and has_prev:
+        first = comments[0]
+        prev_cursor = cursors.encode_cursor(cursors.PREV, first.submit_date, first.pk, page - 1)
+
+    comment_hrefs = bucket.get_comment_fragments(comments, page)
+
+    return {
+        'comments': serialization.serialize_comments(comments, comment_hrefs),
+        # current page, 1-indexed
+        'page': page,
+        # opaque cursors for seeking to the neighbouring pages
+        'next_cursor': next_cursor,
+        'prev_cursor': prev_cursor,
         # total number of comments
-        response['context']['total_comments'] = total_comments
+        'total_comments': total_comments,
         # total pages (also last page since 1 indexed)
-        response['context']['num_pages'] = total_pages
-
-        return response
+        'num_pages': total_pages,
+        # frozen buckets don't take new comments
+        'frozen': bucket.is_frozen,
+    }
 
 
 @ajax_only
 @ajax_auth_required
 @ajax_required_data(['text', 'content_type_id', 'object_id', 'site_id'])
+@stats.instrument('post')
 def post(request):
     """
     Add comment for current user. Update and recache
     comments. Response contains new comment's id and page.
+    Posters over their rate limit get a 429 before any database work.
+    The new comment is pushed to live viewers if fanout is configured.
     """
+    wait = ratelimit.check_post(request)
+    if wait:
+        response = ajax_error(429, 'rate_limited')
+        response['Retry-After'] = str(wait)
+        return response
 
     text = request.POST['text']
     content_type_id = int(request.POST['content_type_id'])
@@ -137,49 +288,321 @@ def post(request):
     site_id = int(request.POST['site_id'])
     ip_address = request.META.get('REMOTE_ADDR', None)
 
-    bucket, created = MarimoCommentBucket.objects.get_or_create(
-        content_type_id=content_type_id, object_id=object_id, originating_site_id=site_id)
-
-    text = allowtags(text, 'b br')
-    text = text.replace('<br />', '\n')
+    # a frozen bucket is turned away on a read, before anything is written
+    bucket = None
+    bucket_id = resolver.resolve_bucket_id(content_type_id, object_id, site_id)
+    if bucket_id is not None:
+        try:
+            bucket = MarimoCommentBucket.objects.get(pk=bucket_id)
+        except MarimoCommentBucket.DoesNotExist:
+            # the cached id outlived its bucket
+            resolver.forget_bucket(content_type_id, object_id, site_id)
+    if bucket is None:
+        bucket, created = MarimoCommentBucket.objects.get_or_create(
+            content_type_id=content_type_id, object_id=object_id, originating_site_id=site_id)
+        if created:
+            resolver.bucket_created(bucket)
+    if bucket.is_frozen:
+        return ajax_error(403, 'comments_frozen')
+
+    text = clean_comment_text(text)
 
     comment = MarimoComment.objects.create(bucket=bucket, user=request.user, text=text, ip_address=ip_address)
 
     update_count_cache(content_type_id, object_id, site_id)
 
-    comments = MarimoComment.objects.filter(bucket=bucket)
-    num_pages = Paginator(comments, constants.COMMENTS_PER_PAGE).num_pages
+    page = comment.get_page_number()
+    if fanout.enabled():
+        row = serialization.CommentRow(comment.pk, request.user.username, text, comment.submit_date, comment.position)
+        fanout.publish(bucket.pk, serialization.serialize_comments([row], bucket.get_comment_urls([row], page))[0])
 
     return ajax_resp(200, {
         'cid': comment.id,
-        'cpage': num_pages,
+        'cpage': page,
     })
 
 
+def clean_comment_text(text):
+    """ strip all markup from comment text but <b>; <br> becomes a newline """
+    if constants.LEGACY_SANITIZER:
+        from sanitizer.templatetags.sanitizer import allowtags
+        return allowtags(text, 'b br').replace('<br />', '\n')
+    return markup.clean_comment_text(text)
+
+
+def _feed_bucket_state(request, content_type_id, object_id, site_id):
+    """
+    ``(bucket_id, last_modified)`` of the feed's bucket, looked up once per
+    request. Bucket resolution is cached, so this is at most a primary key
+    lookup on the bucket table.
+    """
+    if not hasattr(request, '_marimo_feed_state'):
+        bucket_id = resolver.resolve_bucket_id(content_type_id, object_id, site_id)
+        last_modified = None
+        if bucket_id is not None:
+            rows = list(MarimoCommentBucket.objects.filter(pk=bucket_id).values_list('last_modified', flat=True))
+            last_modified = rows[0] if rows else None
+        request._marimo_feed_state = (bucket_id, last_modified)
+    return request._marimo_feed_state
+
+
+def _feed_etag(request, content_type_id, object_id, site_id):
+    bucket_id, last_modified = _feed_bucket_state(request, content_type_id, object_id, site_id)
+    version = last_modified.strftime('%Y%m%d%H%M%S%f') if last_modified else ''
+    page = request.GET.get('cursor') or request.GET.get('page', '1')
+    # the permalinks change with the content object's url, see add_content_url
+    burl = ''
+    if bucket_id is not None:
+        try:
+            burl = resolver.get_content_object_url(int(content_type_id), int(object_id))
+        except ObjectDoesNotExist:
+            pass
+    return hashlib.md5((u'%s:%s:%s:%s' % (bucket_id, version, page, burl)).encode('utf-8')).hexdigest()
+
+
+def _feed_last_modified(request, content_type_id, object_id, site_id):
+    return _feed_bucket_state(request, content_type_id, object_id, site_id)[1]
+
+
+@ajax_method('GET')
+@stats.instrument('feed')
+@condition(etag_func=_feed_etag, last_modified_func=_feed_last_modified)
+def feed(request, content_type_id, object_id, site_id):
+    """
+    JSON feed of an object's comments, one page per request. Takes the same
+    ``page`` or ``cursor`` query parameters as the widget and returns the same
+    keys as get_comment_page; clients walk the feed with ``next_cursor``.
+
+    ETag and Last-Modified come from the bucket's ``last_modified`` (and the
+    ETag from the content object's url too), so a poll with nothing new is
+    answered with a 304 Not Modified without touching the comments table.
+    """
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        return ajax_error(400, 'bad_page')
+    cursor = request.GET.get('cursor')
+    if cursor:
+        try:
+            cursors.decode_cursor(cursor)
+        except cursors.InvalidCursor:
+            return ajax_error(400, 'bad_cursor')
+
+    bucket_id = _feed_bucket_state(request, content_type_id, object_id, site_id)[0]
+    try:
+        if bucket_id is None:
+            raise MarimoCommentBucket.DoesNotExist
+        payload = get_cached_comment_page(bucket_id, page, cursor)
+    except ObjectDoesNotExist:
+        payload = get_empty_comment_page()
+
+    return ajax_resp(200, payload)
+
+
+@ajax_method('GET')
+@stats.instrument('since')
+def since(request, content_type_id, object_id, site_id):
+    """
+    JSON list of an object's comments newer than the last one a client has
+    seen, for live pages polling for new comments. Takes either ``after_id``
+    (a comment_id) or ``after_ts`` (a submitted_ts; second resolution, so a
+    comment may be returned again, clients should dedupe on comment_id).
+
+    Returns ``comments`` (oldest first, at most COMMENTS_PER_PAGE of them),
+    ``has_more`` if there are more after those, and ``after_id`` to poll with
+    next. Answers are cached per bucket generation, so polling a bucket
+    nothing was posted to costs two cache reads.
+    """
+    try:
+        if 'after_id' in request.GET:
+            (field, after) = ('id', int(request.GET['after_id']))
+            since_after = after
+        else:
+            (field, after) = ('ts', int(request.GET['after_ts']))
+            # raises for timestamps out of the platform's range
+            since_after = datetime.datetime.fromtimestamp(after)
+    except (KeyError, ValueError, OverflowError, OSError):
+        return ajax_error(400, 'bad_after')
+
+    bucket_id = resolver.resolve_bucket_id(content_type_id, object_id, site_id)
+    if bucket_id is None:
+        payload = None
+    else:
+        (generation, bumped) = caching.get_generation_state(bucket_id)
+        cache_key = caching.since_key(bucket_id, generation, field, after)
+
+        def build():
+            with routers.reading_primary(bumped):
+                return get_comments_since(bucket_id, field, since_after)
+
+        try:
+            payload = caching.get_or_set(cache_key, build, constants.PAGE_CACHE_TIMEOUT, refresh=routers.is_pinned())
+            payload = dict(payload, comments=add_content_url(payload['comments'], int(content_type_id),
+                                                             int(object_id)))
+        except ObjectDoesNotExist:
+            payload = None
+    if payload is None:
+        payload = {'comments': [], 'has_more': False, 'after_id': after if field == 'id' else None}
+    return ajax_resp(200, payload)
+
+
+def get_comments_since(bucket_id, field, after):
+    """
+    Build the ``since`` payload: the bucket's comments after comment id
+    ``after`` (``field`` 'id', a range scan on the (bucket, id) index), or
+    submitted after datetime ``after`` (``field`` 'ts', on the
+    (bucket, submit_date, id) index). Permalinks are left without the
+    content object's url, see add_content_url.
+
+    :raises MarimoCommentBucket.DoesNotExist: if the bucket is gone
+    """
+    comments = MarimoComment.objects.filter(bucket=bucket_id, is_removed=False)
+    if field == 'id':
+        comments = comments.filter(id__gt=after).order_by('id')
+    else:
+        comments = comments.filter(submit_date__gt=after).order_by(
+            'submit_date', 'id')
+    limit = constants.COMMENTS_PER_PAGE
+    rows = serialization.to_rows(serialization.comment_rows(comments)[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    hrefs = []
+    if rows:
+        bucket = MarimoCommentBucket.objects.get(pk=bucket_id)
+        # only comments without a position fall back to this page number
+        hrefs = bucket.get_comment_fragments(rows, get_num_pages(bucket.comment_count))
+    return {
+        'comments': serialization.serialize_comments(rows, hrefs),
+        'has_more': has_more,
+        'after_id': max(row.pk for row in rows) if rows else (after if field == 'id' else None),
+    }
+
+
+@ajax_method('GET')
+@ajax_staff_required
+@stats.instrument('search')
+def search(request):
+    """
+    Full-text search over comment text for moderators, see search.py. Takes
+    ``q`` and an optional ``page``; returns ``comments`` (best match first,
+    hidden ones included), ``page`` and ``has_more``.
+    """
+    if not constants.SEARCH_ENABLED:
+        return ajax_error(404, 'search_disabled')
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        return ajax_error(400, 'bad_page')
+    if not query:
+        return ajax_error(400, 'bad_query')
+
+    (comments, has_more) = comment_search.search_comments(query, page)
+    return ajax_resp(200, {
+        'comments': [{
+            'comment_id': comment.pk,
+            'bucket_id': comment.bucket_id,
+            'poster': comment.user.username if comment.user_id else None,
+            'submit_date': serialization.format_submit_date(comment.submit_date),
+            'submitted_ts': serialization.timestamp(comment.submit_date),
+            'text': comment.text,
+            'ip_address': comment.ip_address,
+            'is_removed': comment.is_removed,
+        } for comment in comments],
+        'page': page,
+        'has_more': has_more,
+    })
+
+
+@ajax_method('GET')
+@stats.instrument('history')
+def user_history(request, user_id):
+    """
+    JSON list of a user's comments across all content, newest first, for
+    profile pages; see history.py. Takes an optional ``cursor`` (a
+    ``next_cursor`` or ``prev_cursor`` of an earlier answer) and ``site_id``
+    to keep to one site's content.
+    """
+    try:
+        site_id = int(request.GET['site_id']) if 'site_id' in request.GET else None
+    except ValueError:
+        return ajax_error(400, 'bad_site')
+    try:
+        payload = history.get_user_history(int(user_id), request.GET.get('cursor'), site_id)
+    except cursors.InvalidCursor:
+        return ajax_error(400, 'bad_cursor')
+    return ajax_resp(200, payload)
+
+
 def get_page_and_comment_counts(content_type_id, object_id, site_id):
     """ reusable method to get the total comment count and page count """
-    cache_key = 'medley_comments:%s:%s:%s' % (content_type_id, object_id, site_id)
-    packed = cache.get(cache_key)
-    if not packed:
-        packed = update_count_cache(content_type_id, object_id, site_id)
+    return caching.get_or_set(caching.count_key(content_type_id, object_id, site_id),
+                              lambda: _read_counts(content_type_id, object_id, site_id),
+                              settings.SHORT_CACHE_TIMEOUT)
 
-    return packed
 
+def get_bulk_page_and_comment_counts(keys):
+    """
+    Bulk version of get_page_and_comment_counts for listing pages.
 
+    :param keys: iterable of ``(content_type, object_id, site)`` tuples, where
+        content type and site may be ids or model instances
+    :returns: dict mapping each ``(content_type_id, object_id, site_id)`` to a
+        ``(total_comments, total_pages)`` tuple
+    """
+    keys = [tuple(int(getattr(part, 'pk', part)) for part in key) for key in keys]
+    cache_keys = dict((caching.count_key(*key), key) for key in keys)
+
+    counts = {}
+    for cache_key, packed in cache.get_many(cache_keys.keys()).items():
+        # stale entries are simply refreshed along with the misses
+        packed = caching.unpack(packed)
+        if packed is not None:
+            counts[cache_keys[cache_key]] = tuple(packed)
+            stats.cache_hit('counts')
+
+    missing = [key for key in keys if key not in counts]
+    for key in missing:
+        stats.cache_miss('counts')
+    if missing:
+        # one query for all misses: group the object ids by (content type, site)
+        grouped = {}
+        for (content_type_id, object_id, site_id) in missing:
+            grouped.setdefault((content_type_id, site_id), []).append(object_id)
+        query = Q()
+        for (content_type_id, site_id), object_ids in grouped.items():
+            query |= Q(content_type=content_type_id, originating_site=site_id, object_id__in=object_ids)
+
+        found = {}
+        rows = MarimoCommentBucket.objects.filter(query).values_list(
+            'content_type', 'object_id', 'originating_site', 'comment_count')
+        for (content_type_id, object_id, site_id, total_comments) in rows:
+            found[(content_type_id, object_id, site_id)] = (total_comments, get_num_pages(total_comments))
+
+        fresh = {}
+        for key in missing:
+            counts[key] = fresh[caching.count_key(*key)] = found.get(key, (0, 1))
+        caching.store_many(fresh, settings.SHORT_CACHE_TIMEOUT)
+
+    return counts
+
+
+@stats.instrument('counts.update')
 def update_count_cache(content_type_id, object_id, site_id):
     """ update the comment and page counts in cache """
+    packed = _read_counts(content_type_id, object_id, site_id)
+    caching.store(caching.count_key(content_type_id, object_id, site_id), packed, settings.SHORT_CACHE_TIMEOUT)
+    return packed
+
+
+def _read_counts(content_type_id, object_id, site_id):
+    """
+    The comment and page counts from the database. They come from the
+    bucket's denormalized counter, so this is a single row read.
+    """
     try:
         bucket = MarimoCommentBucket.objects.get(content_type__id=content_type_id, object_id=object_id, originating_site__id=site_id)
-        comments = MarimoComment.objects.filter(bucket=bucket)
-        pages = Paginator(comments, constants.COMMENTS_PER_PAGE)
-
-        total_comments = comments.count()
-        total_pages = pages.num_pages
+        return bucket.get_page_and_comment_counts()
     except ObjectDoesNotExist:
-        total_comments = 0
-        total_pages = 1
-
-    packed = (total_comments, total_pages)
-    cache_key = 'marimo_comments:%s:%s:%s' % (content_type_id, object_id, site_id)
-    cache.set(cache_key, packed, settings.SHORT_CACHE_TIMEOUT)
-    return packed
+        return (0, 1)